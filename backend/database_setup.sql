@@ -117,3 +117,136 @@ create table conversations (
 );
 
 
+
+-- Bảng 6: Lưu từng tin nhắn của session theo kiểu append-only (thay cho mảng JSON 'messages')
+ALTER TABLE conversation_sessions ADD COLUMN IF NOT EXISTS messages JSONB DEFAULT '[]'::jsonb;
+ALTER TABLE conversation_sessions ADD COLUMN IF NOT EXISTS lesson_id TEXT;
+
+CREATE TABLE IF NOT EXISTS session_messages (
+    session_id UUID NOT NULL REFERENCES conversation_sessions(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT,
+    type TEXT,
+    metadata JSONB DEFAULT '{}'::jsonb,
+    timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (session_id, seq)
+);
+
+ALTER TABLE session_messages DISABLE ROW LEVEL SECURITY;
+
+-- Ghi một lô tin nhắn vào session trong MỘT round trip.
+-- - Khóa dòng session để cấp số thứ tự (seq) liên tục, không trùng.
+-- - Session cũ còn dữ liệu trong mảng JSON 'messages' sẽ được chuyển sang
+--   session_messages ở lần ghi đầu tiên (migrate trong suốt), sau đó mảng được làm rỗng.
+CREATE OR REPLACE FUNCTION append_session_messages(p_session_id UUID, p_messages JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_legacy JSONB;
+    v_next INTEGER;
+BEGIN
+    SELECT messages, COALESCE(total_messages, 0)
+      INTO v_legacy, v_next
+      FROM conversation_sessions
+     WHERE id = p_session_id
+       FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Session % not found', p_session_id;
+    END IF;
+
+    IF v_legacy IS NOT NULL AND jsonb_typeof(v_legacy) = 'array' AND jsonb_array_length(v_legacy) > 0 THEN
+        INSERT INTO session_messages (session_id, seq, role, text, type, metadata)
+        SELECT p_session_id, m.ord - 1, m.value->>'role', m.value->>'text', m.value->>'type',
+               COALESCE(m.value->'metadata', '{}'::jsonb)
+          FROM jsonb_array_elements(v_legacy) WITH ORDINALITY AS m(value, ord)
+        ON CONFLICT (session_id, seq) DO NOTHING;
+        v_next := GREATEST(v_next, jsonb_array_length(v_legacy));
+    END IF;
+
+    INSERT INTO session_messages (session_id, seq, role, text, type, metadata)
+    SELECT p_session_id, v_next + m.ord - 1, m.value->>'role', m.value->>'text', m.value->>'type',
+           COALESCE(m.value->'metadata', '{}'::jsonb)
+      FROM jsonb_array_elements(COALESCE(p_messages, '[]'::jsonb)) WITH ORDINALITY AS m(value, ord);
+
+    v_next := v_next + jsonb_array_length(COALESCE(p_messages, '[]'::jsonb));
+
+    UPDATE conversation_sessions
+       SET total_messages = v_next,
+           messages = '[]'::jsonb
+     WHERE id = p_session_id;
+
+    RETURN v_next;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Danh sách session nhẹ cho sidebar lịch sử: chỉ các cột hiển thị, KHÔNG kèm nội dung tin nhắn.
+-- message_count lấy từ total_messages (session cũ chưa migrate thì đếm mảng JSON 'messages').
+CREATE OR REPLACE VIEW conversation_session_list AS
+SELECT
+    id,
+    user_id,
+    topic,
+    mode,
+    level,
+    lesson_id,
+    created_at,
+    GREATEST(
+        COALESCE(total_messages, 0),
+        CASE WHEN jsonb_typeof(messages) = 'array' THEN jsonb_array_length(messages) ELSE 0 END
+    ) AS message_count,
+    (ai_feedback_summary IS NOT NULL) AS has_summary
+FROM conversation_sessions;
+
+-- Phục vụ keyset pagination theo created_at cho từng user
+CREATE INDEX IF NOT EXISTS idx_conversation_sessions_user_created
+    ON conversation_sessions (user_id, created_at DESC);
+
+-- Rolling summary ngữ cảnh cho session dài: tóm tắt các tin nhắn có seq < context_summary_seq
+ALTER TABLE conversation_sessions ADD COLUMN IF NOT EXISTS context_summary TEXT;
+ALTER TABLE conversation_sessions ADD COLUMN IF NOT EXISTS context_summary_seq INTEGER DEFAULT 0;
+
+-- Thống kê từ vựng của user theo từng bộ từ trong MỘT truy vấn gộp:
+-- learning / mastered theo status, review_today = số từ đến hạn ôn (next_review_date <= p_today).
+-- p_deck_id = NULL -> trả về mọi bộ từ của user (mỗi bộ 1 dòng, từ không thuộc bộ nào có deck_id NULL).
+-- p_today do backend truyền (ngày UTC) để khớp với lịch ôn tính trong services/vocabulary.
+CREATE INDEX IF NOT EXISTS idx_user_vocabulary_user_deck ON "UserVocabulary" (user_id, deck_id);
+
+CREATE OR REPLACE FUNCTION get_deck_vocab_stats(
+    p_user_id UUID,
+    p_deck_id BIGINT DEFAULT NULL,
+    p_today DATE DEFAULT (NOW() AT TIME ZONE 'utc')::date
+)
+RETURNS TABLE (deck_id BIGINT, learning INTEGER, mastered INTEGER, review_today INTEGER) AS $$
+    SELECT
+        uv.deck_id::BIGINT,
+        COUNT(*) FILTER (WHERE uv.status = 'learning')::INTEGER,
+        COUNT(*) FILTER (WHERE uv.status = 'mastered')::INTEGER,
+        COUNT(*) FILTER (WHERE uv.next_review_date <= p_today)::INTEGER
+      FROM "UserVocabulary" uv
+     WHERE uv.user_id = p_user_id
+       AND (p_deck_id IS NULL OR uv.deck_id = p_deck_id)
+     GROUP BY uv.deck_id;
+$$ LANGUAGE sql STABLE;
+
+-- Số session của nhiều user trong MỘT truy vấn gộp (trang danh sách user của admin, crud.loaders).
+CREATE INDEX IF NOT EXISTS idx_conversation_sessions_user ON conversation_sessions (user_id);
+
+CREATE OR REPLACE FUNCTION count_sessions_by_user(p_user_ids UUID[])
+RETURNS TABLE (user_id UUID, session_count INTEGER) AS $$
+    SELECT s.user_id, COUNT(*)::INTEGER
+      FROM conversation_sessions s
+     WHERE s.user_id = ANY(p_user_ids)
+     GROUP BY s.user_id;
+$$ LANGUAGE sql STABLE;
+
+-- Số từ của nhiều bộ từ công cộng trong MỘT truy vấn gộp (trang quản lý PublicDecks, crud.loaders).
+CREATE INDEX IF NOT EXISTS idx_public_words_deck ON "PublicWords" (deck_id);
+
+CREATE OR REPLACE FUNCTION count_public_words_by_deck(p_deck_ids BIGINT[])
+RETURNS TABLE (deck_id BIGINT, word_count INTEGER) AS $$
+    SELECT w.deck_id::BIGINT, COUNT(*)::INTEGER
+      FROM "PublicWords" w
+     WHERE w.deck_id = ANY(p_deck_ids)
+     GROUP BY w.deck_id;
+$$ LANGUAGE sql STABLE;
@@ -1,6 +1,8 @@
 # fastapi_app/crud/admin_content.py
 from typing import List, Dict, Any, Optional
 
+from . import loaders
+
 # Tên bảng trong DB (Hãy đảm bảo tên bảng đúng với DB của bạn)
 TABLE_DECKS = 'PublicDecks'
 TABLE_VOCAB = 'PublicWords' # Hoặc 'vocabularies' tuỳ bạn đặt
@@ -16,9 +18,9 @@ def get_all_decks(db: Any, search: Optional[str] = None) -> List[Dict[str, Any]]
         decks = response.data
         
         # Đếm số từ trong mỗi deck (Optional - nếu cần hiển thị)
+        word_counts = loaders.public_word_counts_by_deck(db, [deck['id'] for deck in decks])
         for deck in decks:
-            count_res = db.from_(TABLE_VOCAB).select("*", count='exact').eq("deck_id", deck['id']).execute()
-            deck['word_count'] = count_res.count if count_res.count else 0
+            deck['word_count'] = word_counts.get(deck['id'], 0)
             
         return decks
     except Exception as e:
@@ -1,4 +1,5 @@
 from typing import List, Dict, Any, Optional
+from .scenarios import invalidate_scenario_cache
 
 TABLE_SCENARIOS = 'scenarios'
 TABLE_DIALOGUES = 'dialogue_lines'
@@ -40,6 +41,7 @@ def create_scenario(db: Any, data: dict) -> Dict[str, Any]:
             dialogue_payload = [{**d, "scenario_id": scenario_id} for d in dialogues]
             db.from_(TABLE_DIALOGUES).insert(dialogue_payload).execute()
             
+        invalidate_scenario_cache(scenario_id)
         return new_scenario
     except Exception as e:
         print(f"DB Error (create_scenario): {e}")
@@ -51,6 +53,7 @@ def delete_scenario(db: Any, scenario_id: str) -> bool:
         db.from_(TABLE_DIALOGUES).delete().eq("scenario_id", scenario_id).execute()
         # Xóa scenario
         res = db.from_(TABLE_SCENARIOS).delete().eq("id", scenario_id).execute()
+        invalidate_scenario_cache(scenario_id)
         return True if res.data else False
     except Exception as e:
         return False
@@ -62,6 +65,7 @@ def update_scenario(db: Any, scenario_id: str, data: dict) -> Dict[str, Any]:
         
         # 2. Cập nhật thông tin chính (Title, Topic, Level)
         update_res = db.from_(TABLE_SCENARIOS).update(data).eq("id", scenario_id).execute()
+        invalidate_scenario_cache(scenario_id)
         if not update_res.data:
             return None
             
@@ -76,6 +80,7 @@ def update_scenario(db: Any, scenario_id: str, data: dict) -> Dict[str, Any]:
             # Thêm mới
             dialogue_payload = [{**d, "scenario_id": scenario_id} for d in dialogues]
             db.from_(TABLE_DIALOGUES).insert(dialogue_payload).execute()
+            invalidate_scenario_cache(scenario_id)
             
         # 4. Trả về data mới nhất kèm dialogues
         # (Để frontend cập nhật ngay lập tức mà không cần reload)
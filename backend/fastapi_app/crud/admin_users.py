@@ -1,6 +1,8 @@
 from typing import List, Dict, Any, Optional
 from postgrest.base_request_builder import SingleAPIResponse
 from ..schemas.admin import AdminUserUpdate, UpdateUserStatus, UpdateUserRole 
+from ..utils import profile_cache
+from . import loaders
 
 # Tên bảng chính xác trong Supabase
 USER_PROFILES_TABLE = 'profiles' 
@@ -25,9 +27,10 @@ def get_all_user_details(db: Any, search_query: Optional[str] = None) -> List[Di
         user_data = response.data
         
         # 4. Lấy session count (Logic giữ nguyên)
+        # (1 truy vấn gộp cho cả trang thay vì 1 truy vấn / user)
+        session_counts = loaders.session_counts_by_user(db, [user['id'] for user in user_data])
         for user in user_data:
-            session_resp = db.from_('conversation_sessions').select('*', count='exact').eq("user_id", user['id']).execute()
-            user['session_count'] = session_resp.count if session_resp.count is not None else 0
+            user['session_count'] = session_counts.get(user['id'], 0)
             
         return user_data
     except Exception as e:
@@ -37,12 +40,31 @@ def get_all_user_details(db: Any, search_query: Optional[str] = None) -> List[Di
 def update_user_status_in_db(db: Any, user_id: str, new_status: UpdateUserStatus) -> SingleAPIResponse:
     if new_status.status not in ["active", "blocked"]:
         raise ValueError("Invalid status value.")
-    return db.from_(USER_PROFILES_TABLE).update({'status': new_status.status}).eq('id', user_id).execute()
+    response = db.from_(USER_PROFILES_TABLE).update({'status': new_status.status}).eq('id', user_id).execute()
+    profile_cache.invalidate(user_id)
+    return response
 
 def update_user_role_in_db(db: Any, user_id: str, new_role: UpdateUserRole) -> SingleAPIResponse:
     if new_role.role not in ["admin", "user"]:
         raise ValueError("Invalid role value.")
-    return db.from_(USER_PROFILES_TABLE).update({'role': new_role.role}).eq('id', user_id).execute()
+    response = db.from_(USER_PROFILES_TABLE).update({'role': new_role.role}).eq('id', user_id).execute()
+    profile_cache.invalidate(user_id)
+    return response
+
+def get_user_access(db: Any, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Role + status của user cho kiểm tra quyền, qua cache (utils/profile_cache.py).
+    Trả về None nếu không có profile. Lỗi DB được raise cho caller.
+    """
+    access = profile_cache.get(user_id)
+    if access is not None:
+        return access
+    response = db.from_(USER_PROFILES_TABLE).select("role, status").eq("id", user_id).limit(1).execute()
+    if not response.data:
+        return None
+    access = response.data[0]
+    profile_cache.put(user_id, access)
+    return access
 
 def get_user_by_id(db: Any, user_id: str) -> Dict[str, Any]:
     try:
@@ -53,8 +75,7 @@ def get_user_by_id(db: Any, user_id: str) -> Dict[str, Any]:
         user = response.data
         if user:
             # Lấy thêm session count
-            session_resp = db.from_('conversation_sessions').select('*', count='exact').eq("user_id", user_id).execute()
-            user['session_count'] = session_resp.count if session_resp.count is not None else 0
+            user['session_count'] = loaders.session_counts_by_user(db, [user_id]).get(user_id, 0)
             
         return user
     except Exception as e:
@@ -76,6 +97,7 @@ def delete_user_in_db(db: Any, user_id: str) -> bool:
 
         # BƯỚC 2: Xóa Profile (Dữ liệu cha)
         response = db.from_(USER_PROFILES_TABLE).delete().eq("id", user_id).execute()
+        profile_cache.invalidate(user_id)
         
         # Kiểm tra xem có xóa được dòng nào không
         if response.data:
@@ -115,9 +137,9 @@ def get_session_messages(db: Any, session_id: str) -> List[Dict[str, Any]]:
         response = db.from_('session_messages')\
             .select("role, text, type, metadata, timestamp")\
             .eq("session_id", session_id)\
-            .order("timestamp", desc=False)\
+            .order("seq", desc=False)\
             .execute()
-            # SỬA: 'ascending=True' thành 'desc=False' (hoặc bỏ order nếu mặc định)
+            # Thứ tự tin nhắn theo seq (append-only)
             
         return response.data
     except Exception as e:
@@ -149,6 +171,7 @@ def update_user_in_db(db: Any, user_id: str, update_data: AdminUserUpdate) -> Di
             .update(data_to_update)\
             .eq("id", user_id)\
             .execute()
+        profile_cache.invalidate(user_id)
             
         # Trả về dữ liệu sau khi update (nếu thành công)
         if response.data:
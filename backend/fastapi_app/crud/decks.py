@@ -1,7 +1,7 @@
 from fastapi import HTTPException, status
 from fastapi_app import schemas
 from fastapi_app.database import db_client
-from . import vocabulary as vocab_crud 
+from . import loaders
 
 def create_deck_for_user(deck_data: schemas.DeckCreate, user_id: str):
     """Tạo một bộ từ (Deck) mới cho người dùng."""
@@ -28,20 +28,15 @@ def get_all_decks_with_stats(user_id: str):
             .eq("user_id", user_id).order("created_at", desc=True).execute()
         
         decks_data = decks_response.data
-        decks_with_stats = []
 
-        # Lặp qua từng bộ từ để lấy thống kê
-        for deck in decks_data:
-            deck_id = deck["id"]
-            
-            stats = vocab_crud.get_stats_for_user(user_id=user_id, deck_id=deck_id)
-            
-            #  Gộp lại
-            deck_with_stats = {
-                **deck,
-                "stats": stats
-            }
-            decks_with_stats.append(deck_with_stats)
+        # Thống kê của tất cả các bộ từ trong 1 truy vấn gộp (không lặp truy vấn theo từng bộ)
+        stats_by_deck = loaders.vocab_stats_by_deck(user_id, [deck["id"] for deck in decks_data])
+
+        #  Gộp lại
+        decks_with_stats = [
+            {**deck, "stats": stats_by_deck[deck["id"]]}
+            for deck in decks_data
+        ]
             
         return decks_with_stats
     except Exception as e:
@@ -3,24 +3,147 @@ from supabase import Client
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import uuid
+from fastapi_app.utils import session_cache
 
-def get_sessions(db: Client, user_id: str):
-    """Lấy danh sách các phiên hội thoại của user."""
+SESSION_MESSAGES_TABLE = "session_messages"
+
+def _parse_legacy_messages(messages: Any) -> List[Dict[str, Any]]:
+    """Đọc mảng JSON 'messages' cũ (session chưa được migrate sang session_messages)."""
+    if not messages:
+        return []
+    if isinstance(messages, str): # Fallback nếu DB lưu string
+        messages = json.loads(messages)
+    return messages
+
+def _row_to_message(row: Dict[str, Any]) -> Dict[str, Any]:
+    message = {"role": row.get("role"), "text": row.get("text"), "type": row.get("type")}
+    if row.get("metadata"):
+        message["metadata"] = row["metadata"]
+    return message
+
+SESSION_LIST_VIEW = "conversation_session_list"
+SESSION_LIST_COLUMNS = "id, topic, mode, level, lesson_id, created_at, message_count, has_summary"
+
+def get_sessions(
+    db: Client,
+    user_id: str,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    mode: Optional[str] = None,
+    topic: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Lấy danh sách các phiên hội thoại của user (chỉ cột hiển thị, không tải messages).
+    - before: keyset cursor, chỉ lấy session có created_at < before.
+    - limit=None: lấy tất cả (giữ tương thích cho /history).
+    """
     try:
-        res = db.table("conversation_sessions").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
-        return res.data
+        query = db.table(SESSION_LIST_VIEW).select(SESSION_LIST_COLUMNS).eq("user_id", user_id)
+        if mode:
+            query = query.eq("mode", mode)
+        if topic:
+            query = query.eq("topic", topic)
+        if before:
+            query = query.lt("created_at", before)
+        query = query.order("created_at", desc=True)
+        if limit is not None:
+            query = query.limit(limit)
+        res = query.execute()
+        return res.data or []
     except Exception as e:
         print(f"DB Error (get_sessions): {e}")
         raise
 
-def get_session_details(db: Client, session_id: str):
-    """Lấy chi tiết 1 session."""
+def get_sessions_page(
+    db: Client,
+    user_id: str,
+    limit: int = 20,
+    before: Optional[str] = None,
+    mode: Optional[str] = None,
+    topic: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Một trang danh sách session. Đọc dư 1 dòng để biết còn trang sau hay không."""
+    rows = get_sessions(db, user_id, limit=limit + 1, before=before, mode=mode, topic=topic)
+    items = rows[:limit]
+    next_cursor = items[-1]["created_at"] if len(rows) > limit and items else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def get_session_messages(db: Client, session_id: str, legacy_messages: Any = None) -> List[Dict[str, Any]]:
+    """
+    Dựng lại mảng messages của session từ bảng append-only 'session_messages'.
+    Nếu session chưa có dòng nào (session cũ chưa migrate), dùng mảng JSON cũ.
+    """
     try:
-        res = db.table("conversation_sessions").select("*").eq("id", session_id).single().execute()
-        return res.data
+        res = db.table(SESSION_MESSAGES_TABLE) \
+            .select("role, text, type, metadata") \
+            .eq("session_id", session_id) \
+            .order("seq") \
+            .execute()
+        if res.data:
+            return [_row_to_message(r) for r in res.data]
+        if legacy_messages is None:
+            session = get_session_details(db, session_id, with_messages=False) or {}
+            legacy_messages = session.get("messages")
+        return _parse_legacy_messages(legacy_messages)
     except Exception as e:
-        print(f"DB Error (get_session_details): {e}")
-        return None
+        print(f"DB Error (get_session_messages): {e}")
+        raise
+
+def get_message_range(
+    db: Client,
+    session_id: str,
+    min_seq: int = 0,
+    max_seq: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Lấy các tin nhắn có min_seq <= seq < max_seq. Nếu có limit thì lấy `limit` tin nhắn MỚI NHẤT
+    trong khoảng đó. Kết quả theo thứ tự seq tăng dần, mỗi tin nhắn kèm 'seq'.
+    Session cũ chưa migrate: cắt từ mảng JSON 'messages' (seq = vị trí trong mảng).
+    """
+    try:
+        query = db.table(SESSION_MESSAGES_TABLE) \
+            .select("seq, role, text, type, metadata") \
+            .eq("session_id", session_id) \
+            .gte("seq", min_seq)
+        if max_seq is not None:
+            query = query.lt("seq", max_seq)
+        query = query.order("seq", desc=True)
+        if limit is not None:
+            query = query.limit(limit)
+        res = query.execute()
+        if res.data:
+            return [{**_row_to_message(r), "seq": r["seq"]} for r in reversed(res.data)]
+
+        session = get_session_details(db, session_id, with_messages=False) or {}
+        legacy = [
+            {**m, "seq": i} for i, m in enumerate(_parse_legacy_messages(session.get("messages")))
+            if i >= min_seq and (max_seq is None or i < max_seq)
+        ]
+        return legacy[-limit:] if limit else legacy
+    except Exception as e:
+        print(f"DB Error (get_message_range): {e}")
+        raise
+
+def get_session_details(db: Client, session_id: str, with_messages: bool = True):
+    """
+    Lấy chi tiết 1 session. Mảng 'messages' chỉ được dựng lại khi with_messages=True.
+    Dòng session được cache (identity map theo request + TTL cache), bị xóa khi ghi.
+    """
+    session = session_cache.get(session_id)
+    if session is None:
+        try:
+            res = db.table("conversation_sessions").select("*").eq("id", session_id).single().execute()
+            session = res.data
+        except Exception as e:
+            print(f"DB Error (get_session_details): {e}")
+            return None
+        if session:
+            session_cache.put(session_id, session)
+
+    if session and with_messages:
+        session["messages"] = get_session_messages(db, session_id, session.get("messages"))
+    return session
 
 def create_session(db: Client, mode: str, level: str, topic: str, user_id: str, lesson_id: Optional[str] = None) -> Dict[str, Any]:
     """Tạo session mới."""
@@ -30,7 +153,8 @@ def create_session(db: Client, mode: str, level: str, topic: str, user_id: str,
         "mode": mode,
         "level": level,
         "topic": topic,
-        "messages": [], # Init empty JSON array
+        "messages": [], # Legacy column, tin nhắn mới nằm trong session_messages
+        "total_messages": 0,
         "created_at": datetime.utcnow().isoformat(),
         "lesson_id": lesson_id
     }
@@ -41,50 +165,60 @@ def create_session(db: Client, mode: str, level: str, topic: str, user_id: str,
         print(f"DB Error (create_session): {e}")
         raise
 
-def append_message_to_history(db: Client, session_id: str, new_message: Dict[str, Any]):
-    """Thêm tin nhắn vào mảng JSON 'messages'."""
+def append_messages_to_history(db: Client, session_id: str, new_messages: List[Dict[str, Any]]) -> int:
+    """
+    Ghi một lô tin nhắn vào 'session_messages' trong 1 round trip (RPC append_session_messages).
+    Hàm SQL tự cấp số thứ tự và migrate mảng JSON cũ nếu cần.
+    Trả về tổng số tin nhắn của session sau khi ghi.
+    """
+    if not new_messages:
+        return 0
     try:
-        # 1. Get current messages
-        current = get_session_details(db, session_id)
-        if not current:
-             raise ValueError("Session not found")
-        
-        existing_msgs = current.get("messages") or []
-        if isinstance(existing_msgs, str): # Fallback nếu DB lưu string
-             import json
-             existing_msgs = json.loads(existing_msgs)
-        
-        # 2. Append
-        updated_msgs = existing_msgs + [new_message]
-        
-        # 3. Update DB
-        db.table("conversation_sessions").update({
-            "messages": updated_msgs,
-            "updated_at": datetime.utcnow().isoformat()
-        }).eq("id", session_id).execute()
-        
-        return updated_msgs
+        res = db.rpc("append_session_messages", {
+            "p_session_id": session_id,
+            "p_messages": new_messages
+        }).execute()
+        session_cache.invalidate(session_id)
+        return res.data
     except Exception as e:
-        print(f"DB Error (append_message): {e}")
+        print(f"DB Error (append_messages): {e}")
         raise
 
-def update_session_summary(db: Client, session_id: str, summary_text: str, updated_msgs: List[Dict[str, Any]]):
-    """Cập nhật summary và messages cuối cùng."""
+def append_message_to_history(db: Client, session_id: str, new_message: Dict[str, Any]) -> int:
+    """Thêm 1 tin nhắn vào session (append-only, không đọc lại toàn bộ lịch sử)."""
+    return append_messages_to_history(db, session_id, [new_message])
+
+def update_session_summary(db: Client, session_id: str, summary_text: str, summary_message: Dict[str, Any]):
+    """Cập nhật summary và append tin nhắn summary vào lịch sử."""
     try:
+        append_messages_to_history(db, session_id, [summary_message])
         db.table("conversation_sessions").update({
             "ai_feedback_summary": summary_text,
-            "messages": updated_msgs,
             "updated_at": datetime.utcnow().isoformat()
         }).eq("id", session_id).execute()
+        session_cache.invalidate(session_id)
     except Exception as e:
         print(f"DB Error (update_summary): {e}")
         raise
 
+def update_context_summary(db: Client, session_id: str, context_summary: str, context_summary_seq: int):
+    """Lưu rolling summary (tóm tắt các tin nhắn có seq < context_summary_seq)."""
+    try:
+        db.table("conversation_sessions").update({
+            "context_summary": context_summary,
+            "context_summary_seq": context_summary_seq
+        }).eq("id", session_id).execute()
+        session_cache.invalidate(session_id)
+    except Exception as e:
+        print(f"DB Error (update_context_summary): {e}")
+        raise
+
 def delete_session(db: Client, session_id: str, user_id: str):
-    """Xóa session (có check owner)."""
+    """Xóa session (có check owner). session_messages bị xóa theo (ON DELETE CASCADE)."""
     try:
         # Check owner logic nên làm ở service/router, ở đây chỉ xóa
         db.table("conversation_sessions").delete().eq("id", session_id).eq("user_id", user_id).execute()
+        session_cache.invalidate(session_id)
     except Exception as e:
         print(f"DB Error (delete_session): {e}")
         raise
@@ -92,27 +226,21 @@ def delete_session(db: Client, session_id: str, user_id: str):
 # AI suggestion 
 def get_session_messages_by_id(db: Client, session_id: str, user_id: str) -> List[Dict[str, Any]]:
     """
-    Lấy cột 'messages' (JSON array) từ session, có check quyền user_id.
+    Lấy danh sách messages của session, có check quyền user_id.
     """
     try:
         response = db.table("conversation_sessions") \
-            .select("messages") \
+            .select("id, messages") \
             .eq("id", session_id) \
             .eq("user_id", user_id) \
             .single() \
             .execute()
 
         # Kiểm tra data
-        if not response.data or "messages" not in response.data:
+        if not response.data:
             return []
             
-        messages = response.data["messages"]
-        
-        # Fallback nếu DB lưu dạng string
-        if isinstance(messages, str):
-            messages = json.loads(messages)
-            
-        return messages
+        return get_session_messages(db, session_id, response.data.get("messages"))
         
     except Exception as e:
         # Xử lý lỗi "0 rows" (PGRST116)
@@ -120,4 +248,4 @@ def get_session_messages_by_id(db: Client, session_id: str, user_id: str) -> Lis
              raise ValueError("Session not found or Access Denied")
         
         print(f"DB Error (get_session_messages_by_id): {e}")
-        raise e
\ No newline at end of file
+        raise e
@@ -0,0 +1,84 @@
+"""
+Loader gom truy vấn theo request (kiểu DataLoader) cho các trang danh sách.
+
+Thay vì đếm riêng cho từng deck / từng user (N+1 truy vấn), mỗi loader nhận cả danh sách key
+và gọi MỘT hàm SQL đếm theo nhóm (GROUP BY, xem database_setup.sql) qua RPC.
+Số truy vấn và dữ liệu trả về của trang danh sách vì vậy chỉ phụ thuộc số key, không phụ thuộc số dòng con.
+
+Kết quả được nhớ theo request (middleware trong main.py gọi begin_request / end_request),
+nên cùng một key chỉ được tải 1 lần trong 1 request. Ngoài request (script, task nền) thì không nhớ.
+"""
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from fastapi_app import schemas
+
+from . import vocabulary as vocab_crud
+
+_request_loaders: ContextVar[Optional[Dict[str, Dict[Hashable, Any]]]] = ContextVar("request_loaders", default=None)
+
+
+def begin_request():
+    """Mở bộ nhớ loader cho request hiện tại. Trả về token để reset khi request kết thúc."""
+    return _request_loaders.set({})
+
+
+def end_request(token) -> None:
+    _request_loaders.reset(token)
+
+
+def _load_many(
+    name: str,
+    keys: Iterable[Hashable],
+    batch_fn: Callable[[List[Hashable]], Dict[Hashable, Any]],
+    default: Callable[[], Any],
+) -> Dict[Hashable, Any]:
+    """Trả về {key: value} cho mọi key; chỉ gọi batch_fn (1 lần) cho các key chưa có trong request."""
+    keys = list(dict.fromkeys(k for k in keys if k is not None))
+    loaded = _request_loaders.get()
+    memo = loaded.setdefault(name, {}) if loaded is not None else {}
+
+    missing = [k for k in keys if k not in memo]
+    if missing:
+        results = batch_fn(missing)
+        for key in missing:
+            memo[key] = results.get(key, default())
+    return {key: memo[key] for key in keys}
+
+
+def _grouped_counts(db: Any, function: str, param: str, key_column: str, count_column: str, keys: List[Hashable]) -> Dict[Hashable, int]:
+    """Gọi hàm SQL đếm theo nhóm; key không có dòng nào thì không xuất hiện trong kết quả."""
+    rows = db.rpc(function, {param: keys}).execute().data or []
+    return {row[key_column]: row[count_column] or 0 for row in rows}
+
+
+# --- LOADERS ---
+
+def vocab_stats_by_deck(user_id: str, deck_ids: Iterable[int]) -> Dict[int, schemas.VocabularyStats]:
+    """Thống kê learning / mastered / review_today của user cho nhiều bộ từ."""
+    # RPC get_deck_vocab_stats trả về mọi bộ từ của user trong 1 lần gọi (đếm gộp trong SQL)
+    def batch(keys: List[Hashable]) -> Dict[Hashable, schemas.VocabularyStats]:
+        return vocab_crud.get_deck_stats(user_id)
+
+    return _load_many(
+        f"vocab_stats:{user_id}", deck_ids, batch,
+        lambda: schemas.VocabularyStats(learning=0, mastered=0, review_today=0),
+    )
+
+
+def session_counts_by_user(db: Any, user_ids: Iterable[str]) -> Dict[str, int]:
+    """Số conversation_sessions của mỗi user."""
+    return _load_many(
+        "session_counts", user_ids,
+        lambda keys: _grouped_counts(db, "count_sessions_by_user", "p_user_ids", "user_id", "session_count", keys),
+        int,
+    )
+
+
+def public_word_counts_by_deck(db: Any, deck_ids: Iterable[Any]) -> Dict[Any, int]:
+    """Số PublicWords trong mỗi PublicDecks."""
+    return _load_many(
+        "public_word_counts", deck_ids,
+        lambda keys: _grouped_counts(db, "count_public_words_by_deck", "p_deck_ids", "deck_id", "word_count", keys),
+        int,
+    )
@@ -1,7 +1,13 @@
+import threading
 from supabase import Client
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from postgrest import APIResponse 
 
+# Cache scenario trong process: scenario_id -> kịch bản đã index theo turn.
+# Kịch bản chỉ đổi khi admin sửa, nên không cần TTL; admin_scenarios gọi invalidate_scenario_cache.
+_scenario_cache: Dict[str, Dict[str, Any]] = {}
+_scenario_cache_lock = threading.Lock()
+
 def get_scenarios_by_topic_and_level(db: Client, topic: str, level: str) -> List[Dict[str, Any]]:
     """Lấy danh sách scenario (id, title)."""
     try:
@@ -26,6 +32,59 @@ def get_scenario_by_id_with_dialogues(db: Client, scenario_id: str) -> Dict[str,
         print(f"DB Error (get_scenario_detail): {e}")
         raise
 
+def _build_scenario_index(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Dựng bản index của scenario:
+    - lines: [(turn, speaker, line)] theo thứ tự turn
+    - by_turn: mảng index theo turn -> (speaker, line), tra cứu O(1)
+    """
+    lines: List[Tuple[int, str, str]] = [
+        (int(l["turn"]), l["speaker"], l["line"]) for l in scenario.get("dialogue_lines") or []
+    ]
+    size = max((t for t, _, _ in lines), default=-1) + 1
+    by_turn: List[Optional[Tuple[str, str]]] = [None] * size
+    for turn, speaker, line in lines:
+        if turn >= 0:
+            by_turn[turn] = (speaker, line)
+    return {
+        "id": scenario.get("id"),
+        "title": scenario.get("title"),
+        "topic": scenario.get("topic"),
+        "level": scenario.get("level"),
+        "lines": lines,
+        "by_turn": by_turn,
+    }
+
+def get_cached_scenario(db: Client, scenario_id: str) -> Dict[str, Any] | None:
+    """Lấy scenario đã index từ cache; chỉ đọc DB ở lần đầu (hoặc sau khi bị invalidate)."""
+    with _scenario_cache_lock:
+        cached = _scenario_cache.get(scenario_id)
+    if cached is not None:
+        return cached
+
+    scenario = get_scenario_by_id_with_dialogues(db, scenario_id)
+    if not scenario:
+        return None
+    indexed = _build_scenario_index(scenario)
+    with _scenario_cache_lock:
+        _scenario_cache[scenario_id] = indexed
+    return indexed
+
+def get_dialogue_line(scenario: Dict[str, Any], turn: int, speaker: str) -> Optional[str]:
+    """Câu thoại ở lượt `turn` nếu đúng người nói, ngược lại None."""
+    by_turn = scenario["by_turn"]
+    if 0 <= turn < len(by_turn) and by_turn[turn] and by_turn[turn][0] == speaker:
+        return by_turn[turn][1]
+    return None
+
+def invalidate_scenario_cache(scenario_id: Optional[str] = None) -> None:
+    """Xóa cache của 1 scenario (hoặc toàn bộ nếu không truyền id)."""
+    with _scenario_cache_lock:
+        if scenario_id is None:
+            _scenario_cache.clear()
+        else:
+            _scenario_cache.pop(scenario_id, None)
+
 #  HÀM SEEDING 
 def get_scenario_by_title(db: Client, title: str) -> Dict[str, Any] | None:
     """
@@ -61,6 +120,7 @@ def create_scenario_with_dialogues(db: Client, scenario_data: Dict[str, Any], di
             db.table("scenarios").delete().eq("id", new_scenario_id).execute()
             raise Exception("Không thể tạo các câu thoại.")
 
+        invalidate_scenario_cache(new_scenario_id)
         return scenario_response.data[0]
     except Exception as e:
         print(f" LỖI DATABASE trong create_scenario_with_dialogues: {e}")
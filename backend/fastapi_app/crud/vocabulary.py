@@ -8,35 +8,48 @@ from fastapi_app.services.vocabulary import calculate_srs, get_word_details_from
 
 # --- READ ---
 
-def get_stats_for_user(user_id: str, deck_id: int) -> schemas.VocabularyStats:
-    """Lấy thông số thống kê CHO MỘT BỘ TỪ (DECK) CỤ THỂ."""
-    try:
-        today = datetime.utcnow().date().isoformat()
-            
-        learning_count = admin_supabase.table("UserVocabulary").select("id", count="exact") \
-            .eq("user_id", user_id) \
-            .eq("deck_id", deck_id) \
-            .eq("status", "learning").execute().count
-            
-        mastered_count = admin_supabase.table("UserVocabulary").select("id", count="exact") \
-            .eq("user_id", user_id) \
-            .eq("deck_id", deck_id) \
-            .eq("status", "mastered").execute().count
-            
-        review_today_count = admin_supabase.table("UserVocabulary").select("id", count="exact") \
-            .eq("user_id", user_id) \
-            .eq("deck_id", deck_id) \
-            .lte("next_review_date", today).execute().count
+def get_deck_stats(user_id: str, deck_id: Optional[int] = None) -> Dict[Optional[int], schemas.VocabularyStats]:
+    """
+    Thống kê learning / mastered / review_today theo từng bộ từ bằng 1 lần gọi RPC get_deck_vocab_stats.
+    deck_id = None -> mọi bộ từ của người dùng.
+    """
+    today = datetime.utcnow().date().isoformat()
+    params = {"p_user_id": user_id, "p_today": today}
+    if deck_id is not None:
+        params["p_deck_id"] = deck_id
+    rows = admin_supabase.rpc("get_deck_vocab_stats", params).execute().data or []
+    return {
+        row["deck_id"]: schemas.VocabularyStats(
+            learning=row["learning"] or 0,
+            mastered=row["mastered"] or 0,
+            review_today=row["review_today"] or 0
+        )
+        for row in rows
+    }
 
+def get_stats_for_user(user_id: str, deck_id: Optional[int] = None) -> schemas.VocabularyStats:
+    """Lấy thông số thống kê CHO MỘT BỘ TỪ (DECK) CỤ THỂ, hoặc cho toàn bộ từ vựng nếu không truyền deck_id."""
+    try:
+        per_deck = get_deck_stats(user_id, deck_id).values()
         return schemas.VocabularyStats(
-            learning=learning_count or 0,
-            mastered=mastered_count or 0,
-            review_today=review_today_count or 0
+            learning=sum(s.learning for s in per_deck),
+            mastered=sum(s.mastered for s in per_deck),
+            review_today=sum(s.review_today for s in per_deck)
         )
     except Exception as e:
         print(f"--- LỖI THẬT TRONG get_stats_for_user ---: {e}") 
         raise HTTPException(status_code=500, detail=f"Lỗi máy chủ khi lấy stats: {str(e)}")
 
+def stats_from_words(words: List[Dict[str, Any]]) -> schemas.VocabularyStats:
+    """Tính thống kê từ các dòng UserVocabulary đã tải sẵn (không truy vấn thêm)."""
+    today = datetime.utcnow().date().isoformat()
+    return schemas.VocabularyStats(
+        learning=sum(1 for w in words if w.get("status") == "learning"),
+        mastered=sum(1 for w in words if w.get("status") == "mastered"),
+        # next_review_date là cột date: so sánh chuỗi ISO giống .lte("next_review_date", today)
+        review_today=sum(1 for w in words if w.get("next_review_date") and str(w["next_review_date"])[:10] <= today)
+    )
+
 def get_words_for_user(user_id: str, deck_id: int):
     """Lấy danh sách 'Từ của tôi' CHO MỘT BỘ TỪ (DECK) CỤ THỂ."""
     try:
@@ -1,5 +1,7 @@
 import os
 import sys
+import functools
+import anyio
 from dotenv import load_dotenv, find_dotenv
 from supabase import create_client, Client
 
@@ -42,4 +44,31 @@ try:
 
 except Exception as e:
     print(f" Failed to initialize Supabase client: {e}")
-    sys.exit(1)
\ No newline at end of file
+    sys.exit(1)
+
+# ================================================================
+#  CHẠY LỜI GỌI SUPABASE (ĐỒNG BỘ) TỪ CODE ASYNC
+# ================================================================
+# Số lời gọi DB đồng thời tối đa (mỗi lời gọi giữ 1 thread trong lúc chờ PostgREST).
+# Pool riêng, không tranh thread với threadpool mặc định của Starlette / anyio.
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "32"))
+_db_limiter = None
+
+
+def _get_db_limiter():
+    # Tạo lazy: CapacityLimiter cần event loop đang chạy
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_MAX_CONCURRENCY)
+    return _db_limiter
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Chạy hàm đồng bộ dùng supabase-py (crud.*, query builder ... .execute()) trong pool thread dành cho DB,
+    để event loop không bị chặn trong suốt round trip:
+
+        words = await run_db(crud.get_words_for_user, user_id=user_id)
+        res = await run_db(lambda: admin_supabase.table("Decks").select("*").eq("id", deck_id).execute())
+    """
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_get_db_limiter())
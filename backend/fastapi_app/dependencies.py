@@ -1,4 +1,4 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from supabase.client import AuthApiError
 
@@ -7,12 +7,16 @@ from supabase.client import AuthApiError
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 from fastapi_app.database import db_client 
+from fastapi_app.crud import admin_users as admin_crud
+from fastapi_app.utils import admission, prompt_budget, metrics, jwt_verifier
+from fastapi_app.utils.admission import Priority
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     Middleware xác thực người dùng hiện tại bằng Bearer token.
-    - Giải mã token qua Supabase để lấy thông tin user.
+    - Xác thực chữ ký / hạn token ngay trong process (utils/jwt_verifier.py), có cache theo token.
+    - Không tự xác thực được thì giải mã token qua Supabase để lấy thông tin user.
     - Nếu token không hợp lệ hoặc hết hạn, trả về 401.
     """
     if not token:
@@ -22,6 +26,17 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    try:
+        user = jwt_verifier.verify(token)
+        if user is not None:
+            return user
+    except jwt_verifier.TokenExpired:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
     try:
         # Lấy thông tin user từ token
         # Lưu ý: get_user() trả về một đối tượng có thuộc tính .user
@@ -35,6 +50,8 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
+        metrics.increment("auth_verify", result="remote")
+        jwt_verifier.remember(token, user)
         return user
 
     except AuthApiError as e:
@@ -62,26 +79,62 @@ def get_current_user_id(user=Depends(get_current_user)) -> str:
 def get_admin_user_id(user=Depends(get_current_user)) -> str:
     """
     Xác thực user và kiểm tra vai trò 'admin' trong Database qua cột 'role' mới.
+    Role / status được cache ngắn hạn (crud.admin_users.get_user_access), bị xóa ngay khi admin đổi role / status.
     """
     user_id = user.id
     
     try:
-        # Tên bảng bạn cung cấp
-        USER_PROFILES_TABLE = 'profiles' 
-        
-        # Kiểm tra cột 'role' mới
-        response = db_client.from_(USER_PROFILES_TABLE).select("role").eq("id", user_id).single().execute()
-        
-        user_role = response.data.get("role")
-        
-        if user_role != "admin": # Kiểm tra vai trò là 'admin'
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied. Administrator role required.")
-            
-        return user_id
-        
+        access = admin_crud.get_user_access(db_client, user_id) or {}
     except Exception as e:
         print(f"Admin check error for user {user_id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="Access denied. Failed to verify administrator role."
-        )
\ No newline at end of file
+        )
+
+    if access.get("status") == "blocked":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied. Account is blocked.")
+
+    if access.get("role") != "admin": # Kiểm tra vai trò là 'admin'
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied. Administrator role required.")
+        
+    return user_id
+
+
+def _admit_or_429(subject: str, bucket: str, priority: Priority) -> None:
+    try:
+        admission.admit(subject, bucket, priority)
+    except admission.AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Hệ thống đang quá tải hoặc bạn đã gửi quá nhiều yêu cầu. Vui lòng thử lại sau.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+def _endpoint_label(request: Request) -> str:
+    # Đường dẫn mẫu của route (/conversation/{session_id}/...) để metrics không nổ theo id
+    return getattr(request.scope.get("route"), "path", None) or request.url.path
+
+
+def rate_limited(bucket: str, priority: Priority = Priority.STANDARD):
+    """
+    Dependency cho endpoint gọi LLM: token bucket theo user + từ chối sớm khi quá tải (429).
+    Trả về user như get_current_user. Token LLM của request được ghi nhận theo user + endpoint.
+
+    @router.post("/chat", dependencies=[Depends(rate_limited("chat", Priority.INTERACTIVE))])
+    """
+    async def _admit(request: Request, user=Depends(get_current_user)):
+        _admit_or_429(user.id, bucket, priority)
+        prompt_budget.set_caller(user.id, _endpoint_label(request))
+        return user
+    return _admit
+
+
+def rate_limited_by_ip(bucket: str, priority: Priority = Priority.STANDARD):
+    """Như rate_limited nhưng cho endpoint không yêu cầu đăng nhập (hạn mức theo IP)."""
+    async def _admit(request: Request):
+        client = request.client.host if request.client else "unknown"
+        _admit_or_429(f"ip:{client}", bucket, priority)
+        prompt_budget.set_caller(None, _endpoint_label(request))
+    return _admit
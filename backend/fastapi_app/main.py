@@ -1,4 +1,5 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
@@ -9,6 +10,12 @@ from fastapi_app.routers import (
 )
 from fastapi_app.routers import audio
 from fastapi_app.routers import test_router, check_grammar_router, pronunciation_router, assessment_router, quiz_grammar_router
+from fastapi_app.services import turn_buffer, jobs
+from fastapi_app.crud import loaders
+from fastapi_app.utils import session_cache, admission
+from fastapi_app.utils.circuit_breaker import CircuitOpenError
+from fastapi_app.utils.gemini_file_manager import run_remote_file_cleanup
+import asyncio
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ENV_PATH = os.path.join(BASE_DIR, ".env")
@@ -30,6 +37,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def session_identity_map(request: Request, call_next):
+    # Mỗi request có identity map riêng cho các dòng conversation_sessions
+    # và bộ nhớ riêng cho các loader gom truy vấn (crud.loaders)
+    token = session_cache.begin_request()
+    loaders_token = loaders.begin_request()
+    try:
+        return await call_next(request)
+    finally:
+        loaders.end_request(loaders_token)
+        session_cache.end_request(token)
+
+@app.exception_handler(admission.AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: admission.AdmissionRejected):
+    # Hàng đợi LLM đầy / chờ quá lâu giữa chừng request -> 429 nhanh thay vì treo
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Hệ thống đang quá tải. Vui lòng thử lại sau."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    # Gemini đang bị ngắt mạch và endpoint không có fallback -> báo lỗi ngay
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Dịch vụ AI tạm thời không khả dụng. Vui lòng thử lại sau."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # Routers từ HEAD:
 app.include_router(auth.router)
 app.include_router(conversation.router)
@@ -53,6 +90,25 @@ app.include_router(pronunciation_router.router)
 app.include_router(assessment_router.router)
 app.include_router(quiz_grammar_router.router, prefix="/api")
 
+@app.on_event("startup")
+async def start_background_jobs():
+    # Dọn các file audio đã upload lên Gemini Files API theo lịch
+    app.state.gemini_cleanup_task = asyncio.create_task(run_remote_file_cleanup())
+    # Worker xử lý job nền (roadmap tracking sau khi summarize)
+    jobs.start_workers()
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    task = getattr(app.state, "gemini_cleanup_task", None)
+    if task:
+        task.cancel()
+    await jobs.stop_workers()
+
+@app.on_event("shutdown")
+def flush_pending_turns():
+    # Ghi nốt các lượt hội thoại còn trong buffer trước khi tắt server
+    turn_buffer.flush_all_sync()
+
 @app.get("/") 
 async def root():
     return {
@@ -11,7 +11,15 @@ def get_start_conversation_prompt(level: str, topic: str) -> str:
     Example ideal output: "Hi! I love talking about {topic}. What is your favorite thing about it?"
     """
 
-def get_free_talk_text_prompt(level: str, topic: str, context_text: str, user_message: str) -> str:
+def _summary_block(context_summary: str) -> str:
+    if not context_summary:
+        return ""
+    return f"""
+    Earlier in this conversation (summary):
+    {context_summary}
+    """
+
+def get_free_talk_text_prompt(level: str, topic: str, context_text: str, user_message: str, context_summary: str = "") -> str:
     return f"""
     You are an AI English tutor for a '{level}' student. Topic: '{topic}'.
     Tasks:
@@ -26,12 +34,13 @@ def get_free_talk_text_prompt(level: str, topic: str, context_text: str, user_me
       "metadata": {{ "grammar_score": 0.9, "vocabulary_score": 0.8, "tips": "...", "evaluation": "..." }}
     }}
     
+    {_summary_block(context_summary)}
     Context:
     {context_text}
     User: {user_message}
     """
 
-def get_free_talk_voice_prompt(level: str, topic: str, context_text: str) -> str:
+def get_free_talk_voice_prompt(level: str, topic: str, context_text: str, context_summary: str = "") -> str:
     return f"""
     Act as a friendly English conversation partner. User Level: '{level}'. Topic: '{topic}'.
     
@@ -47,6 +56,7 @@ def get_free_talk_voice_prompt(level: str, topic: str, context_text: str) -> str
        - Point out specific errors (Pronunciation, Grammar, Vocab) constructively.
 
     **Context:**
+    {_summary_block(context_summary)}
     {context_text}
 
     **OUTPUT JSON:**
@@ -93,6 +103,24 @@ def get_scenario_voice_prompt(level: str, correct_text: str) -> str:
     }}
     """
 
+def get_context_summary_prompt(previous_summary: str, transcript: str) -> str:
+    """Prompt cập nhật rolling summary (ngữ cảnh cho các lượt sau, KHÔNG phải bản đánh giá cuối buổi)."""
+    return f"""
+    You maintain the running memory of an English practice conversation.
+    Update the summary so the tutor can continue the chat naturally.
+
+    **Current summary:**
+    {previous_summary or "(empty)"}
+
+    **New messages:**
+    {transcript}
+
+    **RULES:**
+    - Max 120 words, plain text, no JSON.
+    - Keep facts the student shared, open questions and recurring mistakes.
+    - Drop greetings and small talk that no longer matters.
+    """
+
 def get_summary_prompt(mode: str, level: str, topic: str, transcript: str) -> str:
     """
     Trả về prompt tóm tắt tùy chỉnh theo chế độ (Scenario vs Free Talk).
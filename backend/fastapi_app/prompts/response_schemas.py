@@ -0,0 +1,46 @@
+"""
+Registry: prompt builder -> schema pydantic của JSON mà prompt đó yêu cầu.
+
+Gateway gửi schema kèm request (response_schema) để Gemini sinh đúng cấu trúc ngay từ đầu,
+service dùng lại cùng schema đó để validate:
+
+    schema = response_schema_for(build_quiz_test_prompt)
+    resp = await llm_gateway.generate(prompt, response_schema=schema)
+    data = parse_llm_output(resp.text, schema)
+
+Prompt không sinh JSON (greeting, rolling summary) không có trong registry.
+"""
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from fastapi_app.schemas import llm_outputs as out
+
+# Key: tên hàm build prompt (hoặc tên hằng với prompt tĩnh / prompt viết trực tiếp trong service)
+RESPONSE_SCHEMAS: Dict[str, Any] = {
+    # prompts/conversation.py
+    "get_free_talk_text_prompt": out.FreeTalkTextOutput,
+    "get_free_talk_voice_prompt": out.FreeTalkVoiceOutput,
+    "get_scenario_voice_prompt": out.ScenarioVoiceOutput,
+    "get_summary_prompt": out.SessionSummaryOutput,
+    # prompts/vocabulary.py
+    "get_vocabulary_context_prompt": List[out.VocabContextItem],
+    "build_vocab_enrichment_prompt": List[out.VocabEntryOutput],
+    "build_topic_generation_prompt": List[out.VocabEntryOutput],
+    # prompts/grammar.py
+    "build_quiz_prompt": List[out.GrammarQuizItemOutput],
+    # prompts/test.py
+    "build_quiz_test_prompt": out.DiagnosticQuizOutput,
+    "build_quiz_repair_prompt": out.DiagnosticQuizOutput,
+    # prompts/roadmap.py
+    "build_roadmap_prompt": out.RoadmapOutput,
+    "build_roadmap_adjustment_prompt": out.RoadmapWeekOutput,
+    # prompts/pronunciation.py
+    "PRONUNCIATION_COACH_PROMPT": out.PronunciationFeedbackResponse,
+    # services/assessment_service.analyze_speaking_audio
+    "speaking_assessment": out.SpeakingAssessmentOutput,
+}
+
+
+def response_schema_for(builder: Union[Callable[..., str], str]) -> Optional[Any]:
+    """Nhận hàm build prompt hoặc tên của nó; None nếu prompt không có schema."""
+    name = builder if isinstance(builder, str) else getattr(builder, "__name__", "")
+    return RESPONSE_SCHEMAS.get(name)
@@ -35,4 +35,34 @@ def build_quiz_test_prompt(
         OUTPUT CONSTRAINT:
         Return ONLY RAW JSON. No markdown blocks, no preamble, no conversational filler.
         Ensure logically plausible distractors for MCQs.
-        """
\ No newline at end of file
+        """
+def build_quiz_repair_prompt(
+    comm_goal,
+    barrier,
+    slots,
+):
+    # slots: [{"id": 7, "question_type": "grammar", "error": "...", "previous": {...}}]
+    slot_lines = "\n".join(
+        f'        - ID {s["id"]} ({s["question_type"]}): {s["error"]}. Previous version: {s["previous"]}'
+        for s in slots
+    )
+    return f"""
+        SYSTEM ROLE: Senior English Assessment Developer.
+        TASK: Some questions of a diagnostic test were invalid. Rewrite ONLY these questions.
+
+        LEARNER PROFILE:
+        - Goal: {comm_goal}
+        - Barrier: {barrier}
+
+        QUESTIONS TO REWRITE:
+{slot_lines}
+
+        RULES (same as the original test):
+        - Keep each "id" and "question_type" exactly as listed above.
+        - "question_text": (string) in English.
+        - grammar / vocabulary: "options" is an array of exactly 4 strings with NO prefixes like "A)", "B)";
+          "correct_answer_key" is exactly one of "A", "B", "C", "D".
+        - speaking_prompt: "options" is [] and "correct_answer_key" is exactly "N/A".
+
+        Return a single JSON object: {{"questions": [...]}} containing only the rewritten questions.
+        """
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional
 from ..dependencies import get_admin_user_id
-from ..database import admin_supabase,db_client
+from ..database import admin_supabase,db_client, run_db
 from ..crud import admin_users as admin_crud
 from ..schemas.admin import AdminUserUpdate, MessageDetail, SessionDetail, SessionOverview
-from ..schemas.admin import AdminUserDetail, UpdateUserStatus, UpdateUserRole
+from ..schemas.admin import AdminUserDetail, UpdateUserStatus, UpdateUserRole, LlmRoutingUpdate
+from ..services import model_routing
+from ..utils import metrics, admission, circuit_breaker, prompt_budget
 
 router = APIRouter(
     prefix="/admin",
@@ -17,7 +19,7 @@ async def list_users(search: Optional[str] = Query(None)): # Nhận tham số se
     """Lấy danh sách user, hỗ trợ tìm kiếm."""
     try:
         # Truyền search vào CRUD
-        users_data = admin_crud.get_all_user_details(db=db_client, search_query=search)
+        users_data = await run_db(admin_crud.get_all_user_details, db=db_client, search_query=search)
         return [AdminUserDetail(**u) for u in users_data]
     except Exception as e:
         print(f"API Error (list_users): {e}")
@@ -26,7 +28,8 @@ async def list_users(search: Optional[str] = Query(None)): # Nhận tham số se
 @router.put("/users/{user_id}/status")
 async def update_user_status(user_id: str, status_data: UpdateUserStatus):
     try:
-        response = admin_crud.update_user_status_in_db(
+        response = await run_db(
+            admin_crud.update_user_status_in_db,
             db=admin_supabase, user_id=user_id, new_status=status_data
         )
         if not response.data:
@@ -38,7 +41,8 @@ async def update_user_status(user_id: str, status_data: UpdateUserStatus):
 @router.put("/users/{user_id}/role")
 async def update_user_role(user_id: str, role_data: UpdateUserRole):
     try:
-        response = admin_crud.update_user_role_in_db(
+        response = await run_db(
+            admin_crud.update_user_role_in_db,
             db=admin_supabase, user_id=user_id, new_role=role_data
         )
         if not response.data:
@@ -51,7 +55,7 @@ async def update_user_role(user_id: str, role_data: UpdateUserRole):
 @router.get("/users/{user_id}", response_model=AdminUserDetail)
 async def get_user_detail(user_id: str):
     """Lấy thông tin chi tiết của một user cụ thể."""
-    user_data = admin_crud.get_user_by_id(db=db_client, user_id=user_id)
+    user_data = await run_db(admin_crud.get_user_by_id, db=db_client, user_id=user_id)
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found.")
     return AdminUserDetail(**user_data)
@@ -60,7 +64,7 @@ async def get_user_detail(user_id: str):
 @router.delete("/users/{user_id}")
 async def delete_user(user_id: str):
     """Xóa người dùng khỏi hệ thống."""
-    success = admin_crud.delete_user_in_db(db=db_client, user_id=user_id)
+    success = await run_db(admin_crud.delete_user_in_db, db=db_client, user_id=user_id)
     if not success:
         # Có thể user không tồn tại hoặc lỗi DB
         raise HTTPException(status_code=400, detail="Failed to delete user or user not found.")
@@ -68,18 +72,18 @@ async def delete_user(user_id: str):
     return {"message": f"User {user_id} deleted successfully."}
 @router.get("/users/{user_id}/sessions", response_model=List[SessionOverview])
 async def list_user_sessions(user_id: str):
-    return [SessionOverview(**s) for s in admin_crud.get_user_sessions(db=db_client, user_id=user_id)]
+    return [SessionOverview(**s) for s in await run_db(admin_crud.get_user_sessions, db=db_client, user_id=user_id)]
 
 # API: Lấy chi tiết nội dung Session
 @router.get("/sessions/{session_id}", response_model=SessionDetail)
 async def get_session_detail(session_id: str):
     # 1. Lấy thông tin chung
-    overview_data = admin_crud.get_session_overview(db=db_client, session_id=session_id)
+    overview_data = await run_db(admin_crud.get_session_overview, db=db_client, session_id=session_id)
     if not overview_data:
         raise HTTPException(status_code=404, detail="Session not found.")
         
     # 2. Lấy danh sách tin nhắn
-    messages_data = admin_crud.get_session_messages(db=db_client, session_id=session_id)
+    messages_data = await run_db(admin_crud.get_session_messages, db=db_client, session_id=session_id)
     
     return SessionDetail(
         overview=SessionOverview(**overview_data), # Map data vào schema
@@ -89,7 +93,7 @@ async def get_session_detail(session_id: str):
 async def update_user(user_id: str, user_data: AdminUserUpdate):
     """Cập nhật thông tin user (Username, Role, Status, Badge)"""
     try:
-        updated_user = admin_crud.update_user_in_db(db=db_client, user_id=user_id, update_data=user_data)
+        updated_user = await run_db(admin_crud.update_user_in_db, db=db_client, user_id=user_id, update_data=user_data)
         
         if not updated_user:
             raise HTTPException(status_code=404, detail="User not found or update failed.")
@@ -103,4 +107,33 @@ async def update_user(user_id: str, user_data: AdminUserUpdate):
 @router.get("/sessions")
 async def list_global_sessions(search: Optional[str] = Query(None)): # <--- Thêm tham số search
     """Lấy danh sách hội thoại, hỗ trợ tìm kiếm theo Topic hoặc Username."""
-    return admin_crud.get_all_sessions_global(db=db_client, search_query=search)
\ No newline at end of file
+    return await run_db(admin_crud.get_all_sessions_global, db=db_client, search_query=search)
+
+@router.get("/metrics")
+async def get_metrics():
+    """Bộ đếm vận hành trong process (số lần gọi/thử lại Gemini, token theo task, ...), hàng đợi LLM, circuit breaker và user tốn token nhất."""
+    return {
+        **metrics.snapshot(),
+        "admission": admission.snapshot(),
+        "circuits": circuit_breaker.snapshot(),
+        "prompt_usage": prompt_budget.snapshot(),
+    }
+
+@router.get("/llm-routing")
+async def get_llm_routing():
+    """Bảng định tuyến task -> tier model đang áp dụng."""
+    return model_routing.snapshot()
+
+@router.put("/llm-routing")
+async def update_llm_routing(update: LlmRoutingUpdate):
+    """Ghi đè định tuyến lúc chạy (chỉ trong process hiện tại; khởi động lại sẽ về cấu hình env)."""
+    try:
+        model_routing.override_routing(
+            task_tiers=update.task_tiers,
+            tier_models=update.tier_models,
+            tier_slo=update.tier_slo,
+            tier_fallback=update.tier_fallback,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return model_routing.snapshot()
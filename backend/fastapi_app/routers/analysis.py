@@ -4,7 +4,7 @@ from fastapi_app.dependencies import get_current_user_id
 from fastapi_app.crud import history as history_crud
 from fastapi_app.crud import vocabulary as vocab_crud
 from fastapi_app.services import vocabulary as vocab_service
-from fastapi_app.database import admin_supabase
+from fastapi_app.database import admin_supabase, run_db
 
 router = APIRouter(
     prefix="/analysis", 
@@ -18,7 +18,8 @@ async def analyze_conversation_session(
     user_id: str = Depends(get_current_user_id)
 ):
     try:
-        json_transcript = history_crud.get_session_messages_by_id(
+        json_transcript = await run_db(
+            history_crud.get_session_messages_by_id,
             db=admin_supabase, 
             session_id=session_data.session_id, 
             user_id=user_id
@@ -32,7 +33,7 @@ async def analyze_conversation_session(
         if not final_suggestions:
             return {"message": "No new unique suggestions found.", "words_added": 0}
 
-        words_added = vocab_crud.create_suggestions_for_user(final_suggestions, user_id)
+        words_added = await run_db(vocab_crud.create_suggestions_for_user, final_suggestions, user_id)
         
         return {"message": "Analysis complete.", "words_added": words_added}
         
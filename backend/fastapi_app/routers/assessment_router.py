@@ -1,4 +1,5 @@
-from fastapi import APIRouter, UploadFile, Form, HTTPException, Request
+from fastapi import APIRouter, Depends, UploadFile, Form, HTTPException, Request
+from fastapi_app.dependencies import rate_limited_by_ip
 from fastapi.responses import JSONResponse
 from typing import Dict, List
 from fastapi_app.schemas.test_schemas import FinalAssessmentSubmission
@@ -11,7 +12,7 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/assessment", tags=["Assessment & Roadmap"])
 
-@router.post("/submit_and_analyze")
+@router.post("/submit_and_analyze", dependencies=[Depends(rate_limited_by_ip("roadmap"))])
 async def submit_assessment(request: Request):
     """
     Nhận FormData từ frontend:
@@ -1,10 +1,18 @@
 import json
+from datetime import datetime
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Body
-from fastapi_app.dependencies import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Body, BackgroundTasks, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from fastapi_app.dependencies import get_current_user, rate_limited
 from fastapi_app.schemas import conversation as schemas
 from fastapi_app.services import conversation as conversation_service
+from fastapi_app.services import turn_buffer
+from fastapi_app.services import jobs
 from fastapi_app.crud import history as crud_history
+from fastapi_app.database import run_db
+from fastapi_app.utils import admission, prompt_budget
+from fastapi_app.utils.admission import AdmissionRejected, Priority
 from fastapi_app.utils.gemini_retry import with_gemini_retry # Giả định import này đã đúng
 from pyexpat import model # Giả định model là một đối tượng được định nghĩa ở đâu đó
 from typing import List, Optional
@@ -16,7 +24,7 @@ def call_gemini_api(prompt, content):
 
 router = APIRouter(prefix="/conversation", tags=["Conversation"])
 
-@router.post("/start", response_model=schemas.StartConversationResponse)
+@router.post("/start", response_model=schemas.StartConversationResponse, dependencies=[Depends(rate_limited("chat", Priority.INTERACTIVE))])
 # 🚨 FIX CỰC ĐOAN: Tạm thời chỉ nhận JSON thô (dict) để tránh lỗi validation Pydantic ban đầu
 async def start_conversation(
     raw_body: dict = Body(..., embed=False), 
@@ -51,23 +59,47 @@ async def start_conversation(
         raise e
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-@router.post("/chat/free-talk", response_model=schemas.ChatResponse)
-async def free_talk_message(req: schemas.FreeTalkMessageRequest, current_user=Depends(get_current_user)):
-    session = conversation_service.get_session_details(req.session_id)
+@router.post("/chat/free-talk", response_model=schemas.ChatResponse, dependencies=[Depends(rate_limited("chat", Priority.INTERACTIVE))])
+async def free_talk_message(req: schemas.FreeTalkMessageRequest, background_tasks: BackgroundTasks, current_user=Depends(get_current_user)):
+    session = await run_db(conversation_service.get_session_details, req.session_id, with_messages=False)
     if not session or session["user_id"] != current_user.id:
         raise HTTPException(403, "Not authorized")
+    # Ghi lịch sử của lượt này sau khi response đã gửi
+    background_tasks.add_task(turn_buffer.flush, req.session_id)
     try:
         return await conversation_service.generate_free_talk_reply(
             message=req.message, topic=req.topic, level=req.level, session_id=req.session_id
         )
-    except HTTPException as e:
-        raise e
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# SSE: stream "reply" theo từng token, "feedback" + "metadata" ở event cuối
+@router.post("/chat/free-talk/stream", dependencies=[Depends(rate_limited("chat", Priority.INTERACTIVE))])
+async def free_talk_message_stream(req: schemas.FreeTalkMessageRequest, background_tasks: BackgroundTasks, current_user=Depends(get_current_user)):
+    session = await run_db(conversation_service.get_session_details, req.session_id, with_messages=False)
+    if not session or session["user_id"] != current_user.id:
+        raise HTTPException(403, "Not authorized")
+    # Chạy sau khi stream kết thúc
+    background_tasks.add_task(turn_buffer.flush, req.session_id)
+
+    async def event_stream():
+        async for event, data in conversation_service.stream_free_talk_reply(
+            message=req.message, topic=req.topic, level=req.level, session_id=req.session_id
+        ):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # API xử lý Voice Multimodal cho Free Talk
-@router.post("/chat/free-talk-voice")
+@router.post("/chat/free-talk-voice", dependencies=[Depends(rate_limited("chat", Priority.INTERACTIVE))])
 async def free_talk_voice(
+    background_tasks: BackgroundTasks,
     audio: UploadFile = File(...),
     history: str = Form(...), # Nhận history dạng string nhưng trong flow mới chúng ta dùng context từ DB là chính
     topic: str = Form(...),
@@ -75,22 +107,24 @@ async def free_talk_voice(
     session_id: str = Form(...),
     current_user=Depends(get_current_user)
 ):
-    session = conversation_service.get_session_details(session_id)
+    session = await run_db(conversation_service.get_session_details, session_id, with_messages=False)
     if not session or session["user_id"] != current_user.id:
         raise HTTPException(403, "Not authorized")
+    background_tasks.add_task(turn_buffer.flush, session_id)
     try:
         # Flow: Audio -> Upload -> Model (Transcribe + Reply)
         return await conversation_service.process_free_talk_voice(
             audio=audio, topic=topic, level=level, session_id=session_id
         )
-    except HTTPException as e:
-        raise e
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # API xử lý Voice Multimodal cho Scenario
-@router.post("/evaluate-scenario-voice", response_model=schemas.EvaluateVoiceResponse)
+@router.post("/evaluate-scenario-voice", response_model=schemas.EvaluateVoiceResponse, dependencies=[Depends(rate_limited("chat", Priority.INTERACTIVE))])
 async def evaluate_scenario_voice(
+    background_tasks: BackgroundTasks,
     audio: UploadFile = File(...),
     scenario_id: str = Form(...),
     level: str = Form(...),
@@ -98,36 +132,137 @@ async def evaluate_scenario_voice(
     session_id: str = Form(...),
     current_user=Depends(get_current_user)
 ):
-    session = conversation_service.get_session_details(session_id)
+    session = await run_db(conversation_service.get_session_details, session_id, with_messages=False)
     if not session or session["user_id"] != current_user.id:
         raise HTTPException(403, "Not authorized")
+    background_tasks.add_task(turn_buffer.flush, session_id)
     try:
         return await conversation_service.evaluate_scenario_voice(
             audio=audio, scenario_id=scenario_id, level=level, turn=current_turn, session_id=session_id
         )
-    except HTTPException as e:
-        raise e
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/history")
+# WebSocket cho hội thoại giọng nói (Free Talk / Scenario) của 1 session.
+# - Xác thực 1 lần khi kết nối: ?token=<access_token>
+# - Client gửi các chunk audio dạng binary trong lúc nói
+# - Text JSON: {"type": "config", "topic"?, "level"?, "scenario_id"?, "mime_type"?}
+#              {"type": "end_utterance", "turn"?}  -> gọi model, trả về transcript/reply/feedback
+#              {"type": "cancel"}                  -> bỏ audio đang nhận
+MAX_UTTERANCE_BYTES = 10 * 1024 * 1024
+
+@router.websocket("/ws/{session_id}")
+async def voice_conversation_socket(websocket: WebSocket, session_id: str, token: str = Query(...)):
+    try:
+        current_user = await run_in_threadpool(get_current_user, token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    session = await run_db(conversation_service.get_session_details, session_id, with_messages=False)
+    if not session or session["user_id"] != current_user.id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    prompt_budget.set_caller(current_user.id, "/conversation/ws/{session_id}")
+    config = {"mime_type": "audio/webm"}
+    audio = bytearray()
+
+    try:
+        while True:
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+
+            if msg.get("bytes") is not None:
+                audio.extend(msg["bytes"])
+                if len(audio) > MAX_UTTERANCE_BYTES:
+                    audio.clear()
+                    await websocket.send_json({"type": "error", "detail": "Utterance too large."})
+                continue
+
+            try:
+                data = json.loads(msg.get("text") or "{}")
+            except ValueError:
+                await websocket.send_json({"type": "error", "detail": "Invalid JSON message."})
+                continue
+
+            msg_type = data.get("type")
+            if msg_type == "config":
+                config.update({k: v for k, v in data.items() if k != "type" and v is not None})
+            elif msg_type == "cancel":
+                audio.clear()
+            elif msg_type == "end_utterance":
+                if not audio:
+                    await websocket.send_json({"type": "error", "detail": "No audio received."})
+                    continue
+                utterance = bytes(audio)
+                audio.clear()
+                try:
+                    admission.admit(current_user.id, "chat", Priority.INTERACTIVE)
+                except AdmissionRejected as e:
+                    await websocket.send_json({"type": "error", "detail": "Too many requests.", "retry_after": e.retry_after})
+                    continue
+                try:
+                    result = await conversation_service.process_voice_utterance(
+                        session, utterance, config.get("mime_type") or "audio/webm", {**config, **data}
+                    )
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+                    continue
+
+                await websocket.send_json({"type": "transcript", "text": result.get("transcribed_text")})
+                if session.get("mode") == "scenario":
+                    await websocket.send_json({"type": "reply", "text": result.get("next_ai_reply"), "next_user_suggestion": result.get("next_user_suggestion"), "is_complete": result.get("is_complete")})
+                    await websocket.send_json({"type": "feedback", "text": result.get("immediate_feedback"), "metadata": result.get("metadata")})
+                else:
+                    await websocket.send_json({"type": "reply", "text": result.get("reply")})
+                    await websocket.send_json({"type": "feedback", "text": result.get("feedback"), "metadata": result.get("metadata")})
+
+                # Ghi lịch sử sau khi đã trả kết quả cho client
+                await turn_buffer.flush(session_id)
+            else:
+                await websocket.send_json({"type": "error", "detail": f"Unknown message type: {msg_type}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await turn_buffer.flush(session_id)
+
+@router.get("/history", response_model=List[schemas.HistorySessionListItem])
 async def get_history(current_user=Depends(get_current_user)):
-    return conversation_service.get_all_sessions(current_user.id)
+    return await run_db(conversation_service.get_all_sessions, current_user.id)
+
+@router.get("/sessions", response_model=schemas.HistorySessionPage)
+async def list_sessions(
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[datetime] = Query(None, description="Cursor: created_at của session cuối trang trước"),
+    mode: Optional[str] = Query(None),
+    topic: Optional[str] = Query(None),
+    current_user=Depends(get_current_user)
+):
+    return await run_db(
+        conversation_service.get_sessions_page,
+        current_user.id, limit, before.isoformat() if before else None, mode, topic
+    )
 
 @router.get("/history/{session_id}")
 async def get_conversation_details(session_id: str, current_user=Depends(get_current_user)):
-    session = conversation_service.get_session_details(session_id)
+    await turn_buffer.flush(session_id)
+    session = await run_db(conversation_service.get_session_details, session_id)
     if not session or session["user_id"] != current_user.id:
         raise HTTPException(403, "Not authorized")
     return session
 
 @router.get("/scenarios", response_model=List[schemas.ScenarioInfo])
-def get_scenarios(topic: str = Query(...), level: str = Query(...)):
-    return conversation_service.get_scenarios_for_topic(topic, level)
+async def get_scenarios(topic: str = Query(...), level: str = Query(...)):
+    return await run_db(conversation_service.get_scenarios_for_topic, topic, level)
 
-@router.post("/summarize-conversation", response_model=schemas.SummarizeResponse)
+@router.post("/summarize-conversation", response_model=schemas.SummarizeResponse, dependencies=[Depends(rate_limited("summary"))])
 async def summarize_conversation_endpoint(data: schemas.SummarizeRequest, current_user=Depends(get_current_user)):
-    session = conversation_service.get_session_details(data.session_id)
+    session = await run_db(conversation_service.get_session_details, data.session_id, with_messages=False)
     if not session or session["user_id"] != current_user.id:
         raise HTTPException(403, "Not authorized")
     
@@ -136,16 +271,22 @@ async def summarize_conversation_endpoint(data: schemas.SummarizeRequest, curren
         return await conversation_service.summarize_conversation(
             session_id=data.session_id, topic=data.topic, level=data.level, messages=msgs_list
         )
-    except HTTPException as e:
-        raise e
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/jobs/{job_id}", response_model=schemas.JobStatusResponse)
+async def get_job_status(job_id: str, current_user=Depends(get_current_user)):
+    if not jobs.job_belongs_to(job_id, current_user.id):
+        raise HTTPException(404, "Job not found")
+    return jobs.get_job(job_id)
+
 @router.delete("/delete/{session_id}")
 async def delete_conversation_session(session_id: str, current_user=Depends(get_current_user)):
-    session = conversation_service.get_session_details(session_id)
+    session = await run_db(conversation_service.get_session_details, session_id, with_messages=False)
     if not session or session["user_id"] != current_user.id:
         raise HTTPException(403, "Not authorized")
     # Tốt nhất nên gọi service.delete_session thay vì crud trực tiếp
-    conversation_service.delete_session(session_id, current_user.id)
+    await run_db(conversation_service.delete_session, session_id, current_user.id)
     return {"message": "Deleted"}
\ No newline at end of file
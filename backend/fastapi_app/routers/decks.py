@@ -1,11 +1,14 @@
+import asyncio
 from fastapi import APIRouter, Depends, status, HTTPException, BackgroundTasks
 from typing import List
 from fastapi_app import schemas
 from fastapi_app.schemas.decks import Deck, TopicRequest, DeckSessionResponse
-from fastapi_app.dependencies import get_current_user_id
+from fastapi_app.dependencies import get_current_user_id, rate_limited
+from fastapi_app.utils.admission import Priority
 from fastapi_app.crud import decks as deck_crud
 from fastapi_app.crud import vocabulary as vocab_crud
 from fastapi_app.services import vocabulary
+from fastapi_app.database import run_db
 
 router = APIRouter(
     prefix="/decks", 
@@ -14,28 +17,31 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.Deck, status_code=status.HTTP_201_CREATED)
-def create_new_deck(deck_data: schemas.DeckCreate, user_id: str = Depends(get_current_user_id)):
+async def create_new_deck(deck_data: schemas.DeckCreate, user_id: str = Depends(get_current_user_id)):
     """Tạo một bộ từ (Deck) mới."""
-    return deck_crud.create_deck_for_user(deck_data=deck_data, user_id=user_id)
+    return await run_db(deck_crud.create_deck_for_user, deck_data=deck_data, user_id=user_id)
 
 
 @router.get("/", response_model=List[schemas.DeckWithStats])
-def get_all_user_decks(user_id: str = Depends(get_current_user_id)):
+async def get_all_user_decks(user_id: str = Depends(get_current_user_id)):
     """
     Lấy tất cả các bộ từ của người dùng, KÈM THEO thống kê (stats).
     """
-    return deck_crud.get_all_decks_with_stats(user_id=user_id)
+    return await run_db(deck_crud.get_all_decks_with_stats, user_id=user_id)
 
 
 @router.get("/{deck_id}", response_model=schemas.DeckDetail)
-def get_deck_details(deck_id: int, user_id: str = Depends(get_current_user_id)):
+async def get_deck_details(deck_id: int, user_id: str = Depends(get_current_user_id)):
     """
     Lấy thông tin chi tiết của MỘT bộ từ (API đang bị lỗi 500).
     """
     try:
-        deck_info = deck_crud.get_deck_by_id(deck_id=deck_id, user_id=user_id)
-        stats = vocab_crud.get_stats_for_user(user_id=user_id, deck_id=deck_id)
-        words = vocab_crud.get_words_for_user(user_id=user_id, deck_id=deck_id)
+        deck_info, words = await asyncio.gather(
+            run_db(deck_crud.get_deck_by_id, deck_id=deck_id, user_id=user_id),
+            run_db(vocab_crud.get_words_for_user, user_id=user_id, deck_id=deck_id),
+        )
+        # Stats tính từ chính các từ vừa tải, không cần thêm truy vấn đếm
+        stats = vocab_crud.stats_from_words(words)
 
         return {
             "deck_info": deck_info,
@@ -47,26 +53,26 @@ def get_deck_details(deck_id: int, user_id: str = Depends(get_current_user_id)):
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.patch("/{deck_id}", response_model=schemas.Deck)
-def update_deck_details(
+async def update_deck_details(
     deck_id: int, 
     deck_data: schemas.DeckUpdate, 
     user_id: str = Depends(get_current_user_id)
 ):
     """Cập nhật tên/mô tả của một bộ từ."""
-    return deck_crud.update_deck(deck_id=deck_id, deck_data=deck_data, user_id=user_id)
+    return await run_db(deck_crud.update_deck, deck_id=deck_id, deck_data=deck_data, user_id=user_id)
 
 
 # DELETE
 @router.delete("/{deck_id}", response_model=schemas.SuccessResponse)
-def delete_user_deck(
+async def delete_user_deck(
     deck_id: int,   
     user_id: str = Depends(get_current_user_id)
 ):
     """Xóa một bộ từ."""
-    return deck_crud.delete_deck(deck_id=deck_id, user_id=user_id)
+    return await run_db(deck_crud.delete_deck, deck_id=deck_id, user_id=user_id)
 
 
-@router.post("/create-deck", response_model=Deck) 
+@router.post("/create-deck", response_model=Deck, dependencies=[Depends(rate_limited("deck", Priority.BACKGROUND))]) 
 async def start_topic(
     topic_req: TopicRequest, 
     background_tasks: BackgroundTasks,
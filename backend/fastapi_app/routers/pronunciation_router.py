@@ -1,12 +1,14 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Header
 from fastapi_app.services import pronunciation_service
-from fastapi_app.dependencies import get_current_user_id
+from fastapi_app.dependencies import get_current_user_id, rate_limited
+from fastapi_app.utils.admission import AdmissionRejected
+from fastapi_app.utils.circuit_breaker import CircuitOpenError
 from fastapi_app.schemas.pronunciation_schemas import PronunciationFeedbackResponse
-import json
+from fastapi_app.utils.json_parser import parse_llm_output
 
 router = APIRouter(prefix="/api/pronunciation", tags=["Pronunciation"])
 
-@router.post("/check-freestyle", response_model=PronunciationFeedbackResponse)
+@router.post("/check-freestyle", response_model=PronunciationFeedbackResponse, dependencies=[Depends(rate_limited("pronunciation"))])
 async def check_freestyle_pronunciation(
     file: UploadFile = File(...),
     user_id: str = Depends(get_current_user_id),
@@ -15,15 +17,10 @@ async def check_freestyle_pronunciation(
     try:
         raw_feedback = await pronunciation_service.process_freestyle_pronunciation(file, x_accent)
         
-        # Làm sạch chuỗi JSON từ AI
-        clean_json = raw_feedback.strip()
-        if "```json" in clean_json:
-            clean_json = clean_json.split("```json")[1].split("```")[0].strip()
-        elif "```" in clean_json:
-            clean_json = clean_json.split("```")[1].split("```")[0].strip()
-        
-        feedback_data = json.loads(clean_json)
-        return feedback_data
+        # Tách JSON từ output của AI (bỏ fence / text thừa) và validate theo schema
+        return parse_llm_output(raw_feedback, PronunciationFeedbackResponse)
         
+    except (AdmissionRejected, CircuitOpenError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
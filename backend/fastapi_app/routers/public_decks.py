@@ -3,6 +3,7 @@ from typing import List
 from fastapi_app import schemas
 from fastapi_app.dependencies import get_current_user_id 
 from fastapi_app.crud import public_decks as crud 
+from fastapi_app.database import run_db
 
 router = APIRouter(
     prefix="/public-decks", # API sẽ là /api/public-decks
@@ -11,16 +12,16 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[schemas.PublicDeck])
-def get_all_public_decks_api():
+async def get_all_public_decks_api():
     """
     Lấy danh sách TẤT CẢ các bộ từ 'chính thức' của ứng dụng.
     """
-    return crud.get_all_public_decks()
+    return await run_db(crud.get_all_public_decks)
 
 
 @router.get("/{deck_id}", response_model=schemas.PublicDeckDetail)
-def get_public_deck_details_api(deck_id: int):
+async def get_public_deck_details_api(deck_id: int):
     """
     Lấy thông tin chi tiết của MỘT bộ từ công cộng (để học).
     """
-    return crud.get_public_deck_details(deck_id=deck_id)
\ No newline at end of file
+    return await run_db(crud.get_public_deck_details, deck_id=deck_id)
\ No newline at end of file
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, status
 from typing import List
 from fastapi_app.schemas import quiz_grammar_schemas as schemas
-from fastapi_app.dependencies import get_current_user_id
+from fastapi_app.dependencies import get_current_user_id, rate_limited
+from fastapi_app.utils.admission import Priority
 from fastapi_app.services import quiz_grammar_service 
-from fastapi_app.database import admin_supabase # Cần thiết cho CRUD
+from fastapi_app.database import admin_supabase, run_db # Cần thiết cho CRUD
 
 router = APIRouter(
     prefix="/quiz-grammar", 
@@ -11,7 +12,7 @@ router = APIRouter(
     dependencies=[Depends(get_current_user_id)]
 )
 
-@router.post("/start", response_model=schemas.QuizSessionStartResponse)
+@router.post("/start", response_model=schemas.QuizSessionStartResponse, dependencies=[Depends(rate_limited("grammar_quiz", Priority.BACKGROUND))])
 async def start_grammar_quiz(
     topic_req: schemas.GrammarTopicRequest, 
     background_tasks: BackgroundTasks,
@@ -48,13 +49,13 @@ async def get_quiz_questions(session_id: int, user_id: str = Depends(get_current
         
     # 1. Kiểm tra trạng thái Session
     try:
-        # SỬA LỖI: BỎ 'await' TRƯỚC LỆNH GỌI DB (nếu client là Sync)
-        session_res = admin_supabase.table("QuizSessions") \
+        # Client Supabase là sync: chạy qua run_db để không chặn event loop (endpoint được polling liên tục)
+        session_res = await run_db(lambda: admin_supabase.table("QuizSessions") \
             .select("status") \
             .eq("id", session_id) \
             .eq("user_id", user_id) \
             .single() \
-            .execute()
+            .execute())
         
         # KIỂM TRA DỮ LIỆU AN TOÀN TRƯỚC KHI TRUY CẬP
         if not session_res.data or session_res.data.get("status") is None:
@@ -76,12 +77,11 @@ async def get_quiz_questions(session_id: int, user_id: str = Depends(get_current
 
     # 2. Lấy câu hỏi nếu trạng thái là READY hoặc COMPLETED
     try:
-        # SỬA LỖI: BỎ 'await' TRƯỚC LỆNH GỌI DB (nếu client là Sync)
-        questions_res = admin_supabase.table("QuizQuestions") \
+        questions_res = await run_db(lambda: admin_supabase.table("QuizQuestions") \
             .select("*") \
             .eq("session_id", session_id) \
             .order("id") \
-            .execute()
+            .execute())
         
         return questions_res.data
     except Exception as e:
@@ -6,6 +6,7 @@ from fastapi_app.schemas.vocabulary import SuccessResponse
 from fastapi_app import schemas
 from fastapi_app.dependencies import get_current_user 
 from fastapi_app.services import quizgame as quiz_service
+from fastapi_app.database import run_db
 from fastapi_app.services.quizgame import logger
 router = APIRouter(tags=["Quiz Game"])
 
@@ -14,7 +15,7 @@ router = APIRouter(tags=["Quiz Game"])
     response_model=List[schemas.SmartQuestion], 
     tags=["Quiz Game"]
 )
-def get_smart_quiz_data(
+async def get_smart_quiz_data(
     deck_type: str, 
     deck_id: int,  
     current_user = Depends(get_current_user) 
@@ -25,7 +26,8 @@ def get_smart_quiz_data(
     """
     try:
         user_id = str(current_user.id)
-        return quiz_service.create_smart_quiz(
+        return await run_db(
+            quiz_service.create_smart_quiz,
             deck_type=deck_type, 
             deck_id=deck_id, 
             user_id=user_id
@@ -41,7 +43,7 @@ def get_smart_quiz_data(
     tags=["Quiz Game"],
     status_code=status.HTTP_201_CREATED 
 )
-def submit_quiz_feedback(
+async def submit_quiz_feedback(
     feedback_data: schemas.QuizFeedbackRequest,
     current_user = Depends(get_current_user)
 ):
@@ -51,7 +53,8 @@ def submit_quiz_feedback(
     """
     try:
         user_id = str(current_user.id)
-        return quiz_service.process_quiz_feedback(
+        return await run_db(
+            quiz_service.process_quiz_feedback,
             user_id=user_id, 
             missed_words=feedback_data.missed_words
         )
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi_app.dependencies import rate_limited_by_ip
 from fastapi_app.schemas.test_schemas import PreferenceData, InitialQuizResponse
 from fastapi_app.services.test_service import generate_initial_quiz
 
@@ -7,7 +8,7 @@ router = APIRouter(prefix="/quiz", tags=["Quiz Generation"]) # 🚨 Changed pref
 
 # We can remove the unused imports (Depends, BackgroundTasks) and the redundant router definition.
 
-@router.post("/test", response_model=InitialQuizResponse, status_code=201)
+@router.post("/test", response_model=InitialQuizResponse, status_code=201, dependencies=[Depends(rate_limited_by_ip("diagnostic_test"))])
 async def generate_diagnostic_quiz_endpoint(
     prefs: PreferenceData # FastAPI automatically parses JSON body into PreferenceData
 ):
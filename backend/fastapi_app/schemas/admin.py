@@ -140,4 +140,11 @@ class ScenarioResponse(ScenarioBase):
     dialogues: Optional[List[DialogueLine]] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# --- Định tuyến model LLM (ghi đè lúc chạy) ---
+class LlmRoutingUpdate(BaseModel):
+    task_tiers: Dict[str, str] = Field(default_factory=dict, description="task -> tier, vd: {'greeting': 'lite'}")
+    tier_models: Dict[str, str] = Field(default_factory=dict, description="tier -> tên model")
+    tier_slo: Dict[str, float] = Field(default_factory=dict, description="tier -> ngân sách thời gian (giây)")
+    tier_fallback: Dict[str, Optional[str]] = Field(default_factory=dict, description="tier -> tier dự phòng ('none' để tắt)")
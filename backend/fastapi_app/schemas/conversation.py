@@ -98,6 +98,17 @@ class SummarizeResponse(BaseModel):
     summary_text: str
     overall_score: Optional[float] = Field(None, description="Điểm tổng kết toàn buổi")
     summary_metadata: Optional[Dict[str, Any]] = Field(None, description="Các điểm đánh giá tổng quát")
+    job_id: Optional[str] = Field(None, description="Job nền cập nhật Roadmap (poll qua /conversation/jobs/{job_id})")
+
+class JobStatusResponse(BaseModel):
+    id: str
+    kind: str
+    status: str  # queued | running | succeeded | failed
+    attempts: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
 
 # ===========================
 # --- History ---
@@ -111,6 +122,15 @@ class HistorySession(BaseModel):
     user_id: Optional[str] = None
     lesson_id: Optional[str] = None
 
+class HistorySessionListItem(HistorySession):
+    """Một dòng trong danh sách lịch sử (không kèm nội dung tin nhắn)."""
+    message_count: int = 0
+    has_summary: bool = False
+
+class HistorySessionPage(BaseModel):
+    items: List[HistorySessionListItem] = Field(default_factory=list)
+    next_cursor: Optional[datetime] = Field(None, description="Truyền vào 'before' để lấy trang tiếp theo")
+
 class HistoryMessage(BaseModel):
     role: str
     text: str
@@ -0,0 +1,110 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+from fastapi_app.schemas.test_schemas import QuizQuestion as DiagnosticQuestion
+from fastapi_app.schemas.pronunciation_schemas import PronunciationFeedbackResponse
+
+# Cấu trúc JSON mà Gemini phải trả về cho từng prompt (gửi kèm request dưới dạng response_schema).
+# Không dùng Dict[str, ...] tự do: schema ràng buộc đầu ra của Gemini không hỗ trợ key động.
+
+# --- Conversation ---
+
+class TurnMetadata(BaseModel):
+    grammar_score: Optional[float] = None
+    vocabulary_score: Optional[float] = None
+    pronunciation_score: Optional[float] = None
+    fluency_score: Optional[float] = None
+    tips: Optional[str] = None
+    evaluation: Optional[str] = None
+
+class FreeTalkTextOutput(BaseModel):
+    reply: str
+    feedback: Optional[str] = None
+    metadata: Optional[TurnMetadata] = None
+
+class FreeTalkVoiceOutput(BaseModel):
+    transcribed_text: str
+    reply: str
+    feedback: Optional[str] = None
+    metadata: Optional[TurnMetadata] = None
+
+class ScenarioVoiceOutput(BaseModel):
+    transcribed_text: str
+    immediate_feedback: Optional[str] = None
+    metadata: Optional[TurnMetadata] = None
+
+class SessionSummaryMetadata(BaseModel):
+    grammar: Optional[float] = None
+    vocabulary: Optional[float] = None
+    pronunciation: Optional[float] = None
+    key_grammar_points_observed: List[str] = []
+    key_vocabulary_highlighted: List[str] = []
+    key_pronunciation_points: List[str] = []
+    relevant_vocabulary_suggestions: List[str] = []
+
+class SessionSummaryOutput(BaseModel):
+    summary_text: str
+    summary_metadata: SessionSummaryMetadata
+
+# --- Vocabulary ---
+
+class VocabContextItem(BaseModel):
+    word: str
+    meaning: Optional[str] = None
+    context: Optional[str] = None
+
+class VocabEntryOutput(VocabContextItem):
+    type: Optional[str] = None
+
+# --- Grammar quiz (build_quiz_prompt) ---
+
+class GrammarQuizItemOutput(BaseModel):
+    question: str
+    options: List[str]
+    answer: str = Field(..., description="Key đáp án đúng: A, B, C hoặc D")
+
+# --- Diagnostic test (build_quiz_test_prompt) ---
+
+class DiagnosticQuizOutput(BaseModel):
+    questions: List[DiagnosticQuestion]
+
+# --- Assessment / Roadmap ---
+
+class SpeakingAssessmentOutput(BaseModel):
+    transcript: str
+    speaking_overall: str
+    speaking_weakness: List[str] = []
+
+class RoadmapLessonItem(BaseModel):
+    title: str
+    lesson_id: str
+    type: Optional[str] = None  # "review" với các task ôn tập do AI chèn vào
+
+class RoadmapSkillBlock(BaseModel):
+    title: str
+    lesson_id: str
+    items: List[RoadmapLessonItem]
+
+class RoadmapWeekOutput(BaseModel):
+    week_number: int
+    grammar: RoadmapSkillBlock
+    vocabulary: RoadmapSkillBlock
+    speaking: RoadmapSkillBlock
+    expected_outcome: Optional[str] = None
+
+class RoadmapPhaseOutput(BaseModel):
+    phase_name: str
+    duration_weeks: int
+    weeks: List[RoadmapWeekOutput]
+
+class RoadmapBodyOutput(BaseModel):
+    summary: str
+    current_status: Optional[str] = None
+    daily_plan_recommendation: Optional[str] = None
+    learning_phases: List[RoadmapPhaseOutput]
+
+class RoadmapOutput(BaseModel):
+    user_summary: str
+    estimated_level: str
+    roadmap: RoadmapBodyOutput
+
@@ -1,31 +1,24 @@
 # backend/fastapi_app/services/assessment_service.py
 
 from typing import Dict, List, Any, Union
-from tempfile import NamedTemporaryFile
 from fastapi import UploadFile, HTTPException, Request
 from fastapi_app.schemas.test_schemas import PreferenceData, FinalAssessmentSubmission, QuizQuestion 
 import os
 import json
 import logging
-from google import genai
-from google.genai import types as g_types
-from starlette.concurrency import run_in_threadpool
 from google.genai.errors import APIError
 import base64, mimetypes
-from fastapi_app.database import admin_supabase
+from fastapi_app.database import admin_supabase, run_db
 from fastapi_app.prompts.roadmap import build_roadmap_prompt, build_roadmap_adjustment_prompt
-import anyio
+from fastapi_app.prompts.response_schemas import response_schema_for
 import re # Import thư viện regex
+from fastapi_app.utils.gemini_file_manager import prepare_audio_bytes
+from fastapi_app.services import llm_gateway
+from fastapi_app.utils import prompt_budget
+from fastapi_app.utils.json_parser import extract_json
 
 logger = logging.getLogger(__name__)
 
-# Tận dụng client đã khởi tạo ở phạm vi global từ test_service
-try:
-    from .test_service import client, GEMINI_MODEL 
-except ImportError:
-    client = None
-    # GEMINI_MODEL = "gemini-2.0-flash"
-
 
 # --- HÀM 1: STT VÀ PHÂN TÍCH TRANSCRIPT ---
     
@@ -120,13 +113,13 @@ def initialize_user_progress(learning_phases: List[Dict[str, Any]]) -> Dict[str,
                             }
                             
     return user_progress
-async def analyze_speaking_audio(audio_path: str, client):
-    def _sync_call():
-        with open(audio_path, "rb") as f:
-            audio_bytes = f.read()
+async def analyze_speaking_audio(audio_bytes: bytes, mime_type: str):
+    try:
+        # Audio ngắn gửi inline; audio lớn upload qua Files API (gemini_file_manager dọn dẹp theo lịch)
+        audio_part = await prepare_audio_bytes(audio_bytes, mime_type)
 
-        return client.models.generate_content(
-            model="gemini-2.5-flash-preview-09-2025",
+        response = await llm_gateway.generate(
+            task="speaking_assessment",
             contents=[
                 {
                     "role": "user",
@@ -154,25 +147,13 @@ async def analyze_speaking_audio(audio_path: str, client):
                             - No word count
                             """
                         },
-                        {
-                            "inline_data": {
-                                "mime_type": "audio/mpeg",
-                                "data": audio_bytes
-                            }
-                        }
+                        audio_part
                     ]
                 }
             ],
+            response_schema=response_schema_for("speaking_assessment"),
         )
-
-    try:
-        response = await run_in_threadpool(_sync_call)
-        raw_text = response.text.strip()
-
-        if raw_text.startswith("```"):
-            raw_text = raw_text.replace("```json", "").replace("```", "").strip()
-
-        data = json.loads(raw_text)
+        data = extract_json(response.text, expect=dict)
 
         return {
             "transcript": data.get("transcript", ""),
@@ -195,7 +176,7 @@ async def analyze_and_generate_roadmap(
     payload_data: FinalAssessmentSubmission,
     audio_files: Dict[str, UploadFile]
 ) -> Dict[str, Any]:
-    if client is None:
+    if not llm_gateway.is_configured():
         raise HTTPException(status_code=500, detail="Gemini Client không khả dụng.")
 
     # Chỉ log audio files
@@ -219,16 +200,15 @@ async def analyze_and_generate_roadmap(
                 logger.warning(f"[Speaking] No audio found for Q{raw_key}")
                 continue
 
-            tmp_path = None
             try:
                 file_bytes = await audio_file.read()
-                suffix = os.path.splitext(audio_file.filename)[1] or ".mp3"
-
-                with NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                    tmp_path = tmp.name
-                    await run_in_threadpool(tmp.write, file_bytes)
+                mime_type = (
+                    audio_file.content_type
+                    or mimetypes.guess_type(audio_file.filename or "")[0]
+                    or "audio/mpeg"
+                )
 
-                speaking_result = await analyze_speaking_audio(tmp_path, client)
+                speaking_result = await analyze_speaking_audio(file_bytes, mime_type)
 
                 # Nếu không có lời nói → bỏ qua
                 if not speaking_result.get("transcript") and speaking_result.get("status") == "FALLBACK":
@@ -245,13 +225,6 @@ async def analyze_and_generate_roadmap(
             except Exception as e:
                 logger.warning(f"[Speaking] Failed Q{raw_key}: {e}")
 
-            finally:
-                if tmp_path and os.path.exists(tmp_path):
-                    try:
-                        os.unlink(tmp_path)
-                    except:
-                        pass
-
     
     # --- 3. XÂY DỰNG PROMPT CHO GEMINI và tạo roadmap ---
     prefs = payload_data.preferences
@@ -277,14 +250,13 @@ async def analyze_and_generate_roadmap(
     )
 
     try:
-        roadmap_response = await run_in_threadpool(
-            client.models.generate_content,
-            model="gemini-2.5-flash-preview-09-2025",
-            contents=[roadmap_prompt],
-            config=g_types.GenerateContentConfig(response_mime_type="application/json")
+        roadmap_response = await llm_gateway.generate(
+            [roadmap_prompt],
+            task="roadmap",
+            response_schema=response_schema_for(build_roadmap_prompt)
         )
 
-        roadmap_json = json.loads(roadmap_response.text)
+        roadmap_json = extract_json(roadmap_response.text, expect=dict, allow_partial=False)
         ai_assessed_level = roadmap_json.get("estimated_level", "Unknown")
         user_summary = roadmap_json.get("user_summary", "Không có tóm tắt.")
         raw_roadmap = roadmap_json.get("roadmap", {})
@@ -331,10 +303,10 @@ async def analyze_and_generate_roadmap(
         try:
             # 1. Thực hiện xoá tất cả roadmap hiện có của user này
             # Lệnh delete sẽ xoá tất cả dòng khớp với user_id
-            admin_supabase.table("roadmaps") \
+            await run_db(lambda: admin_supabase.table("roadmaps") \
                 .delete() \
                 .eq("user_id", payload_data.user_id) \
-                .execute()
+                .execute())
             
             logger.info(f"🗑️ Đã xoá lộ trình cũ của user {payload_data.user_id}")
 
@@ -346,9 +318,9 @@ async def analyze_and_generate_roadmap(
             }
 
             # 3. Chèn (Insert) bản ghi mới nhất vào bảng
-            result = admin_supabase.table("roadmaps") \
+            result = await run_db(lambda: admin_supabase.table("roadmaps") \
                 .insert(insert_data) \
-                .execute()
+                .execute())
             
             logger.info(f"✨ Đã lưu lộ trình mới thành công cho user {payload_data.user_id}")
 
@@ -548,7 +520,7 @@ async def create_weekly_summary_record(
         return result.data[0] if result.data else False
 
     try:
-        record = await anyio.to_thread.run_sync(_aggregate_and_insert_sync)
+        record = await run_db(_aggregate_and_insert_sync)
         logger.info(f"✅ Weekly Summary P{phase}_W{week_number} inserted")
         return record
 
@@ -645,14 +617,20 @@ async def generate_and_apply_adaptive_roadmap(
         dynamic_phase_label = "Px"
         # 2. XÂY DỰNG PROMPT CHO AI ĐIỀU CHỈNH
     
-    # Chuyển dữ liệu tuần N+1 gốc sang JSON string để truyền vào Prompt
-    next_week_json = json.dumps(next_week_data_base, indent=2, ensure_ascii=False)
+    # Chuyển dữ liệu tuần N+1 gốc sang JSON string (minified) để truyền vào Prompt
+    next_week_json = prompt_budget.compact_json(next_week_data_base)
     logger.debug(f"Next week JSON (before adjustment): {next_week_json}")
+    # Tuần N+1 phải giữ nguyên vẹn (AI trả lại cấu trúc này); chỉ summary tuần N bị cắt gọn nếu vượt ngân sách
+    template_tokens = prompt_budget.estimate_tokens(build_roadmap_adjustment_prompt(
+        last_week_number, "", next_week_data_base, next_week_json, dynamic_phase_label
+    ))
     prompt = build_roadmap_adjustment_prompt(
         last_week_number=last_week_number,
-        weekly_summary_record=json.dumps(weekly_summary_record, indent=2, ensure_ascii=False), # Cần đảm bảo đây là chuỗi JSON
+        weekly_summary_record=prompt_budget.compact_json(
+            weekly_summary_record, prompt_budget.budget_for("roadmap_adjustment") - template_tokens
+        ),
         next_week_data_base=next_week_data_base,
-        next_week_json=json.dumps(next_week_data_base, indent=2, ensure_ascii=False), # Cần đảm bảo đây là chuỗi JSON
+        next_week_json=next_week_json,
         dynamic_phase_label=dynamic_phase_label
     )
     # prompt = f"""
@@ -682,23 +660,19 @@ async def generate_and_apply_adaptive_roadmap(
     # Please return the adjusted JSON of the NEXT WEEK ROADMAP STRUCTURE in English.
     # """
     # 3. GỌI GEMINI VÀ XỬ LÝ KẾT QUẢ
-    client = genai.Client()
     try:
-        def _call_gemini_sync():
-            return client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt,
-                config=g_types.GenerateContentConfig(
-                    response_mime_type="application/json"
-                )
+        # Có thể chạy trong job nền: ghi nhận token cho đúng user
+        with prompt_budget.caller(user_id=user_id):
+            response = await llm_gateway.generate(
+                prompt,
+                task="roadmap_adjustment",
+                response_schema=response_schema_for(build_roadmap_adjustment_prompt)
             )
 
-        response = await anyio.to_thread.run_sync(_call_gemini_sync)
-
-        modified_next_week_data = json.loads(response.text)
+        modified_next_week_data = extract_json(response.text, expect=dict, allow_partial=False)
         logger.info(f"✅ AI đã hoàn tất điều chỉnh cho Tuần {modified_next_week_data.get('week_number')}.")
         
-    except (APIError, json.JSONDecodeError) as e:
+    except (APIError, ValueError) as e:
         logger.error(f"❌ Lỗi AI hoặc JSON khi điều chỉnh Roadmap: {e}. Sẽ sử dụng cấu trúc Roadmap gốc.")
         modified_next_week_data = next_week_data_base # Dùng cấu trúc gốc nếu AI thất bại
     except Exception as e:
@@ -783,7 +757,7 @@ async def generate_and_apply_adaptive_roadmap(
         return result.data
 
     try:
-        await anyio.to_thread.run_sync(_save_roadmap_sync)
+        await run_db(_save_roadmap_sync)
         logger.info("✅ Roadmap đã được lưu thành công với điều chỉnh từ AI.")
         return True
     except Exception as e:
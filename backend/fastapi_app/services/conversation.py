@@ -1,43 +1,58 @@
-import os
-import json
-import google.generativeai as genai
 from fastapi import UploadFile, HTTPException
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
 
-from fastapi_app.database import admin_supabase
+from fastapi_app.database import admin_supabase, run_db
 from fastapi_app.crud import history as crud_history
 from fastapi_app.crud import scenarios as crud_scenarios
-from fastapi_app.utils.gemini_file_manager import upload_audio_to_gemini
+from fastapi_app.utils.gemini_file_manager import upload_audio_to_gemini, prepare_audio_bytes
+from fastapi_app.utils.json_parser import JsonFieldStreamer, extract_json
 from fastapi_app.prompts import conversation as prompts
+from fastapi_app.prompts.response_schemas import response_schema_for
 from fastapi_app.services import assessment_service
+from fastapi_app.services import turn_buffer
+from fastapi_app.services import conversation_context
+from fastapi_app.services import jobs
+from fastapi_app.services import llm_gateway
+from fastapi_app.services import grammar_check
+from fastapi_app.utils import circuit_breaker, prompt_budget
+from fastapi_app.utils.circuit_breaker import CircuitOpenError
 import anyio
 import logging
 
 # --- Config ---
-GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found.")
-genai.configure(api_key=GEMINI_API_KEY)
-
-MODEL_NAME = "gemini-2.5-flash"
-try:
-    chat_model = genai.GenerativeModel(MODEL_NAME)
-    summary_model = genai.GenerativeModel(MODEL_NAME)
-except Exception as e:
-    print(f"Gemini Init Error: {e}")
-    raise e
+DEGRADED_TEXT_REPLY = "Sorry, I'm having a little trouble thinking right now. Could you tell me more while I catch up?"
+DEGRADED_VOICE_REPLY = "Sorry, I can't listen properly right now. Could you try again in a moment?"
+DEGRADED_SCENARIO_FEEDBACK = "Evaluation is temporarily unavailable. Let's continue with the script!"
+
+# --- Fallbacks khi Gemini lỗi / bị ngắt mạch (circuit breaker) ---
+def _gemini_unavailable() -> bool:
+    # Mạch đang mở (cả model chính lẫn dự phòng): bỏ qua cả bước upload audio, trả fallback ngay
+    return not llm_gateway.is_task_available("voice_eval")
+
+async def _degraded_text_reply(message: str) -> Dict[str, Any]:
+    """Reply giữ nhịp hội thoại + feedback ngữ pháp từ LanguageTool (không cần Gemini)."""
+    feedback = await anyio.to_thread.run_sync(grammar_check.quick_grammar_feedback, message)
+    if feedback is None:
+        feedback = ""
+    elif not feedback:
+        feedback = "No grammar issues found in your message."
+    return {"reply": DEGRADED_TEXT_REPLY, "feedback": feedback, "metadata": {}}
 
 # --- Wrappers ---
 def get_all_sessions(user_id: str):
     return crud_history.get_sessions(admin_supabase, user_id)
 
-def get_session_details(session_id: str):
-    return crud_history.get_session_details(admin_supabase, session_id)
+def get_sessions_page(user_id: str, limit: int, before: Optional[str] = None, mode: Optional[str] = None, topic: Optional[str] = None):
+    return crud_history.get_sessions_page(admin_supabase, user_id, limit, before, mode, topic)
+
+def get_session_details(session_id: str, with_messages: bool = True):
+    return crud_history.get_session_details(admin_supabase, session_id, with_messages)
 
 def get_scenarios_for_topic(topic: str, level: str):
     return crud_scenarios.get_scenarios_by_topic_and_level(admin_supabase, topic, level)
 
 def delete_session(session_id: str, user_id: str):
+    turn_buffer.discard(session_id)
     crud_history.delete_session(admin_supabase, session_id, user_id)
 
 # --- START ---
@@ -50,121 +65,181 @@ async def start_conversation(mode: str, level: str, scenario_id: Optional[str],
     if mode == "scenario":
         if not scenario_id:
             raise HTTPException(400, "Scenario ID required.")
-        scenario = crud_scenarios.get_scenario_by_id_with_dialogues(admin_supabase, scenario_id)
+        scenario = await run_db(crud_scenarios.get_cached_scenario, admin_supabase, scenario_id)
         if not scenario:
             raise HTTPException(404, "Scenario not found.")
         topic_to_save = scenario["title"]
-        if scenario.get("dialogue_lines"):
-            greeting_text = scenario["dialogue_lines"][0]["line"]
-            user_suggestions = [l["line"] for l in scenario["dialogue_lines"] if l["speaker"] == "user"]
+        if scenario["lines"]:
+            greeting_text = scenario["lines"][0][2]
+            user_suggestions = [line for _, speaker, line in scenario["lines"] if speaker == "user"]
     else:
         if not topic: raise HTTPException(400, "Topic required.")
         
         prompt = prompts.get_start_conversation_prompt(level, topic)
         try:
-            response = await chat_model.generate_content_async(prompt)
+            response = await llm_gateway.generate(prompt, task="greeting", cache_family="greeting")
             greeting_text = response.text.strip()
         except Exception:
             greeting_text = f"Hi! Let's talk about {topic}. How are you?"
 
-    session = crud_history.create_session(admin_supabase, mode, level, topic_to_save, user_id, lesson_id)
-    crud_history.append_message_to_history(admin_supabase, session["id"], {
+    session = await run_db(crud_history.create_session, admin_supabase, mode, level, topic_to_save, user_id, lesson_id)
+    await run_db(crud_history.append_message_to_history, admin_supabase, session["id"], {
         "role": "ai", "text": greeting_text, "type": "greeting", "metadata": {}
     })
     return {"greeting": greeting_text, "suggestions": user_suggestions, "session_id": session["id"]}
 
 # --- FREE TALK TEXT ---
 async def generate_free_talk_reply(message: str, topic: str, level: str, session_id: str):
-    crud_history.append_message_to_history(admin_supabase, session_id, {"role": "user", "text": message, "type": "text"})
-    
-    session_data = crud_history.get_session_details(admin_supabase, session_id)
-    messages = session_data.get("messages", [])
-    context_text = "\n".join(f"{m['role']}: {m.get('text','')}" for m in messages[-8:])
+    user_message = {"role": "user", "text": message, "type": "text"}
+
+    await turn_buffer.flush(session_id)
+    context_summary, recent = await run_db(conversation_context.load_context, session_id, conversation_context.TEXT_WINDOW)
+    conversation_context.schedule_refresh(session_id, recent, conversation_context.TEXT_WINDOW)
+    context_text = conversation_context.format_context(recent + [user_message])
 
 
-    full_prompt = prompts.get_free_talk_text_prompt(level, topic, context_text, message)
+    full_prompt = prompts.get_free_talk_text_prompt(level, topic, context_text, message, context_summary)
     
     try:
-        result = await chat_model.generate_content_async(full_prompt)
-        parsed = json.loads(result.text.strip().replace("```json", "").replace("```", ""))
-    except Exception:
-        parsed = {"reply": "Error generating reply.", "feedback": "", "metadata": {}}
+        result = await llm_gateway.generate(
+            full_prompt, task="free_talk_reply",
+            response_schema=response_schema_for(prompts.get_free_talk_text_prompt),
+        )
+        parsed = extract_json(result.text, expect=dict)
+    except Exception as e:
+        print(f"Gemini FreeTalk Text Error: {e}")
+        parsed = await _degraded_text_reply(message)
 
-    crud_history.append_message_to_history(admin_supabase, session_id, {"role": "ai", "text": parsed.get("feedback"), "type": "feedback", "metadata": parsed.get("metadata")})
-    crud_history.append_message_to_history(admin_supabase, session_id, {"role": "ai", "text": parsed.get("reply"), "type": "reply"})
+    # Cả lượt (user + feedback + reply) được ghi 1 lần sau khi response đã gửi (turn_buffer.flush)
+    turn_buffer.stage(session_id, [
+        user_message,
+        {"role": "ai", "text": parsed.get("feedback"), "type": "feedback", "metadata": parsed.get("metadata")},
+        {"role": "ai", "text": parsed.get("reply"), "type": "reply"},
+    ])
 
     return parsed
 
+# --- FREE TALK TEXT (STREAMING) ---
+async def stream_free_talk_reply(message: str, topic: str, level: str, session_id: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Giống generate_free_talk_reply nhưng stream field "reply" theo từng token.
+    Yield (event, data): nhiều event "token" rồi 1 event "final" (reply, feedback, metadata).
+    """
+    user_message = {"role": "user", "text": message, "type": "text"}
+
+    await turn_buffer.flush(session_id)
+    context_summary, recent = await run_db(conversation_context.load_context, session_id, conversation_context.TEXT_WINDOW)
+    conversation_context.schedule_refresh(session_id, recent, conversation_context.TEXT_WINDOW)
+    context_text = conversation_context.format_context(recent + [user_message])
+
+    full_prompt = prompts.get_free_talk_text_prompt(level, topic, context_text, message, context_summary)
+
+    reply_streamer = JsonFieldStreamer("reply")
+    raw_chunks = []
+    streamed = False
+    try:
+        async for text in llm_gateway.generate_stream(
+            full_prompt, task="free_talk_reply",
+            response_schema=response_schema_for(prompts.get_free_talk_text_prompt),
+        ):
+            raw_chunks.append(text)
+            delta = reply_streamer.feed(text)
+            if delta:
+                streamed = True
+                yield "token", {"text": delta}
+        parsed = extract_json("".join(raw_chunks), expect=dict)
+    except Exception as e:
+        print(f"Gemini FreeTalk Stream Error: {e}")
+        parsed = await _degraded_text_reply(message)
+        if not streamed:
+            yield "token", {"text": parsed["reply"]}
+
+    turn_buffer.stage(session_id, [
+        user_message,
+        {"role": "ai", "text": parsed.get("feedback"), "type": "feedback", "metadata": parsed.get("metadata")},
+        {"role": "ai", "text": parsed.get("reply"), "type": "reply"},
+    ])
+
+    yield "final", {
+        "reply": parsed.get("reply"),
+        "feedback": parsed.get("feedback"),
+        "metadata": parsed.get("metadata"),
+    }
+
 # --- FREE TALK VOICE ---
 async def process_free_talk_voice(audio: UploadFile, topic: str, level: str, session_id: str):
-    gemini_file = await upload_audio_to_gemini(audio)
+    gemini_file = None if _gemini_unavailable() else await upload_audio_to_gemini(audio)
+    return await free_talk_voice_turn(gemini_file, topic, level, session_id)
 
-    session_data = crud_history.get_session_details(admin_supabase, session_id)
-    messages = session_data.get("messages", [])
-    context_text = "\n".join(f"{m['role']}: {m.get('text','')}" for m in messages[-6:])
+async def free_talk_voice_turn(gemini_file: Any, topic: str, level: str, session_id: str):
+    """Xử lý 1 lượt nói Free Talk khi audio đã sẵn sàng cho Gemini (HTTP upload hoặc WebSocket)."""
+    await turn_buffer.flush(session_id)
+    context_summary, recent = await run_db(conversation_context.load_context, session_id, conversation_context.VOICE_WINDOW)
+    conversation_context.schedule_refresh(session_id, recent, conversation_context.VOICE_WINDOW)
+    context_text = conversation_context.format_context(recent)
 
-    prompt = prompts.get_free_talk_voice_prompt(level, topic, context_text)
+    prompt = prompts.get_free_talk_voice_prompt(level, topic, context_text, context_summary)
 
     try:
-        response = await chat_model.generate_content_async([prompt, gemini_file])
-        text_res = response.text.strip().replace("```json", "").replace("```", "")
-        parsed = json.loads(text_res)
+        if gemini_file is None:
+            raise CircuitOpenError("voice_eval", circuit_breaker.CB_OPEN_SECONDS)
+        response = await llm_gateway.generate(
+            [prompt, gemini_file], task="voice_eval",
+            response_schema=response_schema_for(prompts.get_free_talk_voice_prompt),
+        )
+        parsed = extract_json(response.text, expect=dict)
     except Exception as e:
         print(f"Gemini FreeTalk Error: {e}")
         parsed = {
-            "transcribed_text": "(Audio Error)", "reply": "Sorry, audio error.", "feedback": "", "metadata": {}
+            "transcribed_text": "(Audio Error)", "reply": DEGRADED_VOICE_REPLY, "feedback": "", "metadata": {}
         }
 
-    # Save DB...
-    crud_history.append_message_to_history(admin_supabase, session_id, {
-        "role": "user", "text": parsed.get("transcribed_text"), "type": "speech"
-    })
-    crud_history.append_message_to_history(admin_supabase, session_id, {
-        "role": "ai", "text": parsed.get("feedback"), "type": "feedback", "metadata": parsed.get("metadata")
-    })
-    crud_history.append_message_to_history(admin_supabase, session_id, {
-        "role": "ai", "text": parsed.get("reply"), "type": "reply"
-    })
+    # Save DB (1 lần ghi cho cả lượt, sau khi response đã gửi)
+    turn_buffer.stage(session_id, [
+        {"role": "user", "text": parsed.get("transcribed_text"), "type": "speech"},
+        {"role": "ai", "text": parsed.get("feedback"), "type": "feedback", "metadata": parsed.get("metadata")},
+        {"role": "ai", "text": parsed.get("reply"), "type": "reply"},
+    ])
     return parsed
 
 # --- SCENARIO VOICE ---
 async def evaluate_scenario_voice(audio: UploadFile, scenario_id: str, level: str, turn: int, session_id: str):
-    gemini_file = await upload_audio_to_gemini(audio)
+    gemini_file = None if _gemini_unavailable() else await upload_audio_to_gemini(audio)
+    return await scenario_voice_turn(gemini_file, scenario_id, level, turn, session_id)
 
-    scenario = crud_scenarios.get_scenario_by_id_with_dialogues(admin_supabase, scenario_id)
+async def scenario_voice_turn(gemini_file: Any, scenario_id: str, level: str, turn: int, session_id: str):
+    """Chấm 1 lượt nói Scenario khi audio đã sẵn sàng cho Gemini (HTTP upload hoặc WebSocket)."""
+    scenario = await run_db(crud_scenarios.get_cached_scenario, admin_supabase, scenario_id)
     if not scenario: raise HTTPException(404, "Scenario not found")
     
-    correct_line = next((l for l in scenario["dialogue_lines"] if l["turn"] == turn and l["speaker"] == "user"), None)
-    correct_text = correct_line["line"] if correct_line else "(No expected line)"
+    correct_text = crud_scenarios.get_dialogue_line(scenario, turn, "user") or "(No expected line)"
 
     prompt = prompts.get_scenario_voice_prompt(level, correct_text)
 
     try:
-        response = await chat_model.generate_content_async([prompt, gemini_file])
-        text_res = response.text.strip().replace("```json", "").replace("```", "")
-        parsed = json.loads(text_res)
+        if gemini_file is None:
+            raise CircuitOpenError("voice_eval", circuit_breaker.CB_OPEN_SECONDS)
+        response = await llm_gateway.generate(
+            [prompt, gemini_file], task="voice_eval",
+            response_schema=response_schema_for(prompts.get_scenario_voice_prompt),
+        )
+        parsed = extract_json(response.text, expect=dict)
     except Exception as e:
         print(f"Gemini Scenario Error: {e}")
+        # Kịch bản vẫn đi tiếp bằng câu thoại có sẵn, chỉ bỏ qua phần chấm điểm
         parsed = {
-            "transcribed_text": "(Audio Error)", "immediate_feedback": "Error.", "metadata": {}
+            "transcribed_text": "(Audio Error)", "immediate_feedback": DEGRADED_SCENARIO_FEEDBACK, "metadata": {}
         }
 
-    crud_history.append_message_to_history(admin_supabase, session_id, {
-        "role": "user", "text": parsed.get("transcribed_text"), "type": "speech"
-    })
-    crud_history.append_message_to_history(admin_supabase, session_id, {
-        "role": "ai", "text": parsed.get("immediate_feedback"), "type": "feedback", "metadata": parsed.get("metadata")
-    })
-
-    next_ai_line = next((l for l in scenario["dialogue_lines"] if l["turn"] == turn + 1 and l["speaker"] == "ai"), None)
-    next_ai_text = next_ai_line["line"] if next_ai_line else "Scenario completed!"
+    next_ai_text = crud_scenarios.get_dialogue_line(scenario, turn + 1, "ai") or "Scenario completed!"
     
-    crud_history.append_message_to_history(admin_supabase, session_id, {
-        "role": "ai", "text": next_ai_text, "type": "reply"
-    })
+    turn_buffer.stage(session_id, [
+        {"role": "user", "text": parsed.get("transcribed_text"), "type": "speech"},
+        {"role": "ai", "text": parsed.get("immediate_feedback"), "type": "feedback", "metadata": parsed.get("metadata")},
+        {"role": "ai", "text": next_ai_text, "type": "reply"},
+    ])
 
-    next_user_line = next((l for l in scenario["dialogue_lines"] if l["turn"] == turn + 2 and l["speaker"] == "user"), None)
-    next_user_text = next_user_line["line"] if next_user_line else None
+    next_user_text = crud_scenarios.get_dialogue_line(scenario, turn + 2, "user")
 
     return {
         "transcribed_text": parsed.get("transcribed_text"),
@@ -175,6 +250,24 @@ async def evaluate_scenario_voice(audio: UploadFile, scenario_id: str, level: st
         "metadata": parsed.get("metadata")
     }
 
+# --- VOICE OVER WEBSOCKET ---
+async def process_voice_utterance(session: Dict[str, Any], audio_bytes: bytes, mime_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Xử lý 1 câu nói nhận qua WebSocket (audio đã ghép từ các chunk).
+    Chọn Free Talk hoặc Scenario theo mode của session; topic/level lấy từ session nếu client không gửi.
+    """
+    gemini_file = None if _gemini_unavailable() else await prepare_audio_bytes(audio_bytes, mime_type)
+    level = config.get("level") or session.get("level")
+
+    if session.get("mode") == "scenario":
+        scenario_id = config.get("scenario_id")
+        if not scenario_id:
+            raise HTTPException(400, "Scenario ID required.")
+        return await scenario_voice_turn(gemini_file, scenario_id, level, int(config.get("turn", 0)), session["id"])
+
+    topic = config.get("topic") or session.get("topic")
+    return await free_talk_voice_turn(gemini_file, topic, level, session["id"])
+
 # --- SUMMARIZE ---
 
 # Hàm hỗ trợ tính điểm trung bình (Chỉ tính các điểm số có giá trị)
@@ -206,7 +299,8 @@ CONVERSATION_MASTERY_THRESHOLD = 0.80
 MAX_ATTEMPTS = 4
 async def summarize_conversation(session_id: str, topic: str, level: str, messages: Optional[List[Dict[str, Any]]] = None):
     
-    session_data = crud_history.get_session_details(admin_supabase, session_id)
+    await turn_buffer.flush(session_id)
+    session_data = await run_db(crud_history.get_session_details, admin_supabase, session_id)
     if not session_data: 
         raise HTTPException(404, "Session not found")
     
@@ -240,19 +334,26 @@ async def summarize_conversation(session_id: str, topic: str, level: str, messag
     parsed = {"summary_text": "Error/Already summarized.", "summary_metadata": {}}
     
     if not session_already_summarized:
+        # Buổi dài: giữ phần mở đầu + các lượt cuối của transcript trong ngân sách token của prompt
+        template_tokens = prompt_budget.estimate_tokens(prompts.get_summary_prompt(mode, level, topic, ""))
+        transcript = prompt_budget.fit_lines(
+            transcript_lines, prompt_budget.budget_for("session_summary") - template_tokens
+        )
         prompt = prompts.get_summary_prompt(mode, level, topic, transcript)
         
         try:
-            res = await summary_model.generate_content_async(prompt)
-            text_res = res.text.strip().replace("```json", "").replace("```", "")
-            parsed = json.loads(text_res)
+            res = await llm_gateway.generate(
+                prompt, task="session_summary",
+                response_schema=response_schema_for(prompts.get_summary_prompt),
+            )
+            parsed = extract_json(res.text, expect=dict)
         except Exception as e:
             # logger.error(f"Gemini Summarize Error: {e}") 
             parsed = {"summary_text": "Error summarizing.", "summary_metadata": {}}
         
-        # 3. LƯU summary VÀO DB
-        updated_msgs = messages + [{"role": "ai", "text": parsed.get("summary_text"), "type": "summary", "metadata": parsed.get("summary_metadata")}]
-        crud_history.update_session_summary(admin_supabase, session_id, parsed.get("summary_text"), updated_msgs)
+        # 3. LƯU summary VÀO DB (chỉ append tin nhắn summary)
+        summary_message = {"role": "ai", "text": parsed.get("summary_text"), "type": "summary", "metadata": parsed.get("summary_metadata")}
+        await run_db(crud_history.update_session_summary, admin_supabase, session_id, parsed.get("summary_text"), summary_message)
         
     else:
         # Lấy metadata cũ nếu đã có summary
@@ -264,122 +365,125 @@ async def summarize_conversation(session_id: str, topic: str, level: str, messag
 
 
     # ==========================================================
-    # 🚨 FIX TÍNH NĂNG: TÍNH ĐIỂM TỔNG HỢP VÀ CẬP NHẬT ROADMAP
+    # 🚨 TÍNH ĐIỂM TỔNG HỢP VÀ CẬP NHẬT ROADMAP: chạy nền qua hàng đợi job
     # ==========================================================
+    # Response trả về ngay khi có summary; client poll /conversation/jobs/{job_id}.
+    # Job idempotent theo session: gọi lại (vd: summarize lần 2) không cộng thêm lượt thử.
+    if lesson_id_to_mark and user_id and mode in ["free", "scenario"]:
+        job_id = jobs.job_id_for("conversation_progress", session_id)
+        # Session đã summarize trước đó: chỉ trả lại job cũ (và chạy lại nếu job đó FAILED)
+        if not session_already_summarized or jobs.get_job(job_id):
+            parsed["job_id"] = jobs.enqueue(
+                "conversation_progress", session_id, user_id,
+                track_conversation_progress,
+                session_id, user_id, lesson_id_to_mark, parsed.get("summary_metadata") or {}
+            )
+
+    return parsed
+
 
+async def track_conversation_progress(session_id: str, user_id: str, lesson_id: str, summary_metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Job nền: cập nhật tiến độ bài Speaking trong roadmap, và nếu tuần đã hoàn tất thì
+    tạo weekly summary + điều chỉnh roadmap bằng AI.
+    Mỗi session chỉ được tính 1 lần (ghi 'last_session_id' vào tiến độ của lesson).
+    """
+    # TÍNH ĐIỂM TỔNG HỢP
+    overall_score = float(calculate_overall_speaking_score(summary_metadata))
+    overall_score = max(0.0, min(overall_score, 1.0))
+    mastery_achieved = overall_score >= CONVERSATION_MASTERY_THRESHOLD
+
+    # 4. Lấy bản ghi Roadmap hiện tại
+    roadmap_record = await run_db(assessment_service.get_user_roadmap, user_id)
+    if not (roadmap_record and isinstance(roadmap_record, dict) and roadmap_record.get('data')):
+        logger.warning(f"Roadmap not found for user {user_id}. Skipping roadmap update.")
+        return {"status": "NO_ROADMAP"}
+
+    current_roadmap_data = roadmap_record['data']
+    current_progress = current_roadmap_data.get('user_progress', {})
+    roadmap_id = roadmap_record.get('id')
+    if not roadmap_id:
+        logger.warning(f"Roadmap ID not found for user {user_id}. Skipping roadmap update.")
+        return {"status": "NO_ROADMAP"}
+
+    # 5a. LẤY TRẠNG THÁI CŨ & TÍNH LƯỢT THỬ
+    task_progress = current_progress.get(lesson_id, {"type": "speaking"})
+    if task_progress.get("last_session_id") == session_id:
+        # Session này đã được tính (job chạy lại) -> không cộng lượt thử lần nữa
+        return {"status": task_progress.get("status"), "score": task_progress.get("score"), "already_tracked": True}
+
+    current_attempt = task_progress.get("attempt_count", 0) + 1
+
+    # Xác định trạng thái mới
+    if mastery_achieved:
+        new_completed = True
+        new_status = "SUCCESS"
+    elif current_attempt >= MAX_ATTEMPTS:
+        new_completed = False
+        new_status = "END_OF_ATTEMPTS"
+    else:
+        new_completed = False
+        new_status = "PENDING"
+
+    # 5b. Cập nhật trạng thái của lesson_id đó
+    current_progress[lesson_id] = {
+        **task_progress,
+        "completed": new_completed,
+        "score": round(overall_score, 2),
+        "attempt_count": current_attempt,
+        "status": new_status,
+        "type": "speaking",
+        "last_session_id": session_id
+    }
+    current_roadmap_data['user_progress'] = current_progress
+
+    # 6. Lưu lại toàn bộ bản ghi roadmaps
+    def db_update_sync():
+        return admin_supabase.table("roadmaps") \
+            .update({"data": current_roadmap_data}) \
+            .eq("id", roadmap_id) \
+            .execute()
 
-    if lesson_id_to_mark and user_id and mode in ["free", "scenario"] and not session_already_summarized:
-                
-            summary_metadata = parsed.get("summary_metadata", {})
-
-            # TÍNH ĐIỂM TỔNG HỢP
-            overall_score = calculate_overall_speaking_score(summary_metadata) 
-            overall_score = float(overall_score)
-            overall_score = max(0.0, min(overall_score, 1.0))
-            mastery_achieved = overall_score >= CONVERSATION_MASTERY_THRESHOLD
-            try:
-            # 4. Lấy bản ghi Roadmap hiện tại
-                roadmap_record = await anyio.to_thread.run_sync(
-                    assessment_service.get_user_roadmap, 
-                    user_id 
+    await run_db(db_update_sync)
+    logger.info(f"✅ [PROGRESS TRACKED] Speaking {lesson_id} updated (Status: {new_status}).")
+
+    # ==========================================================
+    # 🚨 BƯỚC 7: KIỂM TRA HOÀN THÀNH TUẦN VÀ KÍCH HOẠT ĐIỀU CHỈNH AI
+    # ==========================================================
+    roadmap_adjusted = False
+    try:
+        completed_week_data = assessment_service.get_week_data_by_lesson_id(lesson_id, current_roadmap_data)
+
+        if completed_week_data:
+            week_number = completed_week_data.get('week_number', 'UNKNOWN')
+            is_week_resolved = assessment_service.check_week_completion(current_progress, completed_week_data)
+
+            if is_week_resolved:
+                logger.info(f"🚨 [WEEK STATUS] Tuần {week_number} ĐÃ HOÀN TẤT. KÍCH HOẠT ĐIỀU CHỈNH AI.")
+                summary_record = await assessment_service.create_weekly_summary_record(
+                    user_id=user_id,
+                    completed_week_data=completed_week_data,
+                    current_progress=current_progress,
+                    admin_supabase=admin_supabase
                 )
-                
-                if roadmap_record and isinstance(roadmap_record, dict) and roadmap_record.get('data'):
-                    
-                    current_roadmap_data = roadmap_record['data']
-                    current_progress = current_roadmap_data.get('user_progress', {})
-                    roadmap_id = roadmap_record.get('id')
-
-                    # 5a. LẤY TRẠNG THÁI CŨ & TÍNH LƯỢT THỬ
-                    task_progress = current_progress.get(lesson_id_to_mark, {"type": "speaking"}) 
-                    current_attempt = task_progress.get("attempt_count", 0) + 1
-                    
-                    # Xác định trạng thái mới
-                    new_completed = False 
-                    if mastery_achieved:
-                        new_completed = True
-                        new_status = "SUCCESS"
-                    elif current_attempt >= MAX_ATTEMPTS:
-                        new_completed = False
-                        new_status = "END_OF_ATTEMPTS"
-                    else:
-                        new_completed = False
-                        new_status = "PENDING"
-
-                # 5b. Cập nhật trạng thái của lesson_id đó
-                    update_data = {
-                        **task_progress,
-                        "completed": new_completed, 
-                        "score": round(float(overall_score), 2),
-                        "attempt_count": current_attempt,
-                        "status": new_status,
-                        "type": "speaking" 
-                    }
-
-                current_progress[lesson_id_to_mark] = update_data
-                current_roadmap_data['user_progress'] = current_progress
-
-                # 6. Lưu lại toàn bộ bản ghi roadmaps
-                if roadmap_id:
-                    def db_update_sync():
-                        return admin_supabase.table("roadmaps") \
-                            .update({"data": current_roadmap_data}) \
-                            .eq("id", roadmap_id) \
-                            .execute()
-                            
-                    await anyio.to_thread.run_sync(db_update_sync)
-                    logger.info(f"✅ [PROGRESS TRACKED] Speaking {lesson_id_to_mark} updated (Status: {new_status}).")
-
-                    # ==========================================================
-                    # 🚨 BƯỚC 7: KIỂM TRA HOÀN THÀNH TUẦN VÀ KÍCH HOẠT ĐIỀU CHỈNH AI
-                    # ==========================================================
-                    try:
-                        completed_week_data = assessment_service.get_week_data_by_lesson_id(
-                            lesson_id_to_mark, 
-                            current_roadmap_data
-                        )
-                        
-                        if completed_week_data:
-                            week_number = completed_week_data.get('week_number', 'UNKNOWN')
-                            
-                            is_week_resolved = assessment_service.check_week_completion(
-                                current_progress, 
-                                completed_week_data
-                            ) 
-                            
-                            if is_week_resolved:
-                                logger.info(f"🚨 [WEEK STATUS] Tuần {week_number} ĐÃ HOÀN TẤT. KÍCH HOẠT ĐIỀU CHỈNH AI.")
-                                summary_record = await assessment_service.create_weekly_summary_record(
-                                    user_id=user_id,
-                                    completed_week_data=completed_week_data,
-                                    current_progress=current_progress, 
-                                    admin_supabase=admin_supabase
-                                )
-                                
-                                if summary_record:
-                                    # GỌI HÀM ĐIỀU CHỈNH BẰNG AI
-                                    await assessment_service.generate_and_apply_adaptive_roadmap(
-                                        user_id,
-                                        summary_record,
-                                        current_roadmap_data,
-                                        admin_supabase
-                                    )
-                                else:
-                                    logger.error("❌ Lỗi: Không thể tạo bản ghi tóm tắt tuần.")
-                            else:
-                                logger.info(f"☑️ [WEEK STATUS] Tuần {week_number} CHƯA HOÀN TẤT. (Pending tasks remain).")
-                        else:
-                            logger.warning(f"Lesson ID {lesson_id_to_mark} not found in Roadmap structure.")
-
-                    except Exception as e:
-                        logger.warning(f"Lỗi khi kiểm tra hoàn thành tuần/điều chỉnh AI (Speaking): {e}")
-                        pass
 
+                if summary_record:
+                    # GỌI HÀM ĐIỀU CHỈNH BẰNG AI
+                    await assessment_service.generate_and_apply_adaptive_roadmap(
+                        user_id,
+                        summary_record,
+                        current_roadmap_data,
+                        admin_supabase
+                    )
+                    roadmap_adjusted = True
                 else:
-                    logger.warning(f"Roadmap ID not found for user {user_id}. Skipping roadmap update.")
+                    logger.error("❌ Lỗi: Không thể tạo bản ghi tóm tắt tuần.")
+            else:
+                logger.info(f"☑️ [WEEK STATUS] Tuần {week_number} CHƯA HOÀN TẤT. (Pending tasks remain).")
+        else:
+            logger.warning(f"Lesson ID {lesson_id} not found in Roadmap structure.")
 
-            except Exception as e:
-                logger.error(f"Lỗi trong quá trình cập nhật Roadmap (Conversation): {e}")
-                pass # Vẫn trả về parsed dù cập nhật roadmap thất bại
+    except Exception as e:
+        logger.warning(f"Lỗi khi kiểm tra hoàn thành tuần/điều chỉnh AI (Speaking): {e}")
 
-    return parsed
\ No newline at end of file
+    return {"status": new_status, "score": round(overall_score, 2), "roadmap_adjusted": roadmap_adjusted}
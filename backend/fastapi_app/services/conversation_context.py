@@ -0,0 +1,88 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Set, Tuple
+
+
+from fastapi_app.database import admin_supabase, run_db
+from fastapi_app.crud import history as crud_history
+from fastapi_app.prompts import conversation as prompts
+from fastapi_app.services import llm_gateway
+from fastapi_app.utils import admission
+
+logger = logging.getLogger(__name__)
+
+# Số tin nhắn gần nhất luôn đưa nguyên văn vào prompt
+TEXT_WINDOW = 8
+VOICE_WINDOW = 6
+# Khi số tin nhắn đã rời khỏi cửa sổ mà chưa được tóm tắt đạt ngưỡng này thì refresh summary
+# (mỗi lượt free talk = 3 tin nhắn: user, feedback, reply)
+SUMMARY_REFRESH_EVERY = int(os.getenv("CONTEXT_SUMMARY_REFRESH_EVERY", "9"))
+
+# Session đang refresh summary (tránh chạy trùng)
+_refreshing: Set[str] = set()
+# Giữ tham chiếu tới task nền để không bị GC giữa chừng
+_tasks: Set[asyncio.Task] = set()
+
+
+def format_context(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{m['role']}: {m.get('text','')}" for m in messages)
+
+
+def load_context(session_id: str, window: int) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Trả về (rolling summary, các tin nhắn chưa được tóm tắt).
+    Số tin nhắn trả về bị chặn ở window + SUMMARY_REFRESH_EVERY nên prompt luôn có kích thước giới hạn.
+    Gọi sau turn_buffer.flush để lịch sử đã đầy đủ.
+    """
+    session = crud_history.get_session_details(admin_supabase, session_id, with_messages=False) or {}
+    summary = session.get("context_summary") or ""
+    summary_seq = session.get("context_summary_seq") or 0
+    recent = crud_history.get_message_range(
+        admin_supabase, session_id, min_seq=summary_seq, limit=window + SUMMARY_REFRESH_EVERY
+    )
+    return summary, recent
+
+
+def schedule_refresh(session_id: str, recent: List[Dict[str, Any]], window: int) -> None:
+    """
+    Nếu số tin nhắn nằm ngoài cửa sổ gần nhất đã đủ ngưỡng, chạy refresh summary ở nền
+    (không chặn lượt hiện tại). Lượt hiện tại vẫn thấy các tin nhắn đó nguyên văn.
+    """
+    overflow = recent[:-window] if len(recent) > window else []
+    if len(overflow) < SUMMARY_REFRESH_EVERY or session_id in _refreshing:
+        return
+    _refreshing.add(session_id)
+    # Task mới chép context của request -> hạ priority trong task để không chen trước lượt chat
+    with admission.background_priority():
+        task = asyncio.create_task(_refresh_summary(session_id, overflow))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _refresh_summary(session_id: str, overflow: List[Dict[str, Any]]) -> None:
+    try:
+        session = await run_db(crud_history.get_session_details, admin_supabase, session_id, with_messages=False)
+        if not session:
+            return
+        previous = session.get("context_summary") or ""
+        start_seq = session.get("context_summary_seq") or 0
+        # Chỉ tóm tắt phần chưa có trong summary (phòng khi có lần refresh khác vừa xong)
+        new_messages = [m for m in overflow if m["seq"] >= start_seq]
+        if not new_messages:
+            return
+
+        prompt = prompts.get_context_summary_prompt(previous, format_context(new_messages))
+        response = await llm_gateway.generate(prompt, task="context_summary")
+        summary_text = response.text.strip()
+        if not summary_text:
+            return
+
+        await run_db(
+            crud_history.update_context_summary,
+            admin_supabase, session_id, summary_text, new_messages[-1]["seq"] + 1
+        )
+    except Exception as e:
+        logger.warning(f"Context summary refresh failed for session {session_id}: {e}")
+    finally:
+        _refreshing.discard(session_id)
@@ -1,5 +1,5 @@
 import requests
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import requests
 from fastapi import HTTPException
@@ -47,4 +47,34 @@ def grammar_check_service(req: GrammarRequest) -> GrammarResponse:
         corrected_text=corrected_text,
         count=len(errors),
         errors=errors
-    )
\ No newline at end of file
+    )
+
+
+# Timeout ngắn: chỉ dùng làm fallback khi Gemini không khả dụng, không được làm chậm lượt chat
+FALLBACK_TIMEOUT_SECONDS = 3
+
+
+def quick_grammar_feedback(text: str, max_issues: int = 3) -> Optional[str]:
+    """
+    Feedback ngữ pháp ngắn gọn từ LanguageTool (không qua Gemini).
+    Trả về None nếu không gọi được; "" nếu không phát hiện lỗi.
+    """
+    try:
+        response = requests.post(
+            "https://api.languagetool.org/v2/check",
+            data={"text": text, "language": "en-US"},
+            timeout=FALLBACK_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+        matches = response.json().get("matches", [])
+    except (requests.RequestException, ValueError) as e:
+        print(f"LanguageTool fallback error: {e}")
+        return None
+
+    issues = []
+    for match in matches[:max_issues]:
+        wrong = text[match["offset"]:match["offset"] + match["length"]]
+        replacements = [r["value"] for r in match.get("replacements", [])[:2]]
+        hint = f" → {' / '.join(replacements)}" if replacements else ""
+        issues.append(f'"{wrong}"{hint}: {match["message"]}')
+    return "\n".join(issues)
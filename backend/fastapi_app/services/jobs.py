@@ -0,0 +1,140 @@
+import os
+import uuid
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from cachetools import TTLCache
+
+from fastapi_app.utils import admission
+
+logger = logging.getLogger(__name__)
+
+# Hàng đợi job nền trong process (roadmap tracking, điều chỉnh roadmap bằng AI, ...).
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Trạng thái job được giữ lại trong khoảng này (giây) để client poll
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_jobs: TTLCache = TTLCache(maxsize=10000, ttl=JOB_RETENTION_SECONDS)
+_jobs_lock = threading.Lock()
+_queue: Optional[asyncio.Queue] = None
+_workers: List[asyncio.Task] = []
+
+
+def job_id_for(kind: str, key: str) -> str:
+    """Job id cố định theo (kind, key): cùng một việc luôn có cùng id."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{kind}:{key}"))
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    return _public(job) if job else None
+
+
+def enqueue(kind: str, key: str, user_id: Optional[str], func: Callable[..., Awaitable[Any]], *args, **kwargs) -> str:
+    """
+    Đưa job vào hàng đợi và trả về job_id.
+    Idempotent theo (kind, key): nếu job đang chờ/đang chạy/đã xong thì không tạo lại,
+    chỉ job FAILED (hoặc đã hết hạn lưu) mới được chạy lại.
+    """
+    job_id = job_id_for(kind, key)
+    with _jobs_lock:
+        existing = _jobs.get(job_id)
+        if existing and existing["status"] != FAILED:
+            return job_id
+        _jobs[job_id] = {
+            "id": job_id,
+            "kind": kind,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "attempts": (existing or {}).get("attempts", 0),
+            "created_at": _now(),
+            "updated_at": _now(),
+            "_user_id": user_id,
+            "_call": (func, args, kwargs),
+        }
+    _get_queue().put_nowait(job_id)
+    return job_id
+
+
+def job_belongs_to(job_id: str, user_id: str) -> bool:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    return bool(job) and job.get("_user_id") == user_id
+
+
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    return _queue
+
+
+def _update(job_id: str, **fields) -> Optional[Dict[str, Any]]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        job.update(fields, updated_at=_now())
+        return job
+
+
+async def _worker() -> None:
+    queue = _get_queue()
+    while True:
+        job_id = await queue.get()
+        try:
+            with _jobs_lock:
+                job = _jobs.get(job_id)
+                if job is not None:
+                    job.update(status=RUNNING, attempts=job["attempts"] + 1, updated_at=_now())
+            if job is None:
+                continue  # Job đã hết hạn lưu trước khi tới lượt
+            func, args, kwargs = job["_call"]
+            try:
+                # Job nền: lời gọi LLM xếp hàng sau request tương tác
+                with admission.background_priority():
+                    result = await func(*args, **kwargs)
+                _update(job_id, status=SUCCEEDED, result=result, error=None)
+            except Exception as e:
+                logger.error(f"[Jobs] {job['kind']} {job_id} failed: {e}")
+                _update(job_id, status=FAILED, error=str(e))
+        finally:
+            queue.task_done()
+
+
+def start_workers() -> None:
+    """Khởi động worker (gọi trong startup event của app)."""
+    if _workers:
+        return
+    for _ in range(JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop_workers(timeout: float = 10.0) -> None:
+    """Chờ các job còn trong hàng đợi (tối đa timeout giây) rồi dừng worker."""
+    if _queue is not None and _workers:
+        try:
+            await asyncio.wait_for(_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("[Jobs] Shutdown with pending jobs.")
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
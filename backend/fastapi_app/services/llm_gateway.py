@@ -0,0 +1,370 @@
+"""
+LLM gateway: điểm gọi Gemini DUY NHẤT của backend.
+
+- Một google.genai Client dùng chung (pool kết nối httpx được tái sử dụng), gọi qua client.aio.
+- Định tuyến task -> tier model (services/model_routing.py): SLO thời gian + tier dự phòng.
+- Giới hạn số request đồng thời theo từng model, hàng đợi có ưu tiên (utils/admission.py).
+- Timeout thống nhất cho mọi lời gọi.
+- Retry không block event loop (backoff có jitter, tôn trọng retry-after, deadline cho cả lời gọi).
+- Upload / xóa file trên Files API cũng đi qua đây.
+- Tùy chọn cache response theo prompt (cache_family, xem utils/llm_cache.py).
+- Single-flight: các lời gọi đồng thời với cùng prompt text chỉ gửi 1 request lên Gemini.
+- Circuit breaker theo model (utils/circuit_breaker.py): khi Gemini lỗi liên tục thì fail ngay,
+  prompt có cache_family được trả bản cache cũ (stale) làm fallback.
+- Structured output: response_schema (pydantic, xem prompts/response_schemas.py) ràng buộc JSON trả về.
+- Đếm token theo task / endpoint / user và cảnh báo prompt vượt ngân sách (utils/prompt_budget.py).
+
+Các service chỉ cần:
+    response = await llm_gateway.generate(prompt, task="roadmap", json_mode=True)
+    text = response.text
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from google import genai
+from google.genai import types as g_types
+from dotenv import load_dotenv
+
+from fastapi_app.utils.gemini_retry import retry_async, retry_reason
+from fastapi_app.utils.circuit_breaker import CircuitOpenError, CircuitBreaker, breaker_for, is_open as is_circuit_open
+from fastapi_app.utils import llm_cache, admission, metrics, prompt_budget
+from fastapi_app.services import model_routing
+from fastapi_app.utils.single_flight import SingleFlight
+from fastapi_app.utils.json_parser import extract_json, parse_llm_output
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+# Tên model giữ lại cho các chỗ cần model cụ thể; call site nên dùng task=... (model_routing)
+DEFAULT_MODEL = model_routing.DEFAULT_MODEL
+PREVIEW_MODEL = model_routing.PREVIEW_MODEL
+
+# Timeout (giây) cho 1 lời gọi generate / 1 lần upload
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# Số request đồng thời tối đa cho mỗi model. Ghi đè riêng: LLM_MODEL_CONCURRENCY="gemini-2.5-flash=16,gemini-2.5-pro=2"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+
+def _parse_model_limits(raw: str) -> Dict[str, int]:
+    limits = {}
+    for item in raw.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            try:
+                limits[name.strip()] = int(value)
+            except ValueError:
+                logger.warning(f"[LLM Gateway] Invalid concurrency override: {item}")
+    return limits
+
+
+_MODEL_LIMITS = _parse_model_limits(os.getenv("LLM_MODEL_CONCURRENCY", ""))
+_client: Optional[genai.Client] = None
+_inflight = SingleFlight("llm")
+
+
+def is_configured() -> bool:
+    return bool(GEMINI_API_KEY)
+
+
+def get_client() -> genai.Client:
+    """Client dùng chung cho toàn process (tạo 1 lần, lazy)."""
+    global _client
+    if _client is None:
+        if not GEMINI_API_KEY:
+            raise RuntimeError("GOOGLE_API_KEY not found.")
+        _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
+
+
+def _limiter(model: str) -> admission.PriorityLimiter:
+    # Request chờ slot theo priority của request hiện tại (chat trước, tác vụ nền sau)
+    return admission.limiter(model, _MODEL_LIMITS.get(model, LLM_MAX_CONCURRENCY))
+
+
+def _merge_options(json_mode: bool, config: Optional[Dict[str, Any]], response_schema: Any = None) -> Dict[str, Any]:
+    options = dict(config or {})
+    if response_schema is not None:
+        # Schema pydantic (hoặc list[Model]); SDK tự chuyển thành schema của Gemini
+        options.setdefault("response_schema", response_schema)
+        json_mode = True
+    if json_mode:
+        options.setdefault("response_mime_type", "application/json")
+    return options
+
+
+def _build_config(options: Dict[str, Any]) -> Optional[g_types.GenerateContentConfig]:
+    return g_types.GenerateContentConfig(**options) if options else None
+
+
+class CachedResponse:
+    """Response lấy từ llm_cache (cùng giao diện .text với response của SDK)."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _is_valid_json(text: str) -> bool:
+    try:
+        extract_json(text, allow_partial=False)
+        return True
+    except ValueError:
+        return False
+
+
+def _schema_validator(schema: Any) -> Callable[[str], bool]:
+    def _validate(text: str) -> bool:
+        try:
+            parse_llm_output(text, schema)
+            return True
+        except ValueError:  # ValidationError của pydantic cũng là ValueError
+            return False
+    return _validate
+
+
+async def generate(
+    contents: Any,
+    *,
+    task: Optional[str] = None,
+    model: Optional[str] = None,
+    json_mode: bool = False,
+    config: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    cache_family: Optional[str] = None,
+    cache_validate: Optional[Callable[[str], bool]] = None,
+    response_schema: Any = None,
+):
+    """
+    Gọi generate_content (async). contents nhận mọi dạng google.genai hỗ trợ:
+    str, list[str | Part | dict], list[Content dict].
+    Lỗi tạm thời (429/5xx/timeout) được thử lại; mỗi lần thử giới hạn bởi timeout.
+
+    task: tên tác vụ trong services/model_routing.py -> chọn model, ngân sách thời gian (SLO)
+    và tier dự phòng khi model chính lỗi / bị ngắt mạch. model (nếu truyền) bỏ qua định tuyến.
+
+    cache_family: bật cache response cho prompt text thuần. Chỉ response hợp lệ mới được lưu
+    (cache_validate, mặc định: khớp response_schema, hoặc parse được JSON với json_mode).
+
+    response_schema: schema pydantic của JSON cần trả về (bật json_mode).
+    """
+    tier = model_routing.route(task) if task and not model else None
+    model = model or (tier.model if tier else DEFAULT_MODEL)
+    if cache_family:
+        cached = await llm_cache.get(cache_family, model, contents)
+        if cached is not None:
+            return CachedResponse(cached)
+
+    options = _merge_options(json_mode, config, response_schema)
+    prompt_tokens = prompt_budget.check(task, contents) if task else 0
+    started = time.monotonic()
+    try:
+        response = await _generate_on(model, contents, options, timeout, tier.slo if tier else None)
+        served_by = tier
+    except Exception as e:
+        if not _is_unavailable(e):
+            raise
+        response = None
+        fallback = model_routing.fallback_for(tier) if tier else None
+        if fallback is not None:
+            logger.warning(f"[LLM Gateway] {model} unavailable for '{task}' ({e.__class__.__name__}), falling back to tier '{fallback.name}'")
+            metrics.increment("llm_tier_fallback", task=task, tier=fallback.name)
+            try:
+                response = await _generate_on(fallback.model, contents, options, timeout, fallback.slo)
+                served_by = fallback
+            except Exception as fallback_error:
+                if not _is_unavailable(fallback_error):
+                    raise
+        if response is None:
+            stale = await llm_cache.get_stale(cache_family, model, contents) if cache_family else None
+            if stale is not None:
+                logger.warning(f"[LLM Gateway] {model} unavailable ({e.__class__.__name__}), serving stale '{cache_family}'")
+                return CachedResponse(stale)
+            raise
+
+    if tier:
+        _record_task_usage(task, served_by, time.monotonic() - started, tier.slo)
+    if task:
+        prompt_budget.record_usage(task, *prompt_budget.usage_tokens(response, prompt_tokens))
+
+    if cache_family:
+        if cache_validate:
+            validate = cache_validate
+        elif response_schema is not None:
+            validate = _schema_validator(response_schema)
+        else:
+            validate = _is_valid_json if json_mode else None
+        text = response.text or ""
+        try:
+            is_valid = validate(text) if validate else bool(text.strip())
+        except Exception:
+            is_valid = False
+        if is_valid:
+            await llm_cache.put(cache_family, model, contents, text)
+    return response
+
+
+def is_task_available(task: str) -> bool:
+    """False nếu cả model chính lẫn tier dự phòng của task đều đang bị ngắt mạch."""
+    tier = model_routing.route(task)
+    fallback = model_routing.fallback_for(tier)
+    return not (is_circuit_open(tier.model) and (fallback is None or is_circuit_open(fallback.model)))
+
+
+def _is_unavailable(error: Exception) -> bool:
+    """Lỗi do model không phục vụ được (ngắt mạch, quá tải, hết retry) -> đáng thử tier dự phòng / cache cũ."""
+    return isinstance(error, (CircuitOpenError, admission.AdmissionRejected)) or bool(retry_reason(error))
+
+
+async def _generate_on(model: str, contents: Any, options: Dict[str, Any], timeout: Optional[float], slo: Optional[float]):
+    """1 lời gọi (có retry, circuit breaker, single-flight) lên 1 model; slo giới hạn tổng thời gian."""
+    breaker = breaker_for(model)
+    per_attempt = timeout or LLM_TIMEOUT_SECONDS
+    retry_options = {}
+    if slo:
+        per_attempt = min(per_attempt, slo)
+        retry_options["deadline"] = slo
+
+    async def _call():
+        breaker.before_call()
+        return await _guarded(breaker, retry_async(
+            _generate_once, model, contents, _build_config(options),
+            timeout=per_attempt, label=model, **retry_options,
+        ))
+
+    flight_key = _flight_key(model, contents, options)
+    return await (_inflight.do(flight_key, _call) if flight_key else _call())
+
+
+def _record_task_usage(task: str, tier: model_routing.ModelTier, elapsed: float, slo: float) -> None:
+    metrics.increment("llm_task_calls", task=task, tier=tier.name)
+    metrics.increment("llm_task_latency_ms", round(elapsed * 1000), task=task)
+    metrics.increment("llm_cost_units", tier.cost, task=task)
+    if elapsed > slo:
+        metrics.increment("llm_slo_violations", task=task, tier=tier.name)
+
+
+async def _guarded(breaker: CircuitBreaker, call: Awaitable[Any]) -> Any:
+    """Ghi nhận kết quả lời gọi (đã qua retry) vào circuit breaker của model."""
+    try:
+        result = await call
+    except BaseException as e:
+        if isinstance(e, Exception) and retry_reason(e):
+            breaker.record_failure()
+        else:
+            breaker.release_probe()  # Lỗi phía request / bị hủy: không nói lên gì về upstream
+        raise
+    breaker.record_success()
+    return result
+
+
+def _flight_key(model: str, contents: Any, options: Dict[str, Any]) -> Optional[str]:
+    """Key gộp request: chỉ với prompt text thuần (audio/file thì mỗi request là duy nhất)."""
+    prompt_key = llm_cache.cache_key("flight", model, contents)
+    if prompt_key is None:
+        return None
+    return f"{prompt_key}:{json.dumps(options, sort_keys=True, default=str)}"
+
+
+async def _generate_once(model: str, contents: Any, config: Optional[g_types.GenerateContentConfig], timeout: float):
+    # Giữ slot của model chỉ trong lúc gọi; thời gian chờ retry không chiếm slot
+    async with _limiter(model).slot():
+        return await asyncio.wait_for(
+            get_client().aio.models.generate_content(model=model, contents=contents, config=config),
+            timeout,
+        )
+
+
+async def generate_stream(
+    contents: Any,
+    *,
+    model: Optional[str] = None,
+    json_mode: bool = False,
+    config: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    response_schema: Any = None,
+    task: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream text từng chunk. Timeout áp dụng cho toàn bộ stream (mặc định: SLO của tier nếu có task).
+    Chỉ thử lại khi MỞ stream; đã nhận chunk thì không retry (tránh lặp nội dung).
+    """
+    tier = model_routing.route(task) if task and not model else None
+    model = model or (tier.model if tier else DEFAULT_MODEL)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (timeout or (tier.slo if tier else LLM_TIMEOUT_SECONDS))
+    stream_config = _build_config(_merge_options(json_mode, config, response_schema))
+    prompt_tokens = prompt_budget.check(task, contents) if task else 0
+    output_parts = []
+    usage = None
+
+    async def _open_stream(timeout: float):
+        return await asyncio.wait_for(
+            get_client().aio.models.generate_content_stream(
+                model=model, contents=contents, config=stream_config
+            ),
+            timeout,
+        )
+
+    breaker = breaker_for(model)
+    breaker.before_call()
+    try:
+        async with _limiter(model).slot():
+            stream = await _guarded(breaker, retry_async(
+                _open_stream, timeout=max(deadline - loop.time(), 0.001), label=model,
+                deadline=max(deadline - loop.time(), 0.001),
+            ))
+            iterator = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    breaker.record_failure()  # Stream treo giữa chừng cũng là dấu hiệu upstream suy giảm
+                    raise
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                output_parts.append(chunk.text or "")
+                yield chunk.text or ""
+    except admission.AdmissionRejected:
+        breaker.release_probe()
+        raise
+    if task:
+        # Chunk cuối của stream mang usage_metadata của cả lời gọi
+        prompt_budget.record_usage(
+            task,
+            getattr(usage, "prompt_token_count", None) or prompt_tokens,
+            getattr(usage, "candidates_token_count", None) or prompt_budget.estimate_tokens(output_parts),
+        )
+
+
+def audio_part(data: bytes, mime_type: str) -> g_types.Part:
+    """Part audio gửi inline trong request."""
+    return g_types.Part.from_bytes(data=data, mime_type=mime_type)
+
+
+def file_part(uploaded_file) -> g_types.Part:
+    """Part tham chiếu tới file đã upload lên Files API."""
+    return g_types.Part.from_uri(file_uri=uploaded_file.uri, mime_type=uploaded_file.mime_type)
+
+
+async def upload_file(file: Any, mime_type: str, timeout: Optional[float] = None):
+    """Upload lên Files API (file: path hoặc file-like như io.BytesIO)."""
+    async def _upload_once(timeout: float):
+        if hasattr(file, "seek"):
+            file.seek(0)  # Thử lại thì đọc lại từ đầu
+        return await asyncio.wait_for(
+            get_client().aio.files.upload(file=file, config=g_types.UploadFileConfig(mime_type=mime_type)),
+            timeout,
+        )
+
+    return await retry_async(_upload_once, timeout=timeout or LLM_TIMEOUT_SECONDS, label="files.upload")
+
+
+def delete_file(name: str) -> None:
+    """Xóa file trên Files API (đồng bộ, dùng trong thread dọn dẹp)."""
+    get_client().files.delete(name=name)
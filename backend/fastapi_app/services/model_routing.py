@@ -0,0 +1,153 @@
+"""
+Bảng định tuyến tác vụ -> tầng model (tier).
+
+Mỗi call site gọi Gemini khai báo task (vd: "greeting", "roadmap"); gateway tra bảng này để chọn
+model, ngân sách thời gian (latency SLO) và tầng dự phòng khi model chính lỗi / bị ngắt mạch.
+
+    response = await llm_gateway.generate(prompt, task="greeting")
+
+Ghi đè bằng biến môi trường (cùng định dạng với LLM_MODEL_CONCURRENCY):
+    LLM_TASK_TIERS="greeting=fast,vocab_enrichment=quality"
+    LLM_TIER_MODELS="lite=gemini-2.0-flash-lite"
+    LLM_TIER_SLO="fast=15"                # giây
+    LLM_TIER_FALLBACK="quality=lite,lite=none"
+hoặc lúc chạy qua PUT /admin/llm-routing (override_routing).
+"""
+import os
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Model mặc định cho các tác vụ hội thoại
+DEFAULT_MODEL = os.getenv("GEMINI_DEFAULT_MODEL", "gemini-2.5-flash")
+# Model preview đang dùng cho các tác vụ sinh JSON (quiz, vocab, pronunciation, roadmap)
+PREVIEW_MODEL = os.getenv("GEMINI_PREVIEW_MODEL", "gemini-2.5-flash-preview-09-2025")
+# Model rẻ/nhanh nhất cho tác vụ đơn giản (câu chào, rolling summary)
+LITE_MODEL = os.getenv("GEMINI_LITE_MODEL", "gemini-2.5-flash-lite")
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    name: str
+    model: str
+    slo: float                # Ngân sách thời gian (giây) cho cả lời gọi, tính cả retry
+    fallback: Optional[str]   # Tier dự phòng (None = không có)
+    cost: float = 1.0         # Đơn vị chi phí tương đối, để thống kê (metrics llm_cost_units)
+
+
+TIERS: Dict[str, ModelTier] = {
+    "lite": ModelTier("lite", LITE_MODEL, slo=10, fallback="fast", cost=0.3),
+    "fast": ModelTier("fast", DEFAULT_MODEL, slo=25, fallback="lite", cost=1.0),
+    "quality": ModelTier("quality", PREVIEW_MODEL, slo=90, fallback="fast", cost=1.0),
+}
+
+TASK_TIERS: Dict[str, str] = {
+    "greeting": "lite",             # conversation.start_conversation
+    "free_talk_reply": "fast",      # chat text / SSE
+    "voice_eval": "fast",           # free-talk voice + scenario voice
+    "context_summary": "lite",      # rolling summary (conversation_context)
+    "session_summary": "fast",      # summarize_conversation
+    "vocab_enrichment": "lite",     # vocabulary.build_vocab_enrichment_prompt
+    "deck_vocab": "quality",        # vocabulary.build_topic_generation_prompt
+    "grammar_quiz": "quality",      # quiz_grammar_service
+    "diagnostic_test": "quality",   # test_service
+    "roadmap": "quality",           # assessment_service.analyze_and_generate_roadmap
+    "roadmap_adjustment": "fast",   # assessment_service.generate_and_apply_adaptive_roadmap
+    "speaking_assessment": "quality",
+    "pronunciation": "quality",
+}
+
+_lock = threading.Lock()
+
+
+def _parse_pairs(raw: str) -> Dict[str, str]:
+    pairs = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+def override_routing(
+    task_tiers: Optional[Dict[str, str]] = None,
+    tier_models: Optional[Dict[str, str]] = None,
+    tier_slo: Optional[Dict[str, float]] = None,
+    tier_fallback: Optional[Dict[str, Optional[str]]] = None,
+) -> None:
+    """
+    Ghi đè bảng định tuyến (env lúc khởi động hoặc admin lúc chạy).
+    Kiểm tra toàn bộ trước rồi mới áp dụng: có 1 mục không hợp lệ thì raise ValueError và không đổi gì.
+    """
+    with _lock:
+        tiers = dict(TIERS)
+        for tier, model in (tier_models or {}).items():
+            if not model:
+                raise ValueError(f"Empty model for tier '{tier}'")
+            tiers[tier] = replace(_tier(tiers, tier), model=model)
+        for tier, slo in (tier_slo or {}).items():
+            if float(slo) <= 0:
+                raise ValueError(f"SLO for tier '{tier}' must be > 0 (got {slo})")
+            tiers[tier] = replace(_tier(tiers, tier), slo=float(slo))
+        for tier, fallback in (tier_fallback or {}).items():
+            fallback = None if fallback in (None, "", "none") else fallback
+            if fallback is not None and fallback not in tiers:
+                raise ValueError(f"Unknown fallback tier '{fallback}'")
+            tiers[tier] = replace(_tier(tiers, tier), fallback=fallback)
+        for task, tier in (task_tiers or {}).items():
+            if tier not in tiers:
+                raise ValueError(f"Unknown tier '{tier}' for task '{task}'")
+
+        TIERS.update(tiers)
+        TASK_TIERS.update(task_tiers or {})
+
+
+def _tier(tiers: Dict[str, ModelTier], name: str) -> ModelTier:
+    if name not in tiers:
+        raise ValueError(f"Unknown tier '{name}'")
+    return tiers[name]
+
+
+def route(task: str) -> ModelTier:
+    """Tier của task; task chưa khai báo dùng tier 'fast'."""
+    tier_name = TASK_TIERS.get(task)
+    if tier_name is None:
+        logger.warning(f"[Model Routing] Unknown task '{task}', using 'fast'")
+        tier_name = "fast"
+    return TIERS[tier_name]
+
+
+def fallback_for(tier: ModelTier) -> Optional[ModelTier]:
+    """Tier dự phòng, bỏ qua nếu trùng model với tier chính (không có gì để chuyển sang)."""
+    fallback = TIERS.get(tier.fallback) if tier.fallback else None
+    if fallback is None or fallback.model == tier.model:
+        return None
+    return fallback
+
+
+def model_for(task: str) -> str:
+    return route(task).model
+
+
+def snapshot() -> Dict[str, Dict]:
+    return {
+        "tiers": {name: vars(tier) for name, tier in TIERS.items()},
+        "tasks": dict(TASK_TIERS),
+    }
+
+
+try:
+    override_routing(
+        task_tiers=_parse_pairs(os.getenv("LLM_TASK_TIERS", "")),
+        tier_models=_parse_pairs(os.getenv("LLM_TIER_MODELS", "")),
+        tier_slo={k: float(v) for k, v in _parse_pairs(os.getenv("LLM_TIER_SLO", "")).items()},
+        tier_fallback=_parse_pairs(os.getenv("LLM_TIER_FALLBACK", "")),
+    )
+except ValueError as e:
+    logger.warning(f"[Model Routing] Invalid override ignored: {e}")
@@ -1,9 +1,7 @@
-import google.generativeai as genai
 from fastapi import UploadFile
-import os
 from fastapi_app.prompts.pronunciation import PRONUNCIATION_COACH_PROMPT 
-
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+from fastapi_app.prompts.response_schemas import response_schema_for
+from fastapi_app.services import llm_gateway
 
 async def process_freestyle_pronunciation(audio_file: UploadFile, accent: str):
     audio_data = await audio_file.read()
@@ -12,13 +10,8 @@ async def process_freestyle_pronunciation(audio_file: UploadFile, accent: str):
     accent_name = "British English" if accent == "en-GB" else "American English"
     custom_prompt = f"Target Accent for evaluation: {accent_name}. {PRONUNCIATION_COACH_PROMPT}"
     
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash-preview-09-2025",
-        generation_config={"response_mime_type": "application/json"}
-    )
-    
-    response = await model.generate_content_async(
-        contents=[
+    response = await llm_gateway.generate(
+        [
             {
                 "role": "user",
                 "parts": [
@@ -31,6 +24,8 @@ async def process_freestyle_pronunciation(audio_file: UploadFile, accent: str):
                     }
                 ]
             }
-        ]
+        ],
+        task="pronunciation",
+        response_schema=response_schema_for("PRONUNCIATION_COACH_PROMPT")
     )
     return response.text
\ No newline at end of file
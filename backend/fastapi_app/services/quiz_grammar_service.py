@@ -1,38 +1,20 @@
 # fastapi_app/services/quiz_grammar_service.py
 
-import json
 from typing import List, Dict, Any
-from fastapi_app.database import admin_supabase
+from fastapi_app.database import admin_supabase, run_db
 from fastapi_app.services.user import get_user_level
 from fastapi_app.services.assessment_service import get_user_roadmap
 from fastapi_app.prompts import grammar as prompts
-import google.generativeai as genai
+from fastapi_app.prompts.response_schemas import response_schema_for
 from fastapi_app.services import assessment_service
+from fastapi_app.services import llm_gateway
+from fastapi_app.utils.json_parser import parse_llm_items
+from fastapi_app.schemas.llm_outputs import GrammarQuizItemOutput
 import traceback
-import os
 import logging
-import anyio
 # from google import genai
 # from google.genai import types as g_types
 
-# ============================
-# INIT MODEL
-# ============================
-try:
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    print(f"DEBUG: Loaded API Key (first 5 chars): {GOOGLE_API_KEY[:5] if GOOGLE_API_KEY else 'NONE'}")
-    if not GOOGLE_API_KEY:
-        model = None
-    else:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        model = genai.GenerativeModel(
-            "gemini-2.5-flash-preview-09-2025",
-            generation_config={
-                "response_mime_type": "application/json"
-            }
-        )
-except Exception:
-    model = None
 # ============================
 # CREATE NEW SESSION
 # ============================
@@ -41,14 +23,14 @@ async def create_new_quiz_session(user_id: str, topic_name: str, lesson_id: str)
     if admin_supabase is None:
         raise Exception("Supabase not initialized")
 
-    res = admin_supabase.table("QuizSessions").insert({
+    res = await run_db(lambda: admin_supabase.table("QuizSessions").insert({
         "user_id": user_id,
         "topic": topic_name,
         "lesson_id": lesson_id,
         "status": "GENERATING",
         "score": 0.0,
         "total_questions": 0
-    }).execute()
+    }).execute())
 
     return res.data[0]
 
@@ -62,11 +44,11 @@ async def check_if_lesson_completed(user_id: str, lesson_id: str) -> bool:
         return False
 
     try:
-        res = admin_supabase.table("CompletedTopics") \
+        res = await run_db(lambda: admin_supabase.table("CompletedTopics") \
             .select("count()") \
             .eq("user_id", user_id) \
             .eq("lesson_id", lesson_id) \
-            .execute()
+            .execute())
 
         return (res.count or 0) > 0
 
@@ -79,13 +61,13 @@ async def check_if_lesson_completed(user_id: str, lesson_id: str) -> bool:
 # ============================
 
 async def generate_quiz_questions(session_id: int, topic_name: str, user_id: str):
-    if not model or admin_supabase is None:
+    if not llm_gateway.is_configured() or admin_supabase is None:
         print("Model or Supabase missing.")
         return
 
     try:
         # LEVEL
-        current_level = get_user_level(user_id)
+        current_level = await run_db(get_user_level, user_id)
         print(f"[DEBUG] User Level: {current_level}")
 
         # PROMPT
@@ -93,38 +75,44 @@ async def generate_quiz_questions(session_id: int, topic_name: str, user_id: str
         print(f"[DEBUG] Prompt Sent to AI")
 
         # ===== FIXED HERE =====
-        response = await model.generate_content_async(prompt)
+        response = await llm_gateway.generate(
+            prompt, task="grammar_quiz", cache_family="grammar_quiz",
+            response_schema=response_schema_for(prompts.build_quiz_prompt),
+        )
         ai_text = response.text
         print(f"[DEBUG] RAW AI RESPONSE: {ai_text}")
 
-        # CLEAN JSON
-        ai_text = ai_text.replace("```json", "").replace("```", "").strip()
-        raw_questions = json.loads(ai_text)
+        # CLEAN JSON (chịu được fence / text thừa) + validate từng câu, bỏ câu thiếu field.
+        # Không nhận output bị cắt cụt: câu hỏi dở dang không được ghi vào DB.
+        questions = parse_llm_items(ai_text, GrammarQuizItemOutput)
 
         # SAVE QUESTION
         to_insert = []
-        for q in raw_questions:
+        for q in questions:
             to_insert.append({
                 "session_id": session_id,
                 "user_id": user_id,
-                "question_text": q.get("question"),
-                "options": q.get("options"),
-                "correct_answer": q.get("answer"),
+                "question_text": q.question,
+                "options": q.options,
+                "correct_answer": q.answer,
                 "topic": topic_name
             })
 
         if len(to_insert):
-            admin_supabase.table("QuizQuestions").insert(to_insert).execute()
+            await run_db(lambda: admin_supabase.table("QuizQuestions").insert(to_insert).execute())
 
-            admin_supabase.table("QuizSessions").update({
+            await run_db(lambda: admin_supabase.table("QuizSessions").update({
                 "status": "READY",
                 "total_questions": len(to_insert)
-            }).eq("id", session_id).execute()
+            }).eq("id", session_id).execute())
 
             print(f"[DEBUG] Quiz READY: {len(to_insert)} questions created")
 
         else:
-            print("[WARN] AI returned empty question set")
+            print("[WARN] AI returned no valid questions")
+            await run_db(lambda: admin_supabase.table("QuizSessions").update({
+                "status": "ERROR"
+            }).eq("id", session_id).execute())
 
     except Exception as e:
         print("=" * 60)
@@ -132,9 +120,9 @@ async def generate_quiz_questions(session_id: int, topic_name: str, user_id: str
         traceback.print_exc()
         print("=" * 60)
 
-        admin_supabase.table("QuizSessions").update({
+        await run_db(lambda: admin_supabase.table("QuizSessions").update({
             "status": "ERROR"
-        }).eq("id", session_id).execute()
+        }).eq("id", session_id).execute())
 
 async def get_quiz_result_by_session(session_id: int):
     """
@@ -143,11 +131,11 @@ async def get_quiz_result_by_session(session_id: int):
     if admin_supabase is None:
         raise Exception("Supabase not initialized")
 
-    res = admin_supabase.table("QuizSessions") \
+    res = await run_db(lambda: admin_supabase.table("QuizSessions") \
         .select("score, total_questions, weak_areas") \
         .eq("id", session_id) \
         .maybe_single() \
-        .execute()
+        .execute())
 
     if not res.data:
         return None
@@ -176,9 +164,9 @@ async def grade_and_track_quiz(session_id: int, user_id: str, answers: Dict[int,
 
     # 1. GET QUESTIONS & CHẤM ĐIỂM
     # ... (Logic chấm điểm giữ nguyên) ...
-    res = admin_supabase.table("QuizQuestions") \
+    res = await run_db(lambda: admin_supabase.table("QuizQuestions") \
         .select("id, correct_answer, topic") \
-        .eq("session_id", session_id).execute()
+        .eq("session_id", session_id).execute())
 
     db_questions = {q["id"]: q for q in res.data}
     correct = 0
@@ -199,8 +187,11 @@ async def grade_and_track_quiz(session_id: int, user_id: str, answers: Dict[int,
     mastery_achieved = score >= MASTERY_THRESHOLD
     
     # Chuẩn bị báo cáo điểm yếu/khuyến nghị
-    session_info_topic = admin_supabase.table("QuizSessions").select("topic").eq("id", session_id).single().execute()
-    topic_chinh = session_info_topic.data["topic"]
+    # Lấy topic + lesson_id của session trong 1 lần đọc
+    session_info = await run_db(lambda: admin_supabase.table("QuizSessions") \
+            .select("topic, lesson_id") \
+            .eq("id", session_id).single().execute())
+    topic_chinh = session_info.data["topic"]
     
     weak_areas_report = []
     if not mastery_achieved:
@@ -210,18 +201,14 @@ async def grade_and_track_quiz(session_id: int, user_id: str, answers: Dict[int,
 
 
     # 3. UPDATE SESSION (Lưu kết quả vào QuizSessions)
-    session_info_full = admin_supabase.table("QuizSessions") \
-            .select("lesson_id") \
-            .eq("id", session_id).single().execute()
-            
     # Lấy lesson_id CẦN ĐÁNH DẤU
-    lesson_id_to_mark = session_info_full.data.get("lesson_id")
+    lesson_id_to_mark = session_info.data.get("lesson_id")
     
-    admin_supabase.table("QuizSessions").update({
+    await run_db(lambda: admin_supabase.table("QuizSessions").update({
         "status": "COMPLETED",
         "score": score,
         "weak_areas": weak_areas_report 
-    }).eq("id", session_id).execute()
+    }).eq("id", session_id).execute())
 
     
     # ================================================================
@@ -229,7 +216,7 @@ async def grade_and_track_quiz(session_id: int, user_id: str, answers: Dict[int,
     # ================================================================
     if lesson_id_to_mark:
         try:
-            roadmap_record = assessment_service.get_user_roadmap(user_id) # Giả định đây là hàm sync
+            roadmap_record = await run_db(assessment_service.get_user_roadmap, user_id)
             
             if roadmap_record and roadmap_record.get('data'):
                 current_roadmap_data = roadmap_record['data']
@@ -264,14 +251,14 @@ async def grade_and_track_quiz(session_id: int, user_id: str, answers: Dict[int,
                         "status": new_status              
                     }
                     
-                    # 4b. Lưu lại toàn bộ bản ghi roadmaps (Sử dụng run_sync vì hàm là async)
+                    # 4b. Lưu lại toàn bộ bản ghi roadmaps (hàm sync, chạy qua run_db)
                     def db_update_sync():
                          return admin_supabase.table("roadmaps") \
                             .update({"data": current_roadmap_data}) \
                             .eq("id", roadmap_id) \
                             .execute()
                             
-                    await anyio.to_thread.run_sync(db_update_sync)
+                    await run_db(db_update_sync)
                     
                     logger.info(f"✅ [PROGRESS TRACKED] Grammar {lesson_id_to_mark} updated (Status: {new_status}).")
 
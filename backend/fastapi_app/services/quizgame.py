@@ -7,9 +7,8 @@ from fastapi_app.schemas.decks import QuizResultCreate
 from fastapi_app.crud import decks as decks_crud 
 from fastapi_app.crud import vocabulary as vocab_crud
 import logging
-from fastapi_app.database import admin_supabase
+from fastapi_app.database import admin_supabase, run_db
 from fastapi_app.services import assessment_service
-import anyio
 # --- CẤU HÌNH QUIZ ---
 TOTAL_QUESTIONS = 10
 NUM_MC_C2V = 4
@@ -255,7 +254,7 @@ async def process_save_quiz_result(result_data: QuizResultCreate, user_id: str):
         }
         
         # Gọi hàm CRUD để lưu kết quả
-        response = vocab_crud.insert_quiz_result(data_to_insert)
+        response = await run_db(vocab_crud.insert_quiz_result, data_to_insert)
 
         if not response.data:
             raise HTTPException(status_code=500, detail="Lỗi: Không thể lưu kết quả vào database (No data returned).")
@@ -302,8 +301,8 @@ async def process_quiz_completion(user_id: str, result_data: QuizResultCreate):
         if lesson_id_to_mark:
             logger.info(f"Triggering direct roadmap update for {lesson_id_to_mark} (Voca). Score: {score}")
 
-            # 3a. Lấy bản ghi Roadmap hiện tại (Sử dụng run_sync vì hàm là def)
-            roadmap_record = await anyio.to_thread.run_sync(
+            # 3a. Lấy bản ghi Roadmap hiện tại (hàm sync, chạy qua run_db)
+            roadmap_record = await run_db(
                 assessment_service.get_user_roadmap, 
                 user_id 
             )
@@ -361,7 +360,7 @@ async def process_quiz_completion(user_id: str, result_data: QuizResultCreate):
                             .eq("id", roadmap_id) \
                             .execute()
                             
-                    await anyio.to_thread.run_sync(db_update_sync)
+                    await run_db(db_update_sync)
                     
                     logger.info(f"✅ [PROGRESS TRACKED] Vocabulary {lesson_id_to_mark} updated (Status: {new_status}).")
 
@@ -1,88 +1,215 @@
 
 from ..schemas.test_schemas import PreferenceData, InitialQuizResponse, QuizQuestion
+import re
 import json
-from typing import List
-from google import genai
-from google.genai import types as g_types
+from typing import Any, Dict, List, Optional, Tuple
 from google.genai.errors import APIError 
-from starlette.concurrency import run_in_threadpool
 import os
 from dotenv import load_dotenv
-from fastapi_app.prompts.test import build_quiz_test_prompt
+from fastapi_app.prompts.test import build_quiz_test_prompt, build_quiz_repair_prompt
+from fastapi_app.prompts.response_schemas import response_schema_for
+from fastapi_app.services import llm_gateway, model_routing
+from fastapi_app.utils.json_parser import extract_json
+from fastapi_app.utils import llm_cache, metrics
 
 load_dotenv()
 
-GEMINI_API_KEY = os.environ.get("GOOGLE_API_KEY")
-GEMINI_MODEL = os.environ.get("GEMINI_CHAT_MODEL", "gemini-1.5-flash")
-
-try:
-    client = genai.Client(api_key=GEMINI_API_KEY)
-except:
-    client = None
-
 
 # ================================================================
 #  VALIDATOR CỰC MẠNH — RÀNG BUỘC CHẶT CHẼ ĐẦU RA CỦA GEMINI
 # ================================================================
-def validate_quiz_questions(questions: List[QuizQuestion]):
-    allowed_types = {"grammar", "vocabulary", "speaking_prompt"}
+QUIZ_SIZE = 21
+ALLOWED_TYPES = {"grammar", "vocabulary", "speaking_prompt"}
+# Số lượt sửa từng câu lỗi trước khi bỏ cuộc (thay vì bắt user tạo lại cả bộ đề)
+QUIZ_REPAIR_ROUNDS = int(os.environ.get("QUIZ_REPAIR_ROUNDS", "2"))
+
+
+def question_error(q: QuizQuestion, expected_id: int) -> Optional[str]:
+    """Lỗi của 1 câu hỏi (None nếu hợp lệ)."""
+    # 1️⃣ ID phải đúng số thứ tự
+    if q.id != expected_id:
+        return f"ID câu hỏi không hợp lệ: expected {expected_id}, nhận {q.id}"
+
+    # 2️⃣ question_type đúng chuẩn
+    if q.question_type not in ALLOWED_TYPES:
+        return (
+            f"question_type sai tại câu {q.id}: {q.question_type} "
+            f"(chỉ cho phép {ALLOWED_TYPES})"
+        )
 
-    if len(questions) != 21:
-        raise ValueError(f"Quiz phải có đúng 21 câu hỏi, nhận được {len(questions)}")
+    # 3️⃣ Nếu là SPEAKING
+    if q.question_type == "speaking_prompt":
+        if q.options != []:
+            return f"Câu {q.id}: speaking_prompt phải có options = [], nhưng nhận {q.options}"
+        if q.correct_answer_key != "N/A":
+            return f"Câu {q.id}: speaking_prompt phải có correct_answer_key='N/A'."
+        return None
+
+    # 4️⃣ Nếu là MCQ
+    if len(q.options) != 4:
+        return f"Câu {q.id} phải có 4 lựa chọn, nhưng nhận {len(q.options)}"
+
+    for opt in q.options:
+        if any(prefix in opt for prefix in ["A)", "B)", "C)", "D)"]):
+            return (
+                f"Câu {q.id}: lựa chọn không được chứa A), B), C), D). "
+                f"Hãy trả về nội dung thuần, ví dụ 'Apple'."
+            )
+
+    if q.correct_answer_key not in {"A", "B", "C", "D"}:
+        return f"Câu {q.id}: correct_answer_key phải là A/B/C/D, nhận {q.correct_answer_key}"
+    return None
+
+
+def validate_quiz_questions(questions: List[QuizQuestion]):
+    if len(questions) != QUIZ_SIZE:
+        raise ValueError(f"Quiz phải có đúng {QUIZ_SIZE} câu hỏi, nhận được {len(questions)}")
 
     for idx, q in enumerate(questions, start=1):
+        error = question_error(q, idx)
+        if error:
+            raise ValueError(error)
 
-        # 1️⃣ ID phải đúng số thứ tự
-        if q.id != idx:
-            raise ValueError(
-                f"ID câu hỏi không hợp lệ: expected {idx}, nhận {q.id}"
-            )
 
-        # 2️⃣ question_type đúng chuẩn
-        if q.question_type not in allowed_types:
-            raise ValueError(
-                f"question_type sai tại câu {q.id}: {q.question_type} "
-                f"(chỉ cho phép {allowed_types})"
-            )
+def parse_quiz_questions(quiz_json_string: str) -> List[QuizQuestion]:
+    """Parse + validate output của Gemini. Raise ValueError nếu không hợp lệ."""
+    # Bộ đề bị cắt cụt không dùng được -> không nhận partial
+    raw = extract_json(quiz_json_string, expect=dict, allow_partial=False)
+
+    if "questions" not in raw:
+        raise ValueError("JSON thiếu thuộc tính 'questions'.")
+
+    # Convert → Pydantic
+    questions = [QuizQuestion(**q) for q in raw["questions"]]
 
-        # 3️⃣ Nếu là SPEAKING
-        if q.question_type == "speaking_prompt":
-            if q.options != []:
-                raise ValueError(
-                    f"Câu {q.id}: speaking_prompt phải có options = [], nhưng nhận {q.options}"
-                )
+    # VALIDATE RÀNG BUỘC QUY TẮC
+    validate_quiz_questions(questions)
+    return questions
+
+
+# ================================================================
+#  SỬA TỪNG CÂU LỖI (TARGETED REPAIR)
+# ================================================================
+def expected_question_type(question_id: int) -> str:
+    """Cấu trúc đề: 1-10 grammar, 11-20 vocabulary, 21 speaking (xem build_quiz_test_prompt)."""
+    if question_id <= 10:
+        return "grammar"
+    if question_id < QUIZ_SIZE:
+        return "vocabulary"
+    return "speaking_prompt"
 
-            if q.correct_answer_key != "N/A":
-                raise ValueError(
-                    f"Câu {q.id}: speaking_prompt phải có correct_answer_key='N/A'."
-                )
 
+_OPTION_PREFIX = re.compile(r"^\s*\(?[A-Da-d][\).:]\s+")
+
+
+def _normalize_item(item: dict, question_id: int) -> dict:
+    """Các lỗi sửa được tại chỗ, không cần gọi lại AI: ID, tiền tố 'A) ', chữ thường ở đáp án."""
+    item = dict(item, id=question_id)
+    if isinstance(item.get("options"), list):
+        item["options"] = [_OPTION_PREFIX.sub("", o) if isinstance(o, str) else o for o in item["options"]]
+    if isinstance(item.get("correct_answer_key"), str):
+        item["correct_answer_key"] = item["correct_answer_key"].strip().upper()
+    return item
+
+
+def _accept_item(item: Any, question_id: int) -> Tuple[Optional[QuizQuestion], Optional[str]]:
+    if not isinstance(item, dict):
+        return None, "không phải JSON object"
+    try:
+        q = QuizQuestion(**_normalize_item(item, question_id))
+    except ValueError as e:  # ValidationError
+        return None, f"sai cấu trúc ({e.__class__.__name__})"
+    error = question_error(q, question_id)
+    return (None, error) if error else (q, None)
+
+
+def collect_quiz_items(raw: Any) -> Tuple[Dict[int, QuizQuestion], Dict[int, Tuple[str, Any]]]:
+    """
+    Chia output thành câu hợp lệ và câu lỗi theo slot ID 1..21.
+    Trả về (valid, broken) với broken = {id: (lỗi, bản cũ)}; câu thiếu cũng nằm trong broken.
+    """
+    items = raw.get("questions") if isinstance(raw, dict) else None
+    if not isinstance(items, list):
+        items = []
+
+    valid: Dict[int, QuizQuestion] = {}
+    broken: Dict[int, Tuple[str, Any]] = {}
+    for position, item in enumerate(items[:QUIZ_SIZE], start=1):
+        # Gemini đánh số sai thì dùng vị trí trong danh sách
+        claimed = item.get("id") if isinstance(item, dict) else None
+        question_id = claimed if isinstance(claimed, int) and 1 <= claimed <= QUIZ_SIZE and claimed not in valid else position
+        if question_id in valid:
+            continue
+        q, error = _accept_item(item, question_id)
+        if q is not None:
+            valid[question_id] = q
+            broken.pop(question_id, None)
+        else:
+            broken.setdefault(question_id, (error, item))
+
+    for question_id in range(1, QUIZ_SIZE + 1):
+        if question_id not in valid and question_id not in broken:
+            broken[question_id] = ("thiếu câu hỏi", None)
+    return valid, broken
+
+
+async def repair_quiz_items(
+    valid: Dict[int, QuizQuestion],
+    broken: Dict[int, Tuple[str, Any]],
+    prefs: PreferenceData,
+) -> List[QuizQuestion]:
+    """Chỉ sinh lại các câu lỗi/thiếu rồi ghép vào bộ đề; raise ValueError nếu vẫn còn lỗi."""
+    schema = response_schema_for(build_quiz_repair_prompt)
+    for round_no in range(1, QUIZ_REPAIR_ROUNDS + 1):
+        if not broken:
+            break
+        slots = [
+            {
+                "id": qid,
+                "question_type": expected_question_type(qid),
+                "error": error,
+                "previous": json.dumps(previous, ensure_ascii=False) if previous else "(missing)",
+            }
+            for qid, (error, previous) in sorted(broken.items())
+        ]
+        print(f"🔧 Quiz repair round {round_no}: {len(slots)} câu lỗi -> {[s['id'] for s in slots]}")
+        metrics.increment("quiz_repair_items", len(slots), round=round_no)
+
+        prompt = build_quiz_repair_prompt(
+            comm_goal=prefs.communication_goal, barrier=prefs.confidence_barrier, slots=slots
+        )
+        resp = await llm_gateway.generate([prompt], task="diagnostic_test", response_schema=schema)
+        try:
+            repaired = extract_json(resp.text, expect=dict)
+        except ValueError:
             continue
 
-        # 4️⃣ Nếu là MCQ
-        if len(q.options) != 4:
-            raise ValueError(
-                f"Câu {q.id} phải có 4 lựa chọn, nhưng nhận {len(q.options)}"
-            )
+        for item in repaired.get("questions", []):
+            qid = item.get("id") if isinstance(item, dict) else None
+            if qid not in broken:
+                continue
+            q, error = _accept_item(item, qid)
+            if q is not None:
+                valid[qid] = q
+                del broken[qid]
+            else:
+                broken[qid] = (error, item)
 
-        for opt in q.options:
-            if any(prefix in opt for prefix in ["A)", "B)", "C)", "D)"]):
-                raise ValueError(
-                    f"Câu {q.id}: lựa chọn không được chứa A), B), C), D). "
-                    f"Hãy trả về nội dung thuần, ví dụ 'Apple'."
-                )
+    if broken:
+        metrics.increment("quiz_repair", result="failed")
+        raise ValueError(f"Không sửa được {len(broken)} câu hỏi: {sorted(broken)}")
 
-        if q.correct_answer_key not in {"A", "B", "C", "D"}:
-            raise ValueError(
-                f"Câu {q.id}: correct_answer_key phải là A/B/C/D, nhận {q.correct_answer_key}"
-            )
+    metrics.increment("quiz_repair", result="repaired")
+    questions = [valid[qid] for qid in range(1, QUIZ_SIZE + 1)]
+    validate_quiz_questions(questions)
+    return questions
 
 
 # ================================================================
 #  HÀM TẠO QUIZ — BAO GỒM VALIDATE
 # ================================================================
 async def generate_initial_quiz(prefs: PreferenceData) -> InitialQuizResponse:
-    if client is None:
+    if not llm_gateway.is_configured():
         raise ValueError("Gemini client không hoạt động.")
 
     comm_goal = prefs.communication_goal
@@ -129,34 +256,31 @@ async def generate_initial_quiz(prefs: PreferenceData) -> InitialQuizResponse:
     quiz_json_string = ""
 
     try:
-        # gọi Gemini
-        resp = await run_in_threadpool(
-            client.models.generate_content,
-            model= "gemini-2.5-flash-preview-09-2025",
-            contents=[prompt],
-            config=g_types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
+        # gọi Gemini (output bị ràng buộc theo schema DiagnosticQuizOutput)
+        # Bộ đề chỉ được cache khi đã qua validate (variety mode xoay vòng vài bộ đề)
+        resp = await llm_gateway.generate(
+            [prompt],
+            task="diagnostic_test",
+            response_schema=response_schema_for(build_quiz_test_prompt),
+            cache_family="diagnostic_test",
+            cache_validate=lambda text: bool(parse_quiz_questions(text))
         )
 
         quiz_json_string = resp.text.strip()
-
-        # xử lý trường hợp có ```json
-        if quiz_json_string.startswith("```"):
-            quiz_json_string = (
-                quiz_json_string.replace("```json", "").replace("```", "").strip()
-            )
-
-        raw = json.loads(quiz_json_string)
-
-        if "questions" not in raw:
-            raise ValueError("JSON thiếu thuộc tính 'questions'.")
-
-        # Convert → Pydantic
-        questions = [QuizQuestion(**q) for q in raw["questions"]]
-
-        # VALIDATE RÀNG BUỘC QUY TẮC
-        validate_quiz_questions(questions)
+        try:
+            raw = extract_json(quiz_json_string, expect=dict)
+        except ValueError:
+            raw = {}
+        valid, broken = collect_quiz_items(raw)
+
+        if broken:
+            # Chỉ sinh lại các câu lỗi, giữ nguyên các câu đã đúng
+            questions = await repair_quiz_items(valid, broken, prefs)
+            repaired_json = json.dumps({"questions": [q.model_dump() for q in questions]}, ensure_ascii=False)
+            await llm_cache.put("diagnostic_test", model_routing.model_for("diagnostic_test"), [prompt], repaired_json)
+        else:
+            metrics.increment("quiz_repair", result="clean")
+            questions = [valid[qid] for qid in range(1, QUIZ_SIZE + 1)]
 
         return InitialQuizResponse(
             quiz_title="Bài kiểm tra chẩn đoán Giao tiếp",
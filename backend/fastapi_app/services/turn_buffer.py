@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import weakref
+from typing import Any, Dict, List
+
+
+from fastapi_app.database import admin_supabase, run_db
+from fastapi_app.crud import history as crud_history
+
+logger = logging.getLogger(__name__)
+
+# Tin nhắn của một lượt hội thoại chờ ghi xuống DB, theo session_id (đúng thứ tự)
+_pending: Dict[str, List[Dict[str, Any]]] = {}
+# Mỗi session một lock để các lần flush không chen nhau (đảm bảo thứ tự seq)
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _get_lock(session_id: str) -> asyncio.Lock:
+    lock = _locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[session_id] = lock
+    return lock
+
+
+def stage(session_id: str, messages: List[Dict[str, Any]]) -> None:
+    """Đưa các tin nhắn của lượt hiện tại vào buffer (chưa ghi DB)."""
+    if messages:
+        _pending.setdefault(session_id, []).extend(messages)
+
+
+def discard(session_id: str) -> None:
+    """Bỏ các tin nhắn đang chờ (vd: session bị xóa)."""
+    _pending.pop(session_id, None)
+
+
+async def flush(session_id: str) -> None:
+    """
+    Ghi toàn bộ tin nhắn đang chờ của session trong 1 round trip.
+    - Được gọi qua BackgroundTasks sau khi response đã gửi đi.
+    - Được gọi lại ở đầu lượt kế tiếp: nếu lượt trước chưa ghi xong thì chờ
+      lock, nên lịch sử đọc ra luôn đầy đủ và đúng thứ tự.
+    """
+    lock = _get_lock(session_id)
+    async with lock:
+        batch = _pending.pop(session_id, None)
+        if not batch:
+            return
+        try:
+            await run_db(
+                crud_history.append_messages_to_history, admin_supabase, session_id, batch
+            )
+        except Exception as e:
+            # Giữ lại batch ở đầu hàng đợi để lần flush sau (hoặc lúc shutdown) ghi lại
+            _pending[session_id] = batch + _pending.get(session_id, [])
+            logger.error(f"Turn buffer flush failed for session {session_id}: {e}")
+
+
+def flush_all_sync() -> None:
+    """Fallback đồng bộ khi tắt server: ghi hết những gì còn trong buffer."""
+    for session_id in list(_pending.keys()):
+        batch = _pending.pop(session_id, None)
+        if not batch:
+            continue
+        try:
+            crud_history.append_messages_to_history(admin_supabase, session_id, batch)
+        except Exception as e:
+            logger.error(f"Turn buffer shutdown flush failed for session {session_id}: {e}")
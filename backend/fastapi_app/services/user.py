@@ -2,7 +2,7 @@
 import uuid
 import datetime
 from fastapi import HTTPException, UploadFile
-from fastapi_app.database import db_client, admin_supabase
+from fastapi_app.database import db_client, admin_supabase, run_db
 
 async def upload_avatar_service(file: UploadFile, current_user):
     try:
@@ -10,7 +10,8 @@ async def upload_avatar_service(file: UploadFile, current_user):
         file_path = f"avatars/{current_user.id}_{uuid.uuid4()}.{file_ext}"
         file_content = await file.read()
 
-        res = admin_supabase.storage.from_("avatars").upload(
+        res = await run_db(
+            admin_supabase.storage.from_("avatars").upload,
             file_path,
             file_content,
             {"content-type": file.content_type or "image/jpeg", "upsert": "true"}
@@ -30,11 +31,11 @@ async def upload_avatar_service(file: UploadFile, current_user):
 async def update_profile_service(request, current_user):
     try:
         # Lấy thông tin user hiện tại từ supabase
-        profile_res = admin_supabase.table("profiles")\
+        profile_res = await run_db(lambda: admin_supabase.table("profiles")\
             .select("username, avatar_url")\
             .eq("id", current_user.id)\
             .single()\
-            .execute()
+            .execute())
 
         old_profile = profile_res.data or {}
 
@@ -43,7 +44,8 @@ async def update_profile_service(request, current_user):
         new_avatar = request.avatar_url if request.avatar_url is not None else old_profile.get("avatar_url")
 
         # Update user metadata
-        admin_supabase.auth.admin.update_user_by_id(
+        await run_db(
+            admin_supabase.auth.admin.update_user_by_id,
             current_user.id,
             {"user_metadata": {
                 "username": new_username,
@@ -51,12 +53,12 @@ async def update_profile_service(request, current_user):
             }}
         )
 
-        admin_supabase.table("profiles").upsert({
+        await run_db(lambda: admin_supabase.table("profiles").upsert({
             "id": current_user.id,
             "username": new_username,
             "avatar_url": new_avatar,
             "updated_at": datetime.datetime.utcnow().isoformat()
-        }).execute()
+        }).execute())
 
         return {
             "message": "Profile updated",
@@ -69,6 +71,8 @@ async def update_profile_service(request, current_user):
 
 
 async def change_password_service(request, current_user):
+    # Giữ đồng bộ (không qua run_db): sign_in_with_password đổi session của db_client dùng chung,
+    # update_user ngay sau đó dựa vào session này nên 2 lời gọi không được xen kẽ với request khác.
     try:
         auth_res = db_client.auth.sign_in_with_password({
             "email": current_user.email,
@@ -92,13 +96,13 @@ async def get_profile_service(current_user):
     try:
         # --- LẤY PROFILE ---
         try:
-            db_user_res = (
+            db_user_res = await run_db(lambda: (
                 admin_supabase.table("profiles")
                 .select("*")
                 .eq("id", current_user.id)
                 .single()
                 .execute()
-            )
+            ))
             profile_data = db_user_res.data or {}
         except Exception:
             # Không có profile → profile mới → trả mặc định
@@ -106,7 +110,7 @@ async def get_profile_service(current_user):
 
         # --- LẤY ROADMAP ---
         try:
-            db_roadmap_res = (
+            db_roadmap_res = await run_db(lambda: (
                 admin_supabase.table("roadmaps")
                 .select("level, data")
                 .eq("user_id", current_user.id)
@@ -114,7 +118,7 @@ async def get_profile_service(current_user):
                 .limit(1)
                 .single()
                 .execute()
-            )
+            ))
             roadmap_row = db_roadmap_res.data or {}
         except Exception:
             roadmap_row = {}
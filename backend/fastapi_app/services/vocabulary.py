@@ -1,5 +1,3 @@
-import os
-import json
 import re
 import requests
 import asyncio
@@ -7,27 +5,18 @@ from datetime import datetime, timedelta, date
 from typing import Any, Dict, List, Set, Optional
 from urllib.parse import quote_plus
 from fastapi_app import schemas
-from fastapi_app.database import db_client, admin_supabase
+from fastapi_app.database import db_client, admin_supabase, run_db
 from fastapi_app.crud import vocabulary as vocab_crud
-import google.generativeai  as genai
 from fastapi_app.prompts import vocabulary as prompts
+from fastapi_app.prompts.response_schemas import response_schema_for
 from fastapi_app.services import vocabulary
+from fastapi_app.services import llm_gateway
+from fastapi_app.utils.single_flight import SyncSingleFlight
+from fastapi_app.utils.json_parser import parse_llm_items
+from fastapi_app.schemas.llm_outputs import VocabEntryOutput
 import logging
 
 
-try:
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    if not GOOGLE_API_KEY:
-        model = None
-    else:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash-preview-09-2025', 
-            generation_config={"response_mime_type": "application/json"}
-        )
-except Exception:
-    model = None
-
 # --- SRS LOGIC ---
 def calculate_srs(quality: int, current_interval: int, current_ease_factor: float) -> tuple[int, float, date]:
     if quality < 3:
@@ -50,10 +39,17 @@ def calculate_srs(quality: int, current_interval: int, current_ease_factor: floa
 
 # --- HELPER: TTS & DICTIONARY ---
 
+_word_lookups = SyncSingleFlight("word_lookup")
+
 def get_word_details_from_api(word: str) -> Dict[str, Any]:
     """
-    Tra cứu Sync: Google TTS + Dictionary API (Lấy thêm Type)
+    Tra cứu Sync: Google TTS + Dictionary API (Lấy thêm Type).
+    Nhiều request cùng tra 1 từ cùng lúc chỉ gọi upstream (và upload audio) 1 lần.
     """
+    key = (word or "").strip().lower()
+    return dict(_word_lookups.do(key, lambda: _fetch_word_details(word)))
+
+def _fetch_word_details(word: str) -> Dict[str, Any]:
     pronunciation = None
     audio_url = None
     definition = None
@@ -153,7 +149,7 @@ async def analyze_and_enrich_transcript(transcript_json: List[Dict[str, Any]], u
 
     final_candidates = []
     if user_id:
-        final_candidates = _filter_existing_words(user_id, raw_candidates)
+        final_candidates = await run_db(_filter_existing_words, user_id, raw_candidates)
     else:
         final_candidates = raw_candidates
     
@@ -165,7 +161,7 @@ async def analyze_and_enrich_transcript(transcript_json: List[Dict[str, Any]], u
     # --- 3. Gemini Contextualizer---
     extracted_vocab_data = []
 
-    if model and full_transcript_text:
+    if llm_gateway.is_configured() and full_transcript_text:
         try:
             # GỌI HÀM TẠO PROMPT TỪ FILE KHÁC
             prompt = prompts.build_vocab_enrichment_prompt(
@@ -173,9 +169,14 @@ async def analyze_and_enrich_transcript(transcript_json: List[Dict[str, Any]], u
                 candidates=final_candidates
             )
             
-            response = await model.generate_content_async(prompt)
-            text_res = response.text.strip().replace("```json", "").replace("```", "")
-            extracted_vocab_data = json.loads(text_res)
+            response = await llm_gateway.generate(
+                prompt, task="vocab_enrichment",
+                response_schema=response_schema_for(prompts.build_vocab_enrichment_prompt),
+            )
+            # Chỉ giữ các mục hoàn chỉnh (output bị cắt cụt -> fallback bên dưới)
+            extracted_vocab_data = [
+                item.model_dump() for item in parse_llm_items(response.text, VocabEntryOutput)
+            ]
             
         except Exception as e:
             print(f"Gemini Error: {e}")
@@ -190,8 +191,8 @@ async def analyze_and_enrich_transcript(transcript_json: List[Dict[str, Any]], u
         word = item.get("word")
         if not word: continue
         
-        # Tra cứu chi tiết (Dictionary API)
-        details = get_word_details_from_api(word)
+        # Tra cứu chi tiết (Dictionary API + upload audio lên Storage, đồng bộ)
+        details = await run_db(get_word_details_from_api, word)
         
         meaning = item.get("meaning") or details.get("definition") or "Definition not found"
         context = item.get("context") or "No context available"
@@ -215,11 +216,11 @@ async def analyze_and_enrich_transcript(transcript_json: List[Dict[str, Any]], u
 
 async def check_existing_deck(user_id: str, topic_name: str):
     """Kiểm tra Deck đã tồn tại trên Supabase chưa."""
-    response = admin_supabase.table("Decks") \
+    response = await run_db(lambda: admin_supabase.table("Decks") \
         .select("*") \
         .eq("user_id", user_id) \
         .eq("name", topic_name) \
-        .execute()
+        .execute())
     return response.data[0] if response.data else None
 
 async def create_new_deck(user_id: str, topic_name: str, lesson_id: Optional[str]):
@@ -235,7 +236,7 @@ async def create_new_deck(user_id: str, topic_name: str, lesson_id: Optional[str
     }
     
     try:
-        insert_res = admin_supabase.table("Decks").insert(data_to_insert).execute()
+        insert_res = await run_db(lambda: admin_supabase.table("Decks").insert(data_to_insert).execute())
         return insert_res.data[0]
         
     except Exception as e:
@@ -246,11 +247,11 @@ async def get_user_level(user_id: str) -> str:
     """Truy vấn Supabase để lấy Level của người dùng từ bảng roadmaps."""
     try:
         # GIẢ ĐỊNH: Bảng 'roadmaps' có cột 'user_id' và cột 'current_level' (hoặc 'level')
-        response = admin_supabase.table("roadmaps") \
+        response = await run_db(lambda: admin_supabase.table("roadmaps") \
             .select("level") \
             .eq("user_id", user_id) \
             .single() \
-            .execute()
+            .execute())
             
         # Trả về Level (ví dụ: 'A2', 'B1') hoặc 'B1' nếu không tìm thấy
         user_level = response.data.get("level", "B1") 
@@ -265,8 +266,12 @@ async def generate_vocab_for_deck_supabase(deck_id: int, topic_name: str, user_i
     try:
         user_level = await get_user_level(user_id)
         prompt = prompts.build_topic_generation_prompt(topic_name, user_level)
-        response = await model.generate_content_async(prompt)
-        raw_words = json.loads(response.text.strip().replace("```json", "").replace("```", "")) 
+        response = await llm_gateway.generate(
+            prompt, task="deck_vocab", cache_family="deck_vocab",
+            response_schema=response_schema_for(prompts.build_topic_generation_prompt),
+        )
+        # Bỏ các mục thiếu "word"; output bị cắt cụt thì không ghi gì (tránh từ dở dang như "restaur")
+        raw_words = [item.model_dump() for item in parse_llm_items(response.text, VocabEntryOutput)]
         
         print("-" * 50)
         print(f"DEBUG: STARTING AI TASK (Deck ID: {deck_id})")
@@ -279,7 +284,7 @@ async def generate_vocab_for_deck_supabase(deck_id: int, topic_name: str, user_i
 
         vocab_list = []
         for item in raw_words:
-            details = get_word_details_from_api(item['word'])
+            details = await run_db(get_word_details_from_api, item['word'])
             vocab_list.append({
                 "deck_id": deck_id,
                 "user_id": user_id,
@@ -292,7 +297,7 @@ async def generate_vocab_for_deck_supabase(deck_id: int, topic_name: str, user_i
             })
 
         if vocab_list:
-            admin_supabase.table("UserVocabulary").insert(vocab_list).execute()
+            await run_db(lambda: admin_supabase.table("UserVocabulary").insert(vocab_list).execute())
     except Exception as e:
         print(f"Service Background Task Error: {e}")
 
@@ -0,0 +1,273 @@
+"""
+Admission control cho các endpoint gọi LLM nặng.
+
+1. Token bucket theo user (hoặc IP với endpoint không đăng nhập) cho từng nhóm endpoint:
+   hết token -> 429 ngay, kèm Retry-After.
+2. Giới hạn số lời gọi đồng thời toàn cục theo model (PriorityLimiter, llm_gateway dùng):
+   request chờ trong hàng đợi theo độ ưu tiên (chat tương tác trước, sinh deck/quiz nền sau).
+   Hàng đợi đầy hoặc chờ quá lâu -> AdmissionRejected (429) thay vì treo hàng phút.
+
+Độ ưu tiên đi theo contextvar: endpoint đặt qua admit(), tác vụ nền bọc trong background_priority().
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+from fastapi_app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # Lượt chat / voice: người dùng đang chờ
+    STANDARD = 1     # Request đồng bộ khác (diagnostic test, roadmap, pronunciation)
+    BACKGROUND = 2   # Sinh deck / quiz nền, job roadmap, rolling summary
+
+
+class AdmissionRejected(Exception):
+    """Quá tải hoặc hết hạn mức: trả 429 với Retry-After (giây)."""
+
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(f"Admission rejected ({reason}), retry after {retry_after:.0f}s")
+        self.retry_after = max(1, int(retry_after + 0.999))
+        self.reason = reason
+
+
+# ================================================================
+#  TOKEN BUCKET THEO USER
+# ================================================================
+@dataclass(frozen=True)
+class RateLimit:
+    capacity: float  # Số request tối đa liên tiếp (burst)
+    per: float       # Thời gian (giây) để nạp lại đầy bucket
+
+
+def _parse_limits(raw: str) -> Dict[str, RateLimit]:
+    """ADMISSION_LIMITS="chat=30/60,roadmap=5/600" -> {bucket: RateLimit}."""
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        try:
+            capacity, per = value.split("/", 1)
+            limits[name.strip()] = RateLimit(float(capacity), float(per))
+        except ValueError:
+            logger.warning(f"[Admission] Invalid limit override: {item}")
+    return limits
+
+
+LIMITS: Dict[str, RateLimit] = {
+    "chat": RateLimit(capacity=30, per=60),          # free-talk text / stream / voice, scenario voice
+    "pronunciation": RateLimit(capacity=20, per=60),
+    "diagnostic_test": RateLimit(capacity=5, per=600),
+    "roadmap": RateLimit(capacity=3, per=600),
+    "grammar_quiz": RateLimit(capacity=10, per=600),
+    "deck": RateLimit(capacity=10, per=600),
+    "summary": RateLimit(capacity=10, per=600),
+}
+LIMITS.update(_parse_limits(os.getenv("ADMISSION_LIMITS", "")))
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+
+
+class TokenBucket:
+    def __init__(self, limit: RateLimit):
+        self.capacity = limit.capacity
+        self.rate = limit.capacity / limit.per
+        self.tokens = limit.capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """Lấy token; trả về 0 nếu được phép, ngược lại số giây phải chờ."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+# Bucket không dùng tới sẽ bị bỏ sau 1 giờ (bucket mới luôn đầy nên không mất gì)
+_buckets: TTLCache = TTLCache(maxsize=50_000, ttl=3600)
+_buckets_lock = threading.Lock()
+
+
+def consume(subject: str, bucket: str, cost: float = 1) -> None:
+    """Trừ token của subject (user_id hoặc ip:...) trong bucket; raise AdmissionRejected nếu hết."""
+    limit = LIMITS.get(bucket)
+    if not ADMISSION_ENABLED or limit is None:
+        return
+    with _buckets_lock:
+        state = _buckets.get((subject, bucket))
+        if state is None:
+            state = TokenBucket(limit)
+        wait = state.take(cost)
+        _buckets[(subject, bucket)] = state  # Ghi lại để gia hạn TTL
+    if wait > 0:
+        metrics.increment("admission_rejected", bucket=bucket, reason="rate_limit")
+        raise AdmissionRejected(wait, "rate_limit")
+    metrics.increment("admission_admitted", bucket=bucket)
+
+
+# ================================================================
+#  ĐỘ ƯU TIÊN (CONTEXTVAR)
+# ================================================================
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("llm_priority", default=Priority.STANDARD)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+def set_priority(priority: Priority) -> None:
+    """Đặt độ ưu tiên cho phần còn lại của request hiện tại (mỗi request có context riêng)."""
+    _priority.set(priority)
+
+
+@contextmanager
+def background_priority():
+    """Các lời gọi LLM bên trong khối này xếp hàng sau request tương tác."""
+    token = _priority.set(Priority.BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# ================================================================
+#  GIỚI HẠN ĐỒNG THỜI THEO MODEL, CÓ ƯU TIÊN
+# ================================================================
+# Số request tối đa được xếp hàng chờ 1 model (request nền không bị giới hạn, chỉ chờ lâu hơn)
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# Thời gian chờ slot tối đa (giây) theo độ ưu tiên
+MAX_WAIT: Dict[Priority, float] = {
+    Priority.INTERACTIVE: float(os.getenv("ADMISSION_WAIT_INTERACTIVE", "10")),
+    Priority.STANDARD: float(os.getenv("ADMISSION_WAIT_STANDARD", "30")),
+    Priority.BACKGROUND: float(os.getenv("ADMISSION_WAIT_BACKGROUND", "300")),
+}
+
+
+class PriorityLimiter:
+    """
+    Semaphore có hàng đợi ưu tiên: slot trống được trao cho waiter có priority nhỏ nhất
+    (cùng priority thì FIFO).
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # Thời gian giữ slot trung bình (EWMA), để ước lượng Retry-After
+        self._avg_hold = 5.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    def queued_ahead_of(self, priority: Priority) -> int:
+        return sum(1 for p, _, f in self._waiters if p <= priority and not f.done())
+
+    def estimated_wait(self, priority: Priority) -> float:
+        return (self.queued_ahead_of(priority) + 1) * self._avg_hold / max(self.limit, 1)
+
+    def is_saturated(self, priority: Priority) -> bool:
+        return (
+            priority != Priority.BACKGROUND
+            and self.in_use >= self.limit
+            and self.queued_ahead_of(priority) >= ADMISSION_MAX_QUEUE
+        )
+
+    async def acquire(self, priority: Priority) -> None:
+        if self.in_use < self.limit and not self.queued:
+            self.in_use += 1
+            return
+        if self.is_saturated(priority):
+            metrics.increment("admission_rejected", model=self.name, reason="queue_full")
+            raise AdmissionRejected(self.estimated_wait(priority), "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), MAX_WAIT[priority])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Slot vừa được trao đúng lúc hết giờ / bị hủy -> trả lại cho người tiếp theo
+                self.release()
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.increment("admission_rejected", model=self.name, reason="wait_timeout")
+                raise AdmissionRejected(self.estimated_wait(priority), "wait_timeout") from None
+            raise
+        metrics.increment("admission_queued", model=self.name, priority=priority.name.lower())
+
+    def release(self) -> None:
+        # Trao slot trực tiếp cho waiter tốt nhất còn chờ (in_use giữ nguyên)
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[Priority] = None):
+        priority = current_priority() if priority is None else priority
+        await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.monotonic() - started)
+            self.release()
+
+
+_limiters: Dict[str, PriorityLimiter] = {}
+
+
+def limiter(name: str, limit: int) -> PriorityLimiter:
+    """Limiter dùng chung theo tên (model); tạo lần đầu với limit cho trước."""
+    current = _limiters.get(name)
+    if current is None:
+        current = PriorityLimiter(name, limit)
+        _limiters[name] = current
+    return current
+
+
+def check_capacity(priority: Priority) -> None:
+    """Từ chối sớm (trước khi đọc body / upload audio) nếu model nào đó đã đầy hàng đợi."""
+    if not ADMISSION_ENABLED:
+        return
+    for model_limiter in _limiters.values():
+        if model_limiter.is_saturated(priority):
+            metrics.increment("admission_rejected", model=model_limiter.name, reason="overloaded")
+            raise AdmissionRejected(model_limiter.estimated_wait(priority), "overloaded")
+
+
+def admit(subject: str, bucket: str, priority: Priority, cost: float = 1) -> None:
+    """Kiểm tra đầy đủ cho 1 request: quá tải toàn cục, hạn mức user, rồi đặt priority cho request."""
+    check_capacity(priority)
+    consume(subject, bucket, cost)
+    set_priority(priority)
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    return {
+        name: {"limit": l.limit, "in_use": l.in_use, "queued": l.queued, "avg_hold_s": round(l._avg_hold, 2)}
+        for name, l in _limiters.items()
+    }
@@ -0,0 +1,147 @@
+"""
+Circuit breaker theo model cho các lời gọi Gemini.
+
+- CLOSED: gọi bình thường, ghi nhận kết quả trong cửa sổ trượt (CB_WINDOW giây).
+- Tỉ lệ lỗi >= CB_FAILURE_RATE (với ít nhất CB_MIN_CALLS lời gọi) -> OPEN.
+- OPEN: từ chối ngay (CircuitOpenError) trong CB_OPEN_SECONDS, service trả fallback tức thì
+  thay vì chờ hết timeout + retry.
+- Hết thời gian OPEN -> HALF_OPEN: cho CB_HALF_OPEN_PROBES request thăm dò đi qua;
+  thành công -> CLOSED, lỗi -> OPEN lại.
+
+Chỉ lỗi phía upstream (timeout, 429, 5xx) mới tính là lỗi; lỗi do request (400, schema, ...) thì không.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from fastapi_app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+CB_FAILURE_RATE = float(os.getenv("CB_FAILURE_RATE", "0.5"))
+CB_MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "8"))
+CB_WINDOW = float(os.getenv("CB_WINDOW", "60"))
+CB_OPEN_SECONDS = float(os.getenv("CB_OPEN_SECONDS", "30"))
+CB_HALF_OPEN_PROBES = int(os.getenv("CB_HALF_OPEN_PROBES", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Model đang bị ngắt mạch: caller nên dùng fallback ngay."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for '{name}' is open, retry after {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Gọi trước mỗi request; raise CircuitOpenError nếu phải short-circuit."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + CB_OPEN_SECONDS - time.monotonic()
+                if remaining > 0:
+                    metrics.increment("circuit_short_circuited", model=self.name)
+                    raise CircuitOpenError(self.name, remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= CB_HALF_OPEN_PROBES:
+                    metrics.increment("circuit_short_circuited", model=self.name)
+                    raise CircuitOpenError(self.name, 1)
+                self._probes += 1
+
+    def is_open(self) -> bool:
+        """
+        True nếu before_call() lúc này sẽ short-circuit. Không đổi trạng thái:
+        hết CB_OPEN_SECONDS thì trả False để lời gọi kế tiếp (kể cả lượt voice) làm probe HALF_OPEN.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return self._opened_at + CB_OPEN_SECONDS > time.monotonic()
+            return self.state == HALF_OPEN and self._probes >= CB_HALF_OPEN_PROBES
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+            self._record(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(OPEN)
+                return
+            self._record(False)
+            total = len(self._calls)
+            failures = sum(1 for _, ok in self._calls if not ok)
+            if self.state == CLOSED and total >= CB_MIN_CALLS and failures / total >= CB_FAILURE_RATE:
+                self._transition(OPEN)
+
+    def release_probe(self) -> None:
+        """Probe kết thúc mà không xác định được (lỗi phía request): trả lại lượt thăm dò."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def _record(self, ok: bool) -> None:
+        now = time.monotonic()
+        self._calls.append((now, ok))
+        while self._calls and self._calls[0][0] < now - CB_WINDOW:
+            self._calls.popleft()
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"[Circuit] {self.name}: {self.state} -> {state}")
+        metrics.increment("circuit_transitions", model=self.name, to=state)
+        self.state = state
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state == CLOSED:
+            self._calls.clear()
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls": len(self._calls),
+                "failures": sum(1 for _, ok in self._calls if not ok),
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            _breakers[name] = breaker
+        return breaker
+
+
+def is_open(name: str) -> bool:
+    breaker = _breakers.get(name)
+    return breaker is not None and breaker.is_open()
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
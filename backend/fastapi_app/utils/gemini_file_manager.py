@@ -1,45 +1,88 @@
 import os
-import shutil
-import tempfile
-import google.generativeai as genai
+import io
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Tuple
+
+import anyio
 from fastapi import UploadFile
 
-# Cấu hình API Key (đảm bảo đã set biến môi trường)
-GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found.")
-genai.configure(api_key=GEMINI_API_KEY)
+from fastapi_app.services import llm_gateway
+
+logger = logging.getLogger(__name__)
+
+# Audio nhỏ hơn ngưỡng này được gửi inline trong request (không qua Files API).
+# Giới hạn request của Gemini là ~20MB nên để dư cho prompt/base64.
+INLINE_AUDIO_MAX_BYTES = int(os.getenv("GEMINI_INLINE_AUDIO_MAX_BYTES", str(8 * 1024 * 1024)))
+# File đã upload lên Files API được xóa sau khoảng thời gian này (giây)
+REMOTE_FILE_TTL = int(os.getenv("GEMINI_REMOTE_FILE_TTL", "600"))
+REMOTE_FILE_CLEANUP_INTERVAL = int(os.getenv("GEMINI_REMOTE_FILE_CLEANUP_INTERVAL", "300"))
+
+# name -> (thời điểm upload, hàm xóa)
+_remote_files: Dict[str, Tuple[float, Callable[[str], Any]]] = {}
+
 
 async def upload_audio_to_gemini(audio_file: UploadFile):
     """
-    1. Lưu UploadFile (từ RAM/Network) xuống file tạm trên ổ cứng.
-    2. Upload file đó lên Google Generative AI Files API.
-    3. Trả về đối tượng file của Gemini (để đưa vào prompt).
+    Đọc UploadFile rồi chuẩn bị audio cho Gemini (inline hoặc Files API tùy kích thước).
+    Trả về part có thể đưa thẳng vào prompt.
     """
-    suffix = ".webm"  # Mặc định browser gửi webm, hoặc lấy từ filename
-    if audio_file.filename and "." in audio_file.filename:
-        suffix = "." + audio_file.filename.split(".")[-1]
+    content = await audio_file.read()
+    # mime_type quan trọng để Gemini biết đây là audio
+    mime_type = audio_file.content_type or "audio/webm"
+    return await prepare_audio_bytes(content, mime_type)
+
 
-    # 1. Tạo file tạm
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp_path = tmp.name
-        # Ghi dữ liệu từ UploadFile vào file tạm
-        content = await audio_file.read()
-        tmp.write(content)
+async def prepare_audio_bytes(content: bytes, mime_type: str = "audio/webm"):
+    """
+    Transport theo kích thước:
+    - Nhỏ hơn INLINE_AUDIO_MAX_BYTES: trả về blob inline, không tốn thêm round trip upload.
+    - Lớn hơn: upload lên Files API trong thread (không block event loop).
+    """
+    if len(content) <= INLINE_AUDIO_MAX_BYTES:
+        return llm_gateway.audio_part(content, mime_type)
+    uploaded_file = await upload_audio_bytes_to_gemini(content, mime_type)
+    return llm_gateway.file_part(uploaded_file)
 
+
+async def upload_audio_bytes_to_gemini(content: bytes, mime_type: str = "audio/webm"):
+    """Upload audio dạng bytes lên Gemini Files API (không ghi file tạm, qua client async của gateway)."""
     try:
-        # 2. Upload lên Google
-        # mime_type quan trọng để Gemini biết đây là audio
-        mime_type = audio_file.content_type or "audio/webm"
-        uploaded_file = genai.upload_file(path=tmp_path, mime_type=mime_type)
-        
-        print(f"[Gemini Upload] Uploaded file: {uploaded_file.uri}")
+        uploaded_file = await llm_gateway.upload_file(io.BytesIO(content), mime_type)
+        track_remote_file(uploaded_file.name, llm_gateway.delete_file)
+        logger.info(f"[Gemini Upload] Uploaded file: {uploaded_file.uri}")
         return uploaded_file
-        
     except Exception as e:
-        print(f"[Gemini Upload Error] {e}")
+        logger.error(f"[Gemini Upload Error] {e}")
         raise e
-    finally:
-        # 3. Dọn dẹp file tạm trên server (Local)
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
\ No newline at end of file
+
+
+def track_remote_file(name: str, deleter: Callable[[str], Any]) -> None:
+    """Ghi nhận file đã upload để dọn dẹp theo lịch."""
+    _remote_files[name] = (time.monotonic(), deleter)
+
+
+def cleanup_remote_files(max_age: float = REMOTE_FILE_TTL) -> int:
+    """Xóa các file đã upload quá max_age giây. Trả về số file đã xóa."""
+    now = time.monotonic()
+    deleted = 0
+    for name, (uploaded_at, deleter) in list(_remote_files.items()):
+        if now - uploaded_at < max_age:
+            continue
+        try:
+            deleter(name)
+            deleted += 1
+        except Exception as e:
+            logger.warning(f"[Gemini Cleanup] Could not delete {name}: {e}")
+        _remote_files.pop(name, None)
+    return deleted
+
+
+async def run_remote_file_cleanup(interval: float = REMOTE_FILE_CLEANUP_INTERVAL) -> None:
+    """Vòng lặp nền (khởi động cùng app) dọn các file Gemini đã hết hạn."""
+    while True:
+        await asyncio.sleep(interval)
+        deleted = await anyio.to_thread.run_sync(cleanup_remote_files)
+        if deleted:
+            logger.info(f"[Gemini Cleanup] Deleted {deleted} remote files.")
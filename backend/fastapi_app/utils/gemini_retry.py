@@ -1,47 +1,170 @@
+import os
+import re
 import time
+import random
+import asyncio
 import logging
 import functools
-from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, TooManyRequests
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi_app.utils import metrics
+
+try:
+    from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, TooManyRequests
+    _LEGACY_RETRYABLE: tuple = (ResourceExhausted, TooManyRequests, ServiceUnavailable)
+except ImportError:
+    _LEGACY_RETRYABLE = ()
 
 # Cấu hình logging cơ bản nếu chưa có
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def with_gemini_retry(max_retries=3, initial_delay=2, backoff_factor=2):
+# Mã HTTP nên thử lại: quota (429) và lỗi tạm thời phía server
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+DEFAULT_MAX_RETRIES = int(os.getenv("GEMINI_RETRY_MAX_RETRIES", "3"))
+DEFAULT_INITIAL_DELAY = float(os.getenv("GEMINI_RETRY_INITIAL_DELAY", "1"))
+DEFAULT_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "20"))
+# Tổng thời gian (giây) cho 1 lời gọi, tính cả các lần thử lại và thời gian chờ
+DEFAULT_DEADLINE = float(os.getenv("GEMINI_RETRY_DEADLINE", "90"))
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for attr in ("code", "status_code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def retry_reason(error: Exception) -> Optional[str]:
+    """Lý do thử lại (để gắn nhãn metric), None nếu lỗi không nên thử lại."""
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if _LEGACY_RETRYABLE and isinstance(error, _LEGACY_RETRYABLE):
+        return "quota"
+    code = _status_code(error)
+    if code in RETRYABLE_STATUS:
+        return str(code)
+    return None
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
     """
-    Decorator để tự động thử lại (retry) khi gọi Gemini API gặp lỗi Quota (429).
-    Sử dụng chiến thuật Exponential Backoff (Chờ lâu dần: 2s -> 4s -> 8s).
-    
+    Đọc gợi ý thời gian chờ từ lỗi:
+    - Header HTTP 'Retry-After' (giây)
+    - RetryInfo trong body lỗi của Gemini, vd: "retryDelay": "12s"
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    match = re.search(r"retry[_ ]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(error, "details", "")) + str(error), re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def backoff_delay(attempt: int, initial_delay: float, max_delay: float, error: Optional[Exception] = None, backoff_factor: float = 2) -> float:
+    """Exponential backoff với full jitter; ưu tiên retry-after nếu server gợi ý."""
+    hint = retry_after_seconds(error) if error is not None else None
+    if hint is not None:
+        return min(hint, max_delay)
+    return random.uniform(0, min(max_delay, initial_delay * (backoff_factor ** (attempt - 1))))
+
+
+async def retry_async(
+    func: Callable[..., Awaitable[Any]],
+    *args,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    initial_delay: float = DEFAULT_INITIAL_DELAY,
+    max_delay: float = DEFAULT_MAX_DELAY,
+    backoff_factor: float = 2,
+    deadline: float = DEFAULT_DEADLINE,
+    label: str = "gemini",
+    **kwargs,
+) -> Any:
+    """
+    Gọi func (coroutine) và thử lại khi gặp lỗi tạm thời, KHÔNG block event loop.
+    - max_retries: tổng số lần gọi tối đa.
+    - Nếu func nhận tham số 'timeout', mỗi lần thử được giới hạn bởi thời gian còn lại của deadline.
+    - Không chờ nếu thời gian chờ vượt quá deadline còn lại (ném lỗi ngay).
+    """
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + deadline
+    attempt = 0
+    while True:
+        attempt += 1
+        metrics.increment("gemini_calls", label=label)
+        try:
+            if "timeout" in kwargs:
+                kwargs["timeout"] = max(min(kwargs["timeout"] or deadline, stop_at - loop.time()), 0.001)
+            return await func(*args, **kwargs)
+        except Exception as e:
+            reason = retry_reason(e)
+            if reason is None:
+                raise
+            delay = backoff_delay(attempt, initial_delay, max_delay, e, backoff_factor)
+            remaining = stop_at - loop.time()
+            if attempt >= max_retries or delay >= remaining:
+                metrics.increment("gemini_retry_exhausted", label=label, reason=reason)
+                logger.error(f"❌ Gemini call '{label}' failed after {attempt} attempt(s) ({reason}): {e}")
+                raise
+            metrics.increment("gemini_retry_attempts", label=label, reason=reason)
+            logger.warning(f"⚠️ Gemini '{label}' {reason}. Retrying in {delay:.1f}s... (Attempt {attempt}/{max_retries})")
+            await asyncio.sleep(delay)
+
+
+def with_gemini_retry(max_retries=3, initial_delay=2, backoff_factor=2, max_delay=DEFAULT_MAX_DELAY, deadline=DEFAULT_DEADLINE):
+    """
+    Decorator để tự động thử lại (retry) khi gọi Gemini API gặp lỗi Quota (429) hoặc lỗi tạm thời.
+    - Hàm async: chờ bằng asyncio.sleep (không block event loop), xem retry_async.
+    - Hàm sync (chạy trong thread): chờ bằng time.sleep như cũ, có jitter.
+    Thời gian chờ: exponential backoff có jitter, hoặc theo retry-after nếu server gợi ý.
+
     Cách dùng:
     @with_gemini_retry()
-    def call_gemini_api():
+    async def call_gemini_api():
         ...
     """
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await retry_async(
+                    func, *args,
+                    max_retries=max_retries, initial_delay=initial_delay, max_delay=max_delay,
+                    backoff_factor=backoff_factor, deadline=deadline, label=func.__name__, **kwargs
+                )
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            delay = initial_delay
-            
-            for attempt in range(1, max_retries + 1):
+            stop_at = time.monotonic() + deadline
+            attempt = 0
+            while True:
+                attempt += 1
                 try:
                     return func(*args, **kwargs)
-                
-                except (ResourceExhausted, TooManyRequests, ServiceUnavailable) as e:
-                    # Nếu là lần thử cuối cùng thì ném lỗi ra luôn
-                    if attempt == max_retries:
-                        logger.error(f"❌ Gemini API Failed after {max_retries} attempts. Error: {e}")
-                        raise e
-                    
-                    # Log cảnh báo và chờ
-                    logger.warning(f"⚠️ Gemini Quota Exceeded (429). Retrying in {delay}s... (Attempt {attempt}/{max_retries})")
-                    time.sleep(delay)
-                    
-                    # Tăng thời gian chờ cho lần sau
-                    delay *= backoff_factor
-                
                 except Exception as e:
-                    # Các lỗi khác (Code lỗi, logic sai...) thì không retry
-                    raise e
-            return None
+                    reason = retry_reason(e)
+                    if reason is None:
+                        # Các lỗi khác (Code lỗi, logic sai...) thì không retry
+                        raise
+                    delay = backoff_delay(attempt, initial_delay, max_delay, e, backoff_factor)
+                    if attempt >= max_retries or time.monotonic() + delay >= stop_at:
+                        metrics.increment("gemini_retry_exhausted", label=func.__name__, reason=reason)
+                        logger.error(f"❌ Gemini API Failed after {attempt} attempts. Error: {e}")
+                        raise
+                    metrics.increment("gemini_retry_attempts", label=func.__name__, reason=reason)
+                    logger.warning(f"⚠️ Gemini {reason}. Retrying in {delay:.1f}s... (Attempt {attempt}/{max_retries})")
+                    time.sleep(delay)
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,293 @@
+import json
+import logging
+from typing import Any, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import TypeAdapter, ValidationError
+
+T = TypeVar("T")
+logger = logging.getLogger(__name__)
+
+_SIMPLE_ESCAPES = {
+    '"': '"', '\\': '\\', '/': '/',
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+}
+
+
+class JsonFieldStreamer:
+    """
+    Trích xuất dần giá trị chuỗi của MỘT field cấp 1 trong JSON đang được stream.
+
+    Model trả về từng chunk text (có thể kèm ```json, có thể cắt giữa escape).
+    Mỗi lần feed(chunk) trả về phần ký tự MỚI đã giải mã của field đó, nhờ vậy
+    có thể đẩy từng token của "reply" cho client trước khi JSON hoàn chỉnh.
+
+    Ví dụ:
+        streamer = JsonFieldStreamer("reply")
+        for chunk in chunks:
+            delta = streamer.feed(chunk)
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buf = ""
+        self._last_key: Optional[str] = None
+        self._after_colon = False
+        self._capturing = False
+        self._unicode: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        for c in chunk:
+            if self.done:
+                break
+            if self._capturing:
+                self._feed_value(c, out)
+            elif self._in_string:
+                self._feed_string(c)
+            else:
+                self._feed_structure(c)
+        return "".join(out)
+
+    # --- Bên trong giá trị cần lấy ---
+    def _feed_value(self, c: str, out: list) -> None:
+        if self._unicode is not None:
+            self._unicode += c
+            if len(self._unicode) == 4:
+                self._emit_codepoint(int(self._unicode, 16), out)
+                self._unicode = None
+            return
+        if self._escape:
+            self._escape = False
+            if c == 'u':
+                self._unicode = ""
+            else:
+                out.append(_SIMPLE_ESCAPES.get(c, c))
+            return
+        if c == '\\':
+            self._escape = True
+        elif c == '"':
+            self._capturing = False
+            self.done = True
+        else:
+            out.append(c)
+
+    def _emit_codepoint(self, code: int, out: list) -> None:
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        out.append(chr(code))
+
+    # --- Chuỗi khác (key hoặc value không cần lấy) ---
+    def _feed_string(self, c: str) -> None:
+        if self._escape:
+            self._escape = False
+            self._buf += _SIMPLE_ESCAPES.get(c, c)
+        elif c == '\\':
+            self._escape = True
+        elif c == '"':
+            self._in_string = False
+            if self._depth == 1 and not self._after_colon:
+                self._last_key = self._buf
+            self._after_colon = False
+        else:
+            self._buf += c
+
+    # --- Cấu trúc JSON (ngoài chuỗi) ---
+    def _feed_structure(self, c: str) -> None:
+        if c == '"':
+            if self._depth < 1:
+                return  # Bỏ qua prose / fence trước object
+            if self._depth == 1 and self._after_colon and self._last_key == self.field:
+                self._capturing = True
+                self._after_colon = False
+                return
+            self._in_string = True
+            self._buf = ""
+        elif c in '{[':
+            self._depth += 1
+            self._after_colon = False
+        elif c in '}]':
+            self._depth -= 1
+            self._after_colon = False
+        elif c == ':' and self._depth == 1:
+            self._after_colon = True
+        elif c == ',':
+            self._after_colon = False
+
+
+# =====================================================================
+# Trích xuất JSON "chịu lỗi" từ output của model
+# =====================================================================
+class JsonExtractionError(ValueError):
+    """Không tìm được JSON hợp lệ trong output của model."""
+
+
+def _scan(fragment: str) -> Tuple[bool, bool, List[str], List[int]]:
+    """Quét fragment: (đang trong chuỗi?, escape dở?, stack ký tự đóng, vị trí dấu phẩy cấu trúc)."""
+    in_string = False
+    escape = False
+    stack: List[str] = []
+    commas: List[int] = []
+    for i, c in enumerate(fragment):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c == '{':
+            stack.append('}')
+        elif c == '[':
+            stack.append(']')
+        elif c in '}]':
+            if stack:
+                stack.pop()
+        elif c == ',':
+            commas.append(i)
+    return in_string, escape, stack, commas
+
+
+def _balanced_end(text: str, start: int) -> int:
+    """Vị trí ngay sau object/array cân bằng bắt đầu tại start, -1 nếu bị cắt cụt."""
+    in_string = False
+    escape = False
+    depth = 0
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in '{[':
+            depth += 1
+        elif c in '}]':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+
+def _repair_truncated(fragment: str) -> Any:
+    """
+    Hoàn thiện JSON bị cắt cụt: đóng chuỗi đang mở, bỏ key/value dở dang,
+    đóng các ngoặc còn mở. Trả về phần dữ liệu đã có (partial).
+    """
+    candidate = fragment
+    for _ in range(64):
+        in_string, escape, stack, commas = _scan(candidate)
+        attempt = candidate
+        if in_string:
+            attempt = (attempt[:-1] if escape else attempt) + '"'
+        attempt = attempt.rstrip().rstrip(',')
+        if attempt.endswith(':'):
+            attempt += ' null'
+        try:
+            return json.loads(attempt + "".join(reversed(stack)))
+        except ValueError:
+            if not commas:
+                break
+            candidate = candidate[:commas[-1]]
+    raise JsonExtractionError("Truncated JSON could not be repaired.")
+
+
+def extract_json(text: str, expect: Optional[type] = None, allow_partial: bool = True) -> Any:
+    """
+    Lấy JSON đầu tiên trong output của model.
+    - Chấp nhận ```json fence, lời dẫn trước và text thừa phía sau.
+    - expect=dict / list: chỉ nhận object / array.
+    - allow_partial: nếu output bị cắt cụt thì trả về các field đã đầy đủ (và chuỗi dở dang).
+    Raise JsonExtractionError nếu không tìm được.
+    """
+    if text is None:
+        raise JsonExtractionError("Empty model output.")
+
+    # Đường nhanh: output sạch (hoặc chỉ bọc fence)
+    cleaned = text.strip().replace("```json", "").replace("```", "").strip()
+    try:
+        data = json.loads(cleaned)
+        if expect is None or isinstance(data, expect):
+            return data
+    except ValueError:
+        pass
+
+    openers = "{" if expect is dict else "[" if expect is list else "{["
+    start = next((i for i, c in enumerate(text) if c in openers), -1)
+    while start != -1:
+        end = _balanced_end(text, start)
+        if end == -1:
+            if allow_partial:
+                return _repair_truncated(text[start:].replace("```", ""))
+            break
+        try:
+            return json.loads(text[start:end])
+        except ValueError:
+            # Cặp ngoặc này không phải JSON (vd: "[note]" trong lời dẫn), thử vị trí tiếp theo
+            start = next((i for i in range(start + 1, len(text)) if text[i] in openers), -1)
+    raise JsonExtractionError(f"No JSON found in model output: {text[:200]!r}")
+
+
+def parse_llm_output(text: str, schema: Type[T] | Any, allow_partial: bool = False) -> T:
+    """
+    extract_json + validate bằng pydantic (schema có thể là BaseModel hoặc kiểu như List[Model]).
+    Raise JsonExtractionError hoặc pydantic.ValidationError (đều là ValueError).
+    """
+    return TypeAdapter(schema).validate_python(extract_json(text, allow_partial=allow_partial))
+
+
+def parse_llm_items(text: str, item_schema: Type[T]) -> List[T]:
+    """
+    Lấy mảng JSON HOÀN CHỈNH (output bị cắt cụt -> JsonExtractionError, vì bản vá có thể giữ chuỗi dở dang)
+    rồi validate từng phần tử; phần tử thiếu / sai field bị bỏ qua.
+    Dùng cho các danh sách sẽ được ghi vào DB.
+    """
+    adapter = TypeAdapter(item_schema)
+    items = []
+    for raw in extract_json(text, expect=list, allow_partial=False):
+        try:
+            items.append(adapter.validate_python(raw))
+        except ValidationError as e:
+            logger.warning(f"[JSON] Dropping invalid {getattr(item_schema, '__name__', item_schema)} item: {e.error_count()} error(s)")
+    return items
+
+
+class IncrementalJsonParser:
+    """
+    Gom output stream của model và cho phép đọc bản parse tốt nhất tại mọi thời điểm
+    (các field đã hoàn chỉnh + chuỗi đang viết dở). Dùng kèm JsonFieldStreamer khi cần
+    nhiều field cùng lúc.
+    """
+
+    def __init__(self, expect: Optional[type] = dict):
+        self.expect = expect
+        self._chunks: List[str] = []
+
+    def feed(self, chunk: str) -> None:
+        self._chunks.append(chunk or "")
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def current(self) -> Any:
+        try:
+            return extract_json(self.text, expect=self.expect, allow_partial=True)
+        except JsonExtractionError:
+            return None
@@ -0,0 +1,160 @@
+"""
+Xác thực access token của Supabase ngay trong process (không gọi Supabase Auth mỗi request).
+
+- HS256: ký bằng JWT secret của project (SUPABASE_JWT_SECRET).
+- RS256 / ES256 (signing keys mới): public key lấy từ JWKS của project
+  ({SUPABASE_URL}/auth/v1/.well-known/jwks.json), cache và tự làm mới sau JWKS_REFRESH_SECONDS.
+- Kiểm tra chữ ký, exp, aud (SUPABASE_JWT_AUDIENCE) và iss.
+- Token đã xác thực được cache theo hash tới đúng thời điểm exp.
+
+verify() trả về None khi không tự xác thực được (chưa cấu hình key, lỗi tải JWKS, chữ ký không khớp...):
+dependencies.get_current_user khi đó gọi db_client.auth.get_user như cũ rồi remember() kết quả.
+Lưu ý: user_metadata lấy từ claims nên chỉ cập nhật khi client refresh token.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import jwt
+from cachetools import TLRUCache
+from dotenv import load_dotenv
+
+from fastapi_app.utils import metrics
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SUPABASE_URL = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_URL = os.getenv("SUPABASE_JWKS_URL") or (f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None)
+JWKS_REFRESH_SECONDS = int(os.getenv("JWKS_REFRESH_SECONDS", "600"))
+# Độ lệch đồng hồ cho phép khi kiểm tra exp / iat (giây)
+JWT_LEEWAY_SECONDS = int(os.getenv("JWT_LEEWAY_SECONDS", "5"))
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_LOCAL_VERIFY = os.getenv("JWT_LOCAL_VERIFY", "1") != "0"
+
+_ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+
+@dataclass
+class VerifiedUser:
+    """User lấy từ claims của token; cùng các thuộc tính hay dùng với User của supabase-py."""
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+    user_metadata: Dict[str, Any] = field(default_factory=dict)
+    app_metadata: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_claims(cls, claims: Dict[str, Any]) -> "VerifiedUser":
+        return cls(
+            id=claims["sub"],
+            email=claims.get("email"),
+            role=claims.get("role"),
+            user_metadata=claims.get("user_metadata") or {},
+            app_metadata=claims.get("app_metadata") or {},
+        )
+
+
+class TokenExpired(Exception):
+    """Token hết hạn: trả 401 ngay, không cần hỏi lại Supabase."""
+
+
+@dataclass(frozen=True)
+class _Entry:
+    user: Any
+    expires_at: float  # exp của token (epoch giây)
+
+
+# Mỗi entry sống tới exp của chính token đó
+_verified: TLRUCache = TLRUCache(maxsize=JWT_CACHE_SIZE, ttu=lambda _key, entry, _now: entry.expires_at, timer=time.time)
+_lock = threading.Lock()
+_jwks_client: Optional[jwt.PyJWKClient] = None
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _get_jwks_client() -> Optional[jwt.PyJWKClient]:
+    global _jwks_client
+    if _jwks_client is None and JWKS_URL:
+        # PyJWKClient tự cache bộ key (lifespan) và tải lại khi gặp kid lạ (key vừa xoay vòng)
+        _jwks_client = jwt.PyJWKClient(JWKS_URL, cache_jwk_set=True, lifespan=JWKS_REFRESH_SECONDS, timeout=5)
+    return _jwks_client
+
+
+def _signing_key(token: str) -> Optional[Any]:
+    """Key để kiểm tra chữ ký theo alg trong header; None nếu không có key phù hợp."""
+    alg = jwt.get_unverified_header(token).get("alg")
+    if alg == "HS256":
+        return SUPABASE_JWT_SECRET
+    if alg in _ASYMMETRIC_ALGORITHMS:
+        client = _get_jwks_client()
+        return client.get_signing_key_from_jwt(token).key if client else None
+    return None
+
+
+def cached_user(token: str) -> Optional[Any]:
+    with _lock:
+        entry = _verified.get(_token_key(token))
+    return entry.user if entry else None
+
+
+def remember(token: str, user: Any) -> None:
+    """Cache user (đã xác thực, kể cả qua Supabase Auth) tới exp của token."""
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        return
+    if not exp or exp <= time.time():
+        return
+    with _lock:
+        _verified[_token_key(token)] = _Entry(user, float(exp))
+
+
+def verify(token: str) -> Optional[Any]:
+    """
+    User của token nếu xác thực được tại chỗ (hoặc đã có trong cache).
+    Raise TokenExpired nếu token hết hạn; None nếu cần hỏi lại Supabase Auth.
+    """
+    user = cached_user(token)
+    if user is not None:
+        metrics.increment("auth_verify", result="cache")
+        return user
+    if not JWT_LOCAL_VERIFY:
+        return None
+
+    try:
+        key = _signing_key(token)
+        if key is None:
+            metrics.increment("auth_verify", result="no_key")
+            return None
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=["HS256", *_ASYMMETRIC_ALGORITHMS],
+            audience=SUPABASE_JWT_AUDIENCE,
+            issuer=f"{SUPABASE_URL}/auth/v1" if SUPABASE_URL else None,
+            leeway=JWT_LEEWAY_SECONDS,
+            options={"require": ["exp", "sub"]},
+        )
+    except jwt.ExpiredSignatureError:
+        metrics.increment("auth_verify", result="expired")
+        raise TokenExpired()
+    except (jwt.InvalidTokenError, jwt.PyJWKClientError) as e:
+        # Có thể do cấu hình key sai / JWKS chưa kịp cập nhật: để Supabase Auth quyết định
+        metrics.increment("auth_verify", result="local_failed")
+        logger.info(f"[JWT] Local verification failed ({e.__class__.__name__}), falling back to Supabase Auth")
+        return None
+
+    user = VerifiedUser.from_claims(claims)
+    with _lock:
+        _verified[_token_key(token)] = _Entry(user, float(claims["exp"]))
+    metrics.increment("auth_verify", result="local")
+    return user
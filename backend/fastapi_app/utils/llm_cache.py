@@ -0,0 +1,174 @@
+"""
+Cache response của LLM theo (model, prompt đã chuẩn hóa).
+
+- Mỗi "family" prompt có TTL riêng và số biến thể (variants) riêng.
+- Bộ nhớ: LRU giới hạn kích thước (LLM_CACHE_SIZE).
+- Tùy chọn tầng đĩa: đặt LLM_CACHE_DIR để cache sống qua restart / dùng chung giữa worker.
+- Variety mode (variants > 1): gom đủ K câu trả lời khác nhau rồi xoay vòng,
+  để người dùng không nhận mãi một câu chào / một bộ câu hỏi.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import anyio
+from cachetools import LRUCache
+
+from fastapi_app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")  # Không đặt = chỉ cache trong RAM
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+
+
+@dataclass(frozen=True)
+class CacheFamily:
+    ttl: float         # giây
+    variants: int = 1  # > 1: variety mode
+
+
+# Các prompt chỉ phụ thuộc vào vài tham số nhỏ (level, topic, preferences)
+FAMILIES: Dict[str, CacheFamily] = {
+    "greeting": CacheFamily(ttl=6 * 3600, variants=5),        # get_start_conversation_prompt
+    "deck_vocab": CacheFamily(ttl=24 * 3600, variants=3),     # build_topic_generation_prompt
+    "grammar_quiz": CacheFamily(ttl=6 * 3600, variants=3),    # build_quiz_prompt
+    "diagnostic_test": CacheFamily(ttl=6 * 3600, variants=3), # build_quiz_test_prompt
+}
+
+_memory: LRUCache = LRUCache(maxsize=LLM_CACHE_SIZE)
+_lock = threading.Lock()
+
+
+def _normalize(contents: Any) -> Optional[str]:
+    """Chỉ cache prompt dạng text (str hoặc list[str]); khoảng trắng được gộp lại."""
+    if isinstance(contents, str):
+        parts = [contents]
+    elif isinstance(contents, (list, tuple)) and all(isinstance(c, str) for c in contents):
+        parts = list(contents)
+    else:
+        return None
+    return "\n".join(re.sub(r"\s+", " ", p).strip() for p in parts)
+
+
+def cache_key(family: str, model: str, contents: Any) -> Optional[str]:
+    normalized = _normalize(contents)
+    if normalized is None:
+        return None
+    digest = hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+    return f"{family}:{digest}"
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(LLM_CACHE_DIR, key.replace(":", "_") + ".json")
+
+
+def _read_disk(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_disk_path(key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"[LLM Cache] Disk read failed for {key}: {e}")
+        return None
+
+
+def _write_disk(key: str, entry: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        tmp_path = _disk_path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, _disk_path(key))
+    except Exception as e:
+        logger.warning(f"[LLM Cache] Disk write failed for {key}: {e}")
+
+
+def _load_entry(key: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+    with _lock:
+        entry = _memory.get(key)
+    if entry is None and LLM_CACHE_DIR:
+        entry = _read_disk(key)
+        if entry is not None:
+            with _lock:
+                _memory[key] = entry
+    # Entry hết hạn vẫn giữ lại (LRU tự dọn) để làm fallback stale khi Gemini lỗi
+    if entry is not None and not allow_stale and entry["expires_at"] <= time.time():
+        return None
+    return entry
+
+
+async def get(family: str, model: str, contents: Any) -> Optional[str]:
+    """
+    Trả về text đã cache, hoặc None nếu cần gọi LLM
+    (chưa có, đã hết hạn, hoặc variety mode chưa gom đủ biến thể).
+    """
+    conf = FAMILIES.get(family)
+    key = cache_key(family, model, contents)
+    if not LLM_CACHE_ENABLED or conf is None or key is None:
+        return None
+
+    entry = await anyio.to_thread.run_sync(_load_entry, key)
+    if entry is None or len(entry["variants"]) < conf.variants:
+        metrics.increment("llm_cache", family=family, result="miss")
+        return None
+
+    with _lock:
+        index = entry.get("next", 0) % len(entry["variants"])
+        entry["next"] = index + 1
+    metrics.increment("llm_cache", family=family, result="hit")
+    return entry["variants"][index]
+
+
+async def get_stale(family: str, model: str, contents: Any) -> Optional[str]:
+    """
+    Fallback khi Gemini lỗi / bị ngắt mạch: trả về bất kỳ biến thể nào đã có,
+    kể cả khi đã hết hạn hoặc chưa gom đủ biến thể.
+    """
+    key = cache_key(family, model, contents)
+    if not LLM_CACHE_ENABLED or family not in FAMILIES or key is None:
+        return None
+    entry = await anyio.to_thread.run_sync(lambda: _load_entry(key, allow_stale=True))
+    if not entry or not entry["variants"]:
+        return None
+    with _lock:
+        index = entry.get("next", 0) % len(entry["variants"])
+        entry["next"] = index + 1
+    metrics.increment("llm_cache", family=family, result="stale")
+    return entry["variants"][index]
+
+
+async def put(family: str, model: str, contents: Any, text: str) -> None:
+    """Lưu 1 câu trả lời (variety mode: thêm vào danh sách biến thể, tối đa K)."""
+    conf = FAMILIES.get(family)
+    key = cache_key(family, model, contents)
+    if not LLM_CACHE_ENABLED or conf is None or key is None or not text:
+        return
+
+    def _store():
+        entry = _load_entry(key)
+        with _lock:
+            if entry is None:
+                entry = {"variants": [], "next": 0, "expires_at": time.time() + conf.ttl}
+            variants: List[str] = entry["variants"]
+            if text not in variants:
+                variants.append(text)
+                del variants[:-conf.variants]
+            _memory[key] = entry
+        if LLM_CACHE_DIR:
+            _write_disk(key, entry)
+
+    await anyio.to_thread.run_sync(_store)
+
+
+def clear() -> None:
+    with _lock:
+        _memory.clear()
@@ -0,0 +1,27 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+# Bộ đếm đơn giản trong process: (tên, nhãn) -> giá trị. Xem qua GET /admin/metrics.
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+_lock = threading.Lock()
+
+
+def increment(name: str, value: float = 1, **labels) -> None:
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _counters[key] += value
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """
+    Trả về {tên: {"nhãn=giá trị,...": giá trị}}. Ví dụ:
+        {"gemini_retry_attempts": {"model=gemini-2.5-flash,reason=429": 3}}
+    """
+    result: Dict[str, Dict[str, float]] = {}
+    with _lock:
+        items = list(_counters.items())
+    for (name, labels), value in items:
+        label_key = ",".join(f"{k}={v}" for k, v in labels) or "total"
+        result.setdefault(name, {})[label_key] = value
+    return result
@@ -0,0 +1,34 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+# Cache role / status của profiles cho kiểm tra quyền (get_admin_user_id).
+# Ghi qua crud.admin_users thì bị xóa ngay; TTL ngắn chặn độ trễ khi ghi ở nơi khác (worker khác, SQL trực tiếp).
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "60"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "4096"))
+
+_shared: Optional[TTLCache] = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL) if PROFILE_CACHE_TTL > 0 else None
+_lock = threading.Lock()
+
+
+def get(user_id: str) -> Optional[Dict[str, Any]]:
+    if _shared is None:
+        return None
+    with _lock:
+        row = _shared.get(user_id)
+    return dict(row) if row is not None else None
+
+
+def put(user_id: str, row: Dict[str, Any]) -> None:
+    if _shared is not None:
+        with _lock:
+            _shared[user_id] = dict(row)
+
+
+def invalidate(user_id: str) -> None:
+    """Gọi sau mọi thao tác đổi role / status / xóa user."""
+    if _shared is not None:
+        with _lock:
+            _shared.pop(user_id, None)
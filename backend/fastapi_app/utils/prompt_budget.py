@@ -0,0 +1,233 @@
+"""
+Đếm token và giới hạn kích thước prompt theo họ prompt (prompt family = task trong model_routing).
+
+- Ước lượng token trước khi gửi (estimate_tokens, ~CHARS_PER_TOKEN ký tự / token), đủ để cắt gọn đầu vào.
+- Ngân sách token theo family (PROMPT_BUDGETS), ghi đè bằng biến môi trường:
+    PROMPT_BUDGETS="session_summary=4000,roadmap_adjustment=2500"
+- Thu gọn đầu vào: compact_json (JSON minified, cắt chuỗi/list dài nếu vượt ngân sách),
+  fit_lines (giữ đầu + đuôi transcript, bỏ đoạn giữa).
+- Ghi nhận token thực tế (usage_metadata của Gemini) theo family, endpoint và user:
+  metrics llm_prompt_tokens / llm_output_tokens (nhãn task, endpoint) và top user trong snapshot().
+
+User / endpoint đi theo contextvar: dependency rate_limited đặt qua set_caller(),
+tác vụ nền bọc trong caller(user_id=...).
+"""
+import os
+import json
+import math
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+from fastapi_app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Số ký tự trung bình / token (tiếng Anh ~4; prompt có nhiều tiếng Việt thì nên đặt thấp hơn)
+CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+# Ngân sách mặc định cho family không khai báo riêng
+DEFAULT_BUDGET = int(os.getenv("PROMPT_DEFAULT_BUDGET", "8000"))
+# Số user được giữ bộ đếm riêng (user lâu không gọi sẽ bị bỏ sau PROMPT_USAGE_TTL giây)
+PROMPT_USAGE_USERS = int(os.getenv("PROMPT_USAGE_USERS", "10000"))
+PROMPT_USAGE_TTL = float(os.getenv("PROMPT_USAGE_TTL", str(24 * 3600)))
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    budgets = {}
+    for item in raw.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            try:
+                budgets[name.strip()] = int(value)
+            except ValueError:
+                logger.warning(f"[Prompt Budget] Invalid budget override: {item}")
+    return budgets
+
+
+# Ngân sách token cho toàn bộ prompt (template + dữ liệu) theo family
+PROMPT_BUDGETS: Dict[str, int] = {
+    "session_summary": 6000,      # get_summary_prompt: transcript cả buổi
+    "context_summary": 3000,      # rolling summary
+    "roadmap": 4000,              # build_roadmap_prompt
+    "roadmap_adjustment": 4000,   # build_roadmap_adjustment_prompt: summary tuần N + tuần N+1
+}
+PROMPT_BUDGETS.update(_parse_budgets(os.getenv("PROMPT_BUDGETS", "")))
+
+
+def budget_for(family: str) -> int:
+    return PROMPT_BUDGETS.get(family, DEFAULT_BUDGET)
+
+
+# ================================================================
+#  ƯỚC LƯỢNG TOKEN
+# ================================================================
+def estimate_tokens(contents: Any) -> int:
+    """Ước lượng số token của phần text trong contents (str, list, Content dict); audio/file không tính."""
+    return math.ceil(_text_length(contents) / CHARS_PER_TOKEN)
+
+
+def _text_length(contents: Any) -> int:
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return len(contents)
+    if isinstance(contents, (list, tuple)):
+        return sum(_text_length(c) for c in contents)
+    if isinstance(contents, dict):
+        if "text" in contents:
+            return _text_length(contents["text"])
+        return _text_length(contents.get("parts"))
+    return _text_length(getattr(contents, "text", None))
+
+
+# ================================================================
+#  THU GỌN ĐẦU VÀO
+# ================================================================
+def compact_json(data: Any, max_tokens: Optional[int] = None) -> str:
+    """
+    JSON minified (không indent, không khoảng trắng thừa). Nếu vẫn vượt max_tokens thì cắt dần
+    chuỗi dài và list dài (giữ phần đầu, đánh dấu phần bị bỏ) cho tới khi vừa.
+    """
+    text = _dumps(data)
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+
+    max_str, max_items = 400, 20
+    while max_str >= 40 or max_items >= 2:
+        text = _dumps(_shrink(data, max_str, max_items))
+        if estimate_tokens(text) <= max_tokens:
+            break
+        max_str, max_items = max_str // 2, max_items // 2
+    metrics.increment("prompt_budget_trimmed", kind="json")
+    return text
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _shrink(data: Any, max_str: int, max_items: int) -> Any:
+    if isinstance(data, str):
+        return data if len(data) <= max_str else data[:max_str] + "…"
+    if isinstance(data, dict):
+        return {k: _shrink(v, max_str, max_items) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        items = [_shrink(v, max_str, max_items) for v in data[:max(max_items, 1)]]
+        if len(data) > len(items):
+            items.append(f"... {len(data) - len(items)} more")
+        return items
+    return data
+
+
+def fit_lines(lines: List[str], max_tokens: int, head: int = 4) -> str:
+    """
+    Ghép các dòng (transcript) trong max_tokens: giữ `head` dòng đầu (bối cảnh mở đầu)
+    và càng nhiều dòng cuối càng tốt, đoạn giữa thay bằng 1 dòng đánh dấu.
+    """
+    text = "\n".join(lines)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    budget_chars = max_tokens * CHARS_PER_TOKEN
+    kept_head: List[str] = []
+    used = 0
+    for line in lines[:head]:
+        if used + len(line) + 1 > budget_chars / 3:  # Phần đầu không chiếm quá 1/3 ngân sách
+            break
+        kept_head.append(line)
+        used += len(line) + 1
+
+    kept_tail: List[str] = []
+    for line in reversed(lines[len(kept_head):]):
+        if used + len(line) + 1 > budget_chars:
+            break
+        kept_tail.append(line)
+        used += len(line) + 1
+    kept_tail.reverse()
+
+    omitted = len(lines) - len(kept_head) - len(kept_tail)
+    metrics.increment("prompt_budget_trimmed", kind="lines")
+    return "\n".join(kept_head + [f"[... {omitted} earlier lines omitted ...]"] + kept_tail)
+
+
+# ================================================================
+#  NGƯỜI GỌI (CONTEXTVAR)
+# ================================================================
+_caller: contextvars.ContextVar[Tuple[Optional[str], Optional[str]]] = contextvars.ContextVar(
+    "prompt_caller", default=(None, None)
+)
+
+
+def set_caller(user_id: Optional[str], endpoint: Optional[str]) -> None:
+    """Gắn user / endpoint cho các lời gọi LLM còn lại của request hiện tại."""
+    _caller.set((user_id, endpoint))
+
+
+@contextmanager
+def caller(user_id: Optional[str] = None, endpoint: Optional[str] = None):
+    """Như set_caller nhưng trong 1 khối; giá trị None giữ nguyên giá trị đang có."""
+    current_user, current_endpoint = _caller.get()
+    token = _caller.set((user_id or current_user, endpoint or current_endpoint))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+# ================================================================
+#  GHI NHẬN
+# ================================================================
+_user_usage: TTLCache = TTLCache(maxsize=PROMPT_USAGE_USERS, ttl=PROMPT_USAGE_TTL)
+_lock = threading.Lock()
+
+
+def check(family: str, contents: Any) -> int:
+    """Ước lượng token của prompt trước khi gửi; vượt ngân sách thì ghi metrics + log (không chặn)."""
+    tokens = estimate_tokens(contents)
+    budget = budget_for(family)
+    if tokens > budget:
+        metrics.increment("llm_prompt_over_budget", task=family)
+        logger.warning(f"[Prompt Budget] '{family}' prompt ~{tokens} tokens exceeds budget {budget}")
+    return tokens
+
+
+def record_usage(family: str, prompt_tokens: int, output_tokens: int = 0) -> None:
+    """Cộng token vào bộ đếm theo family + endpoint (metrics) và theo user (snapshot)."""
+    user_id, endpoint = _caller.get()
+    endpoint = endpoint or "background"
+    metrics.increment("llm_prompt_tokens", prompt_tokens, task=family, endpoint=endpoint)
+    if output_tokens:
+        metrics.increment("llm_output_tokens", output_tokens, task=family, endpoint=endpoint)
+    if not user_id:
+        return
+    with _lock:
+        usage = _user_usage.get(user_id)
+        if usage is None:
+            usage = Counter()
+        usage[family] += prompt_tokens + output_tokens
+        _user_usage[user_id] = usage
+
+
+def usage_tokens(response: Any, fallback_prompt_tokens: int) -> Tuple[int, int]:
+    """(prompt, output) token từ usage_metadata của response Gemini; không có thì dùng ước lượng."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or fallback_prompt_tokens
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    if output_tokens is None:
+        output_tokens = estimate_tokens(getattr(response, "text", None) or "")
+    return prompt_tokens, output_tokens
+
+
+def snapshot(top: int = 20) -> Dict[str, Any]:
+    with _lock:
+        totals = [(user_id, sum(usage.values()), dict(usage)) for user_id, usage in _user_usage.items()]
+    totals.sort(key=lambda item: item[1], reverse=True)
+    return {
+        "budgets": dict(PROMPT_BUDGETS),
+        "top_users": [{"user_id": u, "tokens": total, "by_task": by_task} for u, total, by_task in totals[:top]],
+    }
@@ -0,0 +1,61 @@
+import os
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+# TTL (giây) của cache dùng chung giữa các request. Đặt 0 để tắt, chỉ giữ identity map theo request.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "30"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "2048"))
+
+# Identity map theo request: cùng 1 request chỉ đọc 1 dòng conversation_sessions 1 lần
+_request_sessions: ContextVar[Optional[Dict[str, Dict[str, Any]]]] = ContextVar("request_sessions", default=None)
+
+_shared: Optional[TTLCache] = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL) if SESSION_CACHE_TTL > 0 else None
+_lock = threading.Lock()
+
+
+def begin_request():
+    """Mở identity map cho request hiện tại. Trả về token để reset khi request kết thúc."""
+    return _request_sessions.set({})
+
+
+def end_request(token) -> None:
+    _request_sessions.reset(token)
+
+
+def get(session_id: str) -> Optional[Dict[str, Any]]:
+    """Lấy dòng session đã cache (bản sao), ưu tiên identity map của request."""
+    identity_map = _request_sessions.get()
+    if identity_map is not None and session_id in identity_map:
+        return dict(identity_map[session_id])
+
+    row = None
+    if _shared is not None:
+        with _lock:
+            row = _shared.get(session_id)
+
+    if row is not None and identity_map is not None:
+        identity_map[session_id] = row
+    return dict(row) if row is not None else None
+
+
+def put(session_id: str, row: Dict[str, Any]) -> None:
+    row = dict(row)
+    identity_map = _request_sessions.get()
+    if identity_map is not None:
+        identity_map[session_id] = row
+    if _shared is not None:
+        with _lock:
+            _shared[session_id] = row
+
+
+def invalidate(session_id: str) -> None:
+    """Gọi sau mọi thao tác ghi vào session (append, summary, delete)."""
+    identity_map = _request_sessions.get()
+    if identity_map is not None:
+        identity_map.pop(session_id, None)
+    if _shared is not None:
+        with _lock:
+            _shared.pop(session_id, None)
@@ -0,0 +1,100 @@
+"""
+Single-flight: các lời gọi đồng thời cùng key chỉ thực hiện 1 lần gọi upstream,
+những lời gọi còn lại chờ và dùng chung kết quả (hoặc lỗi).
+
+    greetings = SingleFlight("llm")
+    text = await greetings.do(key, lambda: call_llm(...))
+
+    lookups = SyncSingleFlight("word_lookup")   # cho code sync chạy trong threadpool
+    details = lookups.do(word, lambda: fetch(word))
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from fastapi_app.utils import metrics
+
+
+class _Flight:
+    """Lời gọi upstream đang chạy (task riêng) và số caller đang chờ nó."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Bản async (asyncio): chỉ gộp các lời gọi trong cùng event loop."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, _Flight] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._inflight.get(key)
+        if flight is not None:
+            metrics.increment("single_flight", flight=self.name, result="coalesced")
+        else:
+            # func chạy trong task riêng: caller đầu tiên bị hủy không kéo theo những caller khác
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            metrics.increment("single_flight", flight=self.name, result="leader")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Không còn ai chờ (mọi caller đều đã bị hủy): dừng lời gọi upstream
+                self._discard(key, flight)
+                flight.task.cancel()
+
+    def _discard(self, key: Hashable, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def _finish(self, key: Hashable, flight: _Flight) -> None:
+        self._discard(key, flight)
+        if not flight.task.cancelled():
+            flight.task.exception()  # Đánh dấu đã đọc để không log "exception was never retrieved"
+
+
+class SyncSingleFlight:
+    """Bản sync (threading) cho các hàm blocking chạy trong threadpool."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Tuple[threading.Event, Dict[str, Any]]] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = (threading.Event(), {})
+                self._inflight[key] = call
+        done, outcome = call
+
+        if not is_leader:
+            metrics.increment("single_flight", flight=self.name, result="coalesced")
+            done.wait()
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["result"]
+
+        metrics.increment("single_flight", flight=self.name, result="leader")
+        try:
+            outcome["result"] = func()
+            return outcome["result"]
+        except BaseException as e:
+            outcome["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()